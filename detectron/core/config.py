@@ -135,6 +135,17 @@ __C.TRAIN.PROPOSAL_FILES = ()
 # faster)
 __C.TRAIN.ASPECT_GROUPING = True
 
+# Boundaries of the aspect ratio (height / width) bins used by ASPECT_GROUPING
+# (e.g., (0.5, 0.75, 1.0, 1.5, 2.0)): minibatches are made from images in the
+# same bin, which are padded less to the shape of the minibatch blob
+# If empty, images are only grouped into horizontal and vertical images
+__C.TRAIN.ASPECT_RATIO_BINS = ()
+
+# Use one scale (sampled from TRAIN.SCALES) for all images of a minibatch
+# instead of one per image, so that images of similar aspect ratios are resized
+# to similar shapes and are padded less to the shape of the minibatch blob
+__C.TRAIN.SCALE_PER_MINIBATCH = False
+
 # ---------------------------------------------------------------------------- #
 # RPN training options
 # ---------------------------------------------------------------------------- #
@@ -171,6 +182,13 @@ __C.TRAIN.RPN_POST_NMS_TOP_N = 2000
 # Set to -1 or a large value, e.g. 100000, to disable pruning anchors
 __C.TRAIN.RPN_STRADDLE_THRESH = 0
 
+# Match anchors to ground-truth boxes (for RPN and RetinaNet targets) by only
+# computing the overlaps of anchor / gt box pairs that can overlap, found from
+# the position of the gt boxes on the grid of anchors, instead of computing
+# the overlaps of all anchors with all gt boxes. The resulting labels and
+# targets are identical.
+__C.TRAIN.SPARSE_ANCHOR_MATCHING = True
+
 # Proposal height and width both need to be greater than RPN_MIN_SIZE
 # (at orig image scale; not scale used during training or inference)
 __C.TRAIN.RPN_MIN_SIZE = 0
@@ -207,6 +225,104 @@ __C.DATA_LOADER.MINIBATCH_QUEUE_SIZE = 64
 # Capacity of the per GPU blobs queue
 __C.DATA_LOADER.BLOBS_QUEUE_CAPACITY = 8
 
+# Use worker processes instead of threads to construct minibatches. Minibatch
+# construction (image decoding, anchor labeling, mask rasterization) mostly
+# holds the GIL, so with several GPUs the loader threads may not keep up. When
+# True, DATA_LOADER.NUM_THREADS worker processes are forked and send their
+# minibatch blobs back to the trainer process through shared memory
+__C.DATA_LOADER.USE_PROCESSES = False
+
+# Pass minibatches from the worker processes (DATA_LOADER.USE_PROCESSES) to the
+# enqueue threads through a preallocated ring of shared memory slots, in which
+# the workers build the image blobs, instead of per worker buffers that are
+# copied out by the trainer process. Has no effect with loader threads, which
+# pass their arrays by reference. Each slot is sized from TRAIN.MAX_SIZE and
+# TRAIN.IMS_PER_BATCH
+__C.DATA_LOADER.USE_SHARED_RING = False
+
+# Number of ready minibatches the shared ring holds (when used, the minibatch
+# queue holds at most this many minibatches); the ring has SHARED_RING_SIZE +
+# NUM_THREADS + NUM_GPUS slots
+__C.DATA_LOADER.SHARED_RING_SIZE = 8
+
+# Adapt the number of loader threads (or worker processes) at runtime, between
+# DATA_LOADER.MIN_THREADS and DATA_LOADER.MAX_THREADS starting from NUM_THREADS,
+# to the occupancy of the minibatch queue: a loader is added when the queue
+# drains or stays nearly empty over DATA_LOADER.AUTOSCALE_PERIOD seconds (the
+# GPUs are starved) and one is retired when it stays full. MAX_THREADS loaders
+# are created up front and the retired ones sleep; with worker processes each
+# one has its own shared buffer
+__C.DATA_LOADER.AUTOSCALE = False
+__C.DATA_LOADER.MIN_THREADS = 1
+__C.DATA_LOADER.MAX_THREADS = 8
+__C.DATA_LOADER.AUTOSCALE_PERIOD = 10.0
+
+# Directory of the on-disk cache of prepared training roidbs (see
+# detectron/datasets/roidb_cache.py); caching is disabled if empty
+# Cached roidbs are keyed on the contents of the annotation and proposal files
+# and on the relevant config options, so they are rebuilt when any input
+# changes
+__C.DATA_LOADER.ROIDB_CACHE_DIR = b''
+
+# Store the training roidb in a columnar (struct-of-arrays) layout (see
+# detectron/datasets/columnar_roidb.py) instead of a list of per-image dicts,
+# which substantially reduces its memory footprint and pickling time
+__C.DATA_LOADER.COLUMNAR_ROIDB = False
+
+# Hand the roidb entries of each minibatch to the ops that label the RPN
+# proposals during end-to-end training as roidb indices into the training
+# roidb, registered in a shared store (see detectron/roi_data/roidb_store.py),
+# instead of pickling the entries into the 'roidb' blob
+__C.DATA_LOADER.ROIDB_STORE = False
+
+# When training with TRAIN.USE_FLIPPED, build each horizontally flipped roidb
+# entry only when it is sampled instead of materializing flipped copies of all
+# entries up front
+__C.DATA_LOADER.LAZY_FLIPPED_ROIDB = False
+
+# Number of lazily flipped roidb entries kept in an LRU cache (0 disables the
+# cache)
+__C.DATA_LOADER.FLIPPED_ROIDB_CACHE_SIZE = 0
+
+# Budget (in MB) of the cache of decoded training images (see
+# detectron/roi_data/image_cache.py); 0 disables the cache. A flipped roidb
+# entry shares the cached image of its unflipped counterpart
+__C.DATA_LOADER.IMAGE_CACHE_MB = 0
+
+# If not empty, cached images are stored as memory-mapped .npy files in this
+# directory (ideally on a RAM backed file system such as /dev/shm) and are
+# shared by all loader workers, including worker processes. Otherwise images
+# are cached in the memory of each loader process and shared by its threads
+__C.DATA_LOADER.IMAGE_CACHE_DIR = b''
+
+# Cache images already resized to each of the TRAIN.SCALES instead of at full
+# resolution. This saves memory and the per-sample resize, but images are
+# resized before (instead of after) they are converted to float and have the
+# pixel means subtracted, and before (instead of after) they are flipped, so
+# the resulting blobs differ slightly (by a sub-pixel shift for flipped images)
+__C.DATA_LOADER.IMAGE_CACHE_RESIZED = False
+
+# Load json dataset annotation files with a streaming parser (see
+# detectron/datasets/streaming_coco.py) that parses one object at a time, drops
+# unused fields and builds only the indexes used by Detectron. This
+# considerably reduces the peak memory used to load large annotation files
+__C.DATA_LOADER.STREAMING_JSON = False
+
+# Make the minibatch stream reproducible (e.g., for throughput comparisons):
+# the roidb is shuffled with a random generator seeded with RNG_SEED and, with
+# worker processes (DATA_LOADER.USE_PROCESSES), the numpy random generator is
+# reseeded from RNG_SEED and the minibatch number before sampling each
+# minibatch. Loader threads share the numpy random generator, so with them only
+# the sequence of roidb entries is reproducible. Minibatches built in parallel
+# may still reach the GPUs slightly out of order
+__C.DATA_LOADER.DETERMINISTIC = False
+
+# Time the stages of the construction of minibatches (image reading, resizing,
+# blob assembly, RPN / RetinaNet targets, RoI sampling, mask and keypoint
+# targets, serialization) and report percentiles of the time of each stage per
+# minibatch in the training stats (see detectron/roi_data/minibatch_stats.py)
+__C.DATA_LOADER.PROFILE_STAGES = False
+
 
 # ---------------------------------------------------------------------------- #
 # Inference ('test') options
@@ -227,6 +343,12 @@ __C.TEST.SCALE = 600
 # Max pixel size of the longest side of a scaled input image
 __C.TEST.MAX_SIZE = 1000
 
+# Number of images per forward pass of the network during inference (see
+# core.test.im_detect_all_batch). Images are only batched for models that
+# generate their proposals with an RPN and run without test-time augmentation
+# or tiling; others are processed one image at a time
+__C.TEST.IMS_PER_BATCH = 1
+
 # Overlap threshold used for non-maximum suppression (suppress boxes with
 # IoU >= this threshold)
 __C.TEST.NMS = 0.3
@@ -240,6 +362,11 @@ __C.TEST.PROPOSAL_FILES = ()
 # Limit on the number of proposals per image used during inference
 __C.TEST.PROPOSAL_LIMIT = 2000
 
+# Save the proposals generated by an RPN-only model in the memory-mapped
+# proposal format (a directory; see detectron/datasets/mapped_proposals.py)
+# instead of as a pickle file
+__C.TEST.MAPPED_PROPOSALS = False
+
 # NMS threshold used on RPN proposals
 __C.TEST.RPN_NMS_THRESH = 0.7
 
@@ -281,6 +408,53 @@ __C.TEST.FORCE_JSON_DATASET_EVAL = False
 __C.TEST.PRECOMPUTED_PROPOSALS = True
 
 
+# ---------------------------------------------------------------------------- #
+# Pipelined inference options (see detectron/core/test_pipeline.py)
+# ---------------------------------------------------------------------------- #
+__C.TEST.PIPELINE = AttrDict()
+
+# Overlap the decoding of upcoming images, the execution of the network and the
+# postprocessing of previous images if True (not supported by RetinaNet,
+# test-time augmentation and tiling, which fall back to running one image at a
+# time)
+__C.TEST.PIPELINE.ENABLED = False
+
+# Number of threads that read upcoming images and prepare the network inputs
+__C.TEST.PIPELINE.NUM_PREFETCH_THREADS = 2
+
+# Number of threads that turn network outputs into detections (NMS, mask and
+# keypoint results)
+__C.TEST.PIPELINE.NUM_POSTPROCESS_THREADS = 2
+
+# Capacity (in batches of TEST.IMS_PER_BATCH images) of the queues between the
+# stages of the pipeline
+__C.TEST.PIPELINE.QUEUE_SIZE = 4
+
+
+# ---------------------------------------------------------------------------- #
+# Tiled inference options (see core.test.im_detect_bbox_tiled)
+# ---------------------------------------------------------------------------- #
+__C.TEST.TILING = AttrDict()
+
+# Detect objects in overlapping tiles of the image at its original resolution
+# instead of in the image resized to TEST.SCALE, for large images with small
+# objects (only supported by Faster R-CNN bounding box detection)
+__C.TEST.TILING.ENABLED = False
+
+# Side of the square tiles in pixels; the memory used by a forward pass grows
+# with TILING.SIZE**2 * TILING.IMS_PER_BATCH
+__C.TEST.TILING.SIZE = 800
+
+# Overlap in pixels between neighbouring tiles. Each tile keeps the detections
+# centered in the part of the image closer to it than to the other tiles, which
+# entirely contains the objects smaller than the overlap: these are detected
+# once, without the truncated boxes found along the seams of the other tiles
+__C.TEST.TILING.OVERLAP = 200
+
+# Number of tiles per forward pass of the network
+__C.TEST.TILING.IMS_PER_BATCH = 4
+
+
 # ---------------------------------------------------------------------------- #
 # Test-time augmentations for bounding box detection
 # See configs/test_time_aug/e2e_mask_rcnn_R-50-FPN_2x.yaml for an example
@@ -656,6 +830,12 @@ __C.FAST_RCNN.ROI_XFORM_SAMPLING_RATIO = 0
 # pretrained FC layers like in VGG16, and will ignore this option
 __C.FAST_RCNN.ROI_XFORM_RESOLUTION = 14
 
+# Use a compact encoding of the bbox regression targets: only the 4 targets of
+# each fg RoI and the location of their class's predictions, consumed by
+# SelectSmoothL1Loss, instead of (R, 4 * NUM_CLASSES) targets and weights that
+# are mostly zero (which is costly with many classes). The loss is the same.
+__C.FAST_RCNN.COMPACT_BBOX_TARGETS = False
+
 
 # ---------------------------------------------------------------------------- #
 # RPN options
@@ -775,6 +955,17 @@ __C.MRCNN.WEIGHT_LOSS_MASK = 1.0
 # Binarization threshold for converting soft masks to hard masks
 __C.MRCNN.THRESH_BINARIZE = 0.5
 
+# Rasterize each gt mask once, to a MASK_BITMAP_SIZE x MASK_BITMAP_SIZE bitmap
+# of its bounding box, and compute the mask targets of all fg RoIs of an image
+# by sampling (nearest neighbor) the bitmaps, instead of rasterizing the
+# polygons of a gt mask for every RoI
+# Set to 0 to rasterize the polygons for every RoI
+__C.MRCNN.MASK_BITMAP_SIZE = 0
+
+# Memory budget (in MB, per loader process) of the cache of gt mask bitmaps,
+# which takes MASK_BITMAP_SIZE**2 / 8 bytes per instance
+__C.MRCNN.MASK_BITMAP_CACHE_MB = 1024
+
 
 # ---------------------------------------------------------------------------- #
 # Keyoint Mask R-CNN options ("KRCNN" = Mask R-CNN with Keypoint support)
@@ -841,6 +1032,13 @@ __C.KRCNN.MIN_KEYPOINT_COUNT_FOR_VALID_MINIBATCH = 20
 # below this minimum size
 __C.KRCNN.INFERENCE_MIN_SIZE = 0
 
+# Infer the keypoint locations and logits without resizing the whole heatmaps
+# to their rois if True. The locations and logits are unchanged. The
+# probabilities (the spatial softmax of the resized heatmaps at their maximum)
+# are then only computed when KEYPOINT_CONFIDENCE is 'prob', with cv2.exp and
+# within 1e-5 (relative), and are 0 otherwise
+__C.KRCNN.FAST_HEATMAP_DECODING = False
+
 # Multi-task loss weight to use for keypoints
 # Recommended values:
 #   - use 1.0 if KRCNN.NORMALIZE_BY_VISIBLE_KEYPOINTS is True
@@ -28,7 +28,6 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import cv2
 import datetime
 import logging
 import numpy as np
@@ -44,9 +43,11 @@ from detectron.datasets.json_dataset import JsonDataset
 from detectron.modeling import model_builder
 from detectron.utils.io import save_object
 from detectron.utils.timer import Timer
+import detectron.datasets.mapped_proposals as mapped_proposals
 import detectron.utils.blob as blob_utils
 import detectron.utils.c2 as c2_utils
 import detectron.utils.env as envu
+import detectron.utils.image as image_utils
 import detectron.utils.net as nu
 import detectron.utils.subprocess as subprocess_utils
 
@@ -110,12 +111,9 @@ def multi_gpu_generate_rpn_on_dataset(
         boxes += rpn_data['boxes']
         scores += rpn_data['scores']
         ids += rpn_data['ids']
-    rpn_file = os.path.join(output_dir, 'rpn_proposals.pkl')
-    cfg_yaml = yaml.dump(cfg)
-    save_object(
-        dict(boxes=boxes, scores=scores, ids=ids, cfg=cfg_yaml), rpn_file
+    rpn_file = save_rpn_proposals(
+        boxes, scores, ids, output_dir, 'rpn_proposals'
     )
-    logger.info('Wrote RPN proposals to {}'.format(os.path.abspath(rpn_file)))
     return boxes, scores, ids, rpn_file
 
 
@@ -155,19 +153,44 @@ def generate_rpn_on_range(
         gpu_id=gpu_id,
     )
 
-    cfg_yaml = yaml.dump(cfg)
     if ind_range is not None:
+        # Range outputs are collated by the parent process
+        cfg_yaml = yaml.dump(cfg)
         rpn_name = 'rpn_proposals_range_%s_%s.pkl' % tuple(ind_range)
+        rpn_file = os.path.join(output_dir, rpn_name)
+        save_object(
+            dict(boxes=boxes, scores=scores, ids=ids, cfg=cfg_yaml), rpn_file
+        )
+        logger.info(
+            'Wrote RPN proposals to {}'.format(os.path.abspath(rpn_file))
+        )
     else:
-        rpn_name = 'rpn_proposals.pkl'
-    rpn_file = os.path.join(output_dir, rpn_name)
-    save_object(
-        dict(boxes=boxes, scores=scores, ids=ids, cfg=cfg_yaml), rpn_file
-    )
-    logger.info('Wrote RPN proposals to {}'.format(os.path.abspath(rpn_file)))
+        rpn_file = save_rpn_proposals(
+            boxes, scores, ids, output_dir, 'rpn_proposals'
+        )
     return boxes, scores, ids, rpn_file
 
 
+def save_rpn_proposals(boxes, scores, ids, output_dir, rpn_name):
+    """Save RPN proposals for a whole dataset as a pickle file, or in the
+    mapped proposal format if cfg.TEST.MAPPED_PROPOSALS. Returns the path of
+    the proposal file.
+    """
+    cfg_yaml = yaml.dump(cfg)
+    if cfg.TEST.MAPPED_PROPOSALS:
+        rpn_file = os.path.join(output_dir, rpn_name)
+        mapped_proposals.save_mapped_proposals(
+            boxes, scores, ids, rpn_file, cfg_yaml=cfg_yaml
+        )
+    else:
+        rpn_file = os.path.join(output_dir, rpn_name + '.pkl')
+        save_object(
+            dict(boxes=boxes, scores=scores, ids=ids, cfg=cfg_yaml), rpn_file
+        )
+    logger.info('Wrote RPN proposals to {}'.format(os.path.abspath(rpn_file)))
+    return rpn_file
+
+
 def generate_proposals_on_roidb(
     model, roidb, start_ind=None, end_ind=None, total_num_images=None,
     gpu_id=0,
@@ -184,7 +207,7 @@ def generate_proposals_on_roidb(
         total_num_images = num_images
     for i in range(num_images):
         roidb_ids[i] = roidb[i]['id']
-        im = cv2.imread(roidb[i]['image'])
+        im = image_utils.read_image(roidb[i]['image'])
         with c2_utils.NamedCudaScope(gpu_id):
             _t.tic()
             roidb_boxes[i], roidb_scores[i] = im_proposals(model, im)
@@ -35,7 +35,6 @@ import numpy as np
 
 from caffe2.python import core
 from caffe2.python import workspace
-import pycocotools.mask as mask_util
 
 from detectron.core.config import cfg
 from detectron.utils.timer import Timer
@@ -45,6 +44,7 @@ import detectron.utils.blob as blob_utils
 import detectron.utils.boxes as box_utils
 import detectron.utils.image as image_utils
 import detectron.utils.keypoints as keypoint_utils
+import detectron.utils.segms as segm_utils
 
 logger = logging.getLogger(__name__)
 
@@ -61,6 +61,10 @@ def im_detect_all(model, im, box_proposals, timers=None):
     timers['im_detect_bbox'].tic()
     if cfg.TEST.BBOX_AUG.ENABLED:
         scores, boxes, im_scale = im_detect_bbox_aug(model, im, box_proposals)
+    elif cfg.TEST.TILING.ENABLED:
+        scores, boxes, im_scale = im_detect_bbox_tiled(
+            model, im, box_proposals
+        )
     else:
         scores, boxes, im_scale = im_detect_bbox(
             model, im, cfg.TEST.SCALE, cfg.TEST.MAX_SIZE, boxes=box_proposals
@@ -108,6 +112,93 @@ def im_detect_all(model, im, box_proposals, timers=None):
     return cls_boxes, cls_segms, cls_keyps
 
 
+def im_detect_all_batch(model, ims, box_proposals=None, timers=None):
+    """Detect objects in a list of images with a single pass of the network
+    for all the images (and a single pass of the mask and keypoint heads).
+    Images that would not be padded the same way alone (e.g. of different
+    sizes) may get slightly different detections near their borders than with
+    im_detect_all.
+
+    Arguments:
+        model (DetectionModelHelper): the detection model to use
+        ims (list): color images to test (in BGR order)
+        box_proposals (list): per image box proposals as for im_detect_all,
+            or None if using RPN
+
+    Returns:
+        results (list): (cls_boxes, cls_segms, cls_keyps) for each image, as
+            returned by im_detect_all
+    """
+    if timers is None:
+        timers = defaultdict(Timer)
+
+    if not is_batch_inference_supported():
+        if box_proposals is None:
+            box_proposals = [None] * len(ims)
+        return [
+            im_detect_all(model, im, proposals, timers)
+            for im, proposals in zip(ims, box_proposals)
+        ]
+
+    timers['im_detect_bbox'].tic()
+    scores, boxes, im_scales = im_detect_bbox_batch(
+        model, ims, cfg.TEST.SCALE, cfg.TEST.MAX_SIZE
+    )
+    timers['im_detect_bbox'].toc()
+
+    timers['misc_bbox'].tic()
+    scores, boxes, cls_boxes = zip(*[
+        box_results_with_nms_and_limit(scores_i, boxes_i)
+        for scores_i, boxes_i in zip(scores, boxes)
+    ])
+    timers['misc_bbox'].toc()
+
+    num_ims = len(ims)
+    num_boxes = sum(boxes_i.shape[0] for boxes_i in boxes)
+    if cfg.MODEL.MASK_ON and num_boxes > 0:
+        timers['im_detect_mask'].tic()
+        masks = im_detect_mask_batch(model, im_scales, boxes)
+        timers['im_detect_mask'].toc()
+
+        timers['misc_mask'].tic()
+        cls_segms = [
+            segm_results(
+                cls_boxes[i], masks[i], boxes[i], ims[i].shape[0],
+                ims[i].shape[1]
+            ) if boxes[i].shape[0] > 0 else None
+            for i in range(num_ims)
+        ]
+        timers['misc_mask'].toc()
+    else:
+        cls_segms = [None] * num_ims
+
+    if cfg.MODEL.KEYPOINTS_ON and num_boxes > 0:
+        timers['im_detect_keypoints'].tic()
+        heatmaps = im_detect_keypoints_batch(model, im_scales, boxes)
+        timers['im_detect_keypoints'].toc()
+
+        timers['misc_keypoints'].tic()
+        cls_keyps = [
+            keypoint_results(cls_boxes[i], heatmaps[i], boxes[i])
+            if boxes[i].shape[0] > 0 else None
+            for i in range(num_ims)
+        ]
+        timers['misc_keypoints'].toc()
+    else:
+        cls_keyps = [None] * num_ims
+
+    return list(zip(cls_boxes, cls_segms, cls_keyps))
+
+
+def is_batch_inference_supported():
+    """Whether im_detect_all_batch can run the images of a batch together."""
+    return (
+        cfg.MODEL.FASTER_RCNN and not cfg.RETINANET.RETINANET_ON and
+        not cfg.TEST.BBOX_AUG.ENABLED and not cfg.TEST.MASK_AUG.ENABLED and
+        not cfg.TEST.KPS_AUG.ENABLED and not cfg.TEST.TILING.ENABLED
+    )
+
+
 def im_conv_body_only(model, im, target_scale, target_max_size):
     """Runs `model.conv_body_net` on the given image `im`."""
     im_blob, im_scale, _im_info = blob_utils.get_image_blob(
@@ -135,7 +226,14 @@ def im_detect_bbox(model, im, target_scale, target_max_size, boxes=None):
             returned by _get_blobs and for use with im_detect_mask, etc.)
     """
     inputs, im_scale = _get_blobs(im, boxes, target_scale, target_max_size)
+    return im_detect_bbox_from_inputs(model, inputs, im_scale, im.shape, boxes)
 
+
+def im_detect_bbox_from_inputs(model, inputs, im_scale, im_shape, boxes=None):
+    """Bounding box object detection for an image given the network inputs
+    returned by _get_blobs for the image. Function signature is otherwise the
+    same as for im_detect_bbox.
+    """
     # When mapping from image ROIs to feature map ROIs, there's some aliasing
     # (some distinct image ROIs get mapped to the same feature ROI).
     # Here, we identify duplicate feature ROIs, so we only compute features
@@ -179,7 +277,7 @@ def im_detect_bbox(model, im, target_scale, target_max_size, boxes=None):
         pred_boxes = box_utils.bbox_transform(
             boxes, box_deltas, cfg.MODEL.BBOX_REG_WEIGHTS
         )
-        pred_boxes = box_utils.clip_tiled_boxes(pred_boxes, im.shape)
+        pred_boxes = box_utils.clip_tiled_boxes(pred_boxes, im_shape)
         if cfg.MODEL.CLS_AGNOSTIC_BBOX_REG:
             pred_boxes = np.tile(pred_boxes, (1, scores.shape[1]))
     else:
@@ -194,6 +292,172 @@ def im_detect_bbox(model, im, target_scale, target_max_size, boxes=None):
     return scores, pred_boxes, im_scale
 
 
+def im_detect_bbox_batch(model, ims, target_scale, target_max_size):
+    """Bounding box object detection for a list of images with the proposals
+    of an in-network RPN.
+
+    Returns:
+        scores (list): R_i x K array of object class scores for each image
+        boxes (list): R_i x 4*K array of predicted bounding boxes for each
+            image
+        im_scales (list): image scales used in the input blob
+    """
+    inputs = {}
+    inputs['data'], im_scales, inputs['im_info'] = \
+        blob_utils.get_image_blob_batch(ims, target_scale, target_max_size)
+    scores, boxes = im_detect_bbox_batch_from_inputs(
+        model, inputs, im_scales, [im.shape for im in ims]
+    )
+    return scores, boxes, im_scales
+
+
+def im_detect_bbox_batch_from_inputs(model, inputs, im_scales, im_shapes):
+    """Bounding box object detection for a list of images given the network
+    inputs built with get_image_blob_batch. Returns the scores and boxes of
+    im_detect_bbox_batch.
+    """
+    for k, v in inputs.items():
+        workspace.FeedBlob(core.ScopedName(k), v)
+    workspace.RunNet(model.net.Proto().name)
+
+    rois = workspace.FetchBlob(core.ScopedName('rois'))
+    scores = workspace.FetchBlob(core.ScopedName('cls_prob'))
+    scores = scores.reshape([-1, scores.shape[-1]])
+    if cfg.TEST.BBOX_REG:
+        box_deltas = workspace.FetchBlob(core.ScopedName('bbox_pred'))
+        box_deltas = box_deltas.reshape([-1, box_deltas.shape[-1]])
+        if cfg.MODEL.CLS_AGNOSTIC_BBOX_REG:
+            # Remove predictions for bg class (compat with MSRA code)
+            box_deltas = box_deltas[:, -4:]
+
+    scores_per_im = []
+    pred_boxes_per_im = []
+    for i, im_shape in enumerate(im_shapes):
+        inds = np.where(rois[:, 0] == i)[0]
+        # unscale back to raw image space
+        boxes = rois[inds, 1:5] / im_scales[i]
+        if cfg.TEST.BBOX_REG:
+            pred_boxes = box_utils.bbox_transform(
+                boxes, box_deltas[inds], cfg.MODEL.BBOX_REG_WEIGHTS
+            )
+            pred_boxes = box_utils.clip_tiled_boxes(pred_boxes, im_shape)
+            if cfg.MODEL.CLS_AGNOSTIC_BBOX_REG:
+                pred_boxes = np.tile(pred_boxes, (1, scores.shape[1]))
+        else:
+            pred_boxes = np.tile(boxes, (1, scores.shape[1]))
+        scores_per_im.append(scores[inds])
+        pred_boxes_per_im.append(pred_boxes)
+
+    return scores_per_im, pred_boxes_per_im
+
+
+def im_detect_bbox_tiled(model, im, box_proposals=None):
+    """Performs bbox detection in overlapping tiles of the image at its
+    original resolution, running TEST.TILING.IMS_PER_BATCH tiles at a time.
+    The detections of the tiles are returned together in image coordinates.
+    Function signature is the same as for im_detect_bbox.
+
+    Each tile only keeps the detections whose center is in the part of the
+    image that is closer to it than to its neighbours. Objects smaller than
+    TEST.TILING.OVERLAP are entirely in that tile, so the truncated boxes of
+    these objects in the neighbouring tiles are dropped instead of being left
+    to NMS (which keeps the ones that overlap the full box too little).
+    """
+    assert cfg.MODEL.FASTER_RCNN and box_proposals is None, \
+        'Tiled inference requires proposals from an in-network RPN'
+    assert not cfg.MODEL.MASK_ON and not cfg.MODEL.KEYPOINTS_ON, \
+        'Tiled inference only supports bounding box detection'
+    assert not cfg.TEST.BBOX_AUG.ENABLED, \
+        'Tiled inference with test-time augmentation not implemented'
+
+    tiles = _get_tiles(im.shape, cfg.TEST.TILING.SIZE, cfg.TEST.TILING.OVERLAP)
+    tile_cores = _get_tile_cores(tiles, im.shape)
+    # All the tiles have the same shape; run them at their resolution
+    tile_h = tiles[0][3] - tiles[0][1]
+    tile_w = tiles[0][2] - tiles[0][0]
+    ims_per_batch = cfg.TEST.TILING.IMS_PER_BATCH
+    scores_ts = []
+    boxes_ts = []
+    for k in range(0, len(tiles), ims_per_batch):
+        batch_tiles = tiles[k:k + ims_per_batch]
+        scores_b, boxes_b, _ = im_detect_bbox_batch(
+            model, [im[y1:y2, x1:x2] for x1, y1, x2, y2 in batch_tiles],
+            min(tile_h, tile_w), max(tile_h, tile_w)
+        )
+        for (x1, y1, _, _), core, scores_t, boxes_t in zip(
+            batch_tiles, tile_cores[k:k + ims_per_batch], scores_b, boxes_b
+        ):
+            # Map the boxes from tile to image coordinates
+            offsets = np.tile(
+                np.array([x1, y1], dtype=boxes_t.dtype), boxes_t.shape[1] // 2
+            )
+            boxes_t = boxes_t + offsets
+            # Drop the class detections centered outside of the tile core
+            ctr_x = (boxes_t[:, 0::4] + boxes_t[:, 2::4]) / 2.
+            ctr_y = (boxes_t[:, 1::4] + boxes_t[:, 3::4]) / 2.
+            in_core = (
+                (ctr_x >= core[0]) & (ctr_y >= core[1]) &
+                (ctr_x < core[2]) & (ctr_y < core[3])
+            )
+            scores_ts.append(np.where(in_core, scores_t, 0.).astype(
+                scores_t.dtype, copy=False
+            ))
+            boxes_ts.append(boxes_t)
+
+    return np.vstack(scores_ts), np.vstack(boxes_ts), 1.0
+
+
+def _get_tiles(im_shape, tile_size, overlap):
+    """Return the [x1, y1, x2, y2) coordinates of tiles of at most tile_size x
+    tile_size pixels that cover an image of shape im_shape, with neighbouring
+    tiles overlapping by at least overlap pixels. The last tiles of each row
+    and column are aligned with the image border so all the tiles have the
+    same shape.
+    """
+    assert overlap < tile_size, 'Tile overlap must be smaller than tile size'
+
+    def get_starts(size):
+        if size <= tile_size:
+            return [0]
+        starts = list(range(0, size - tile_size, tile_size - overlap))
+        return starts + [size - tile_size]
+
+    height, width = im_shape[:2]
+    return [
+        (x1, y1, min(x1 + tile_size, width), min(y1 + tile_size, height))
+        for y1 in get_starts(height) for x1 in get_starts(width)
+    ]
+
+
+def _get_tile_cores(tiles, im_shape):
+    """Return the [x1, y1, x2, y2) coordinates of the core of each tile
+    returned by _get_tiles: the part of the image that is closer to the tile
+    than to its neighbours. The overlaps of neighbouring tiles are split in
+    the middle so the cores of the tiles partition the image.
+    """
+    def get_core_bounds(starts, tile_size, size):
+        starts = sorted(set(starts))
+        bounds = [0.]
+        for start, next_start in zip(starts[:-1], starts[1:]):
+            bounds.append((next_start + start + tile_size) / 2.)
+        bounds.append(float(size))
+        return {
+            start: (bounds[k], bounds[k + 1]) for k, start in enumerate(starts)
+        }
+
+    height, width = im_shape[:2]
+    x_bounds = get_core_bounds(
+        [x1 for x1, _, _, _ in tiles], tiles[0][2] - tiles[0][0], width
+    )
+    y_bounds = get_core_bounds(
+        [y1 for _, y1, _, _ in tiles], tiles[0][3] - tiles[0][1], height
+    )
+    return [
+        (x_bounds[x1][0], y_bounds[y1][0], x_bounds[x1][1], y_bounds[y1][1])
+        for x1, y1, _, _ in tiles
+    ]
+
+
 def im_detect_bbox_aug(model, im, box_proposals=None):
     """Performs bbox detection with test-time augmentations.
     Function signature is the same as for im_detect_bbox.
@@ -391,7 +655,30 @@ def im_detect_mask(model, im_scale, boxes):
         pred_masks = np.zeros((0, M, M), np.float32)
         return pred_masks
 
-    inputs = {'mask_rois': _get_rois_blob(boxes, im_scale)}
+    return _run_mask_net(model, _get_rois_blob(boxes, im_scale))
+
+
+def im_detect_mask_batch(model, im_scales, boxes):
+    """Infer instance segmentation masks for the images of a batch. This
+    function must be called after im_detect_bbox_batch.
+
+    Arguments:
+        model (DetectionModelHelper): the detection model to use
+        im_scales (list): image blob scales as returned by im_detect_bbox_batch
+        boxes (list): R_i x 4 array of bounding box detections for each image
+
+    Returns:
+        pred_masks (list): R_i x K x M x M array of class specific soft masks
+            for each image (see im_detect_mask)
+    """
+    pred_masks = _run_mask_net(model, _get_rois_blob_batch(boxes, im_scales))
+    return _split_per_image(pred_masks, boxes)
+
+
+def _run_mask_net(model, rois):
+    """Run the mask head on the given rois blob (see _get_rois_blob)."""
+    M = cfg.MRCNN.RESOLUTION
+    inputs = {'mask_rois': rois}
     # Add multi-level rois for FPN
     if cfg.FPN.MULTILEVEL_ROIS:
         _add_multilevel_rois_for_test(inputs, 'mask_rois')
@@ -559,7 +846,31 @@ def im_detect_keypoints(model, im_scale, boxes):
         pred_heatmaps = np.zeros((0, cfg.KRCNN.NUM_KEYPOINTS, M, M), np.float32)
         return pred_heatmaps
 
-    inputs = {'keypoint_rois': _get_rois_blob(boxes, im_scale)}
+    return _run_keypoint_net(model, _get_rois_blob(boxes, im_scale))
+
+
+def im_detect_keypoints_batch(model, im_scales, boxes):
+    """Infer instance keypoint poses for the images of a batch. This function
+    must be called after im_detect_bbox_batch.
+
+    Arguments:
+        model (DetectionModelHelper): the detection model to use
+        im_scales (list): image blob scales as returned by im_detect_bbox_batch
+        boxes (list): R_i x 4 array of bounding box detections for each image
+
+    Returns:
+        pred_heatmaps (list): R_i x J x M x M array of keypoint location logits
+            for each image (see im_detect_keypoints)
+    """
+    pred_heatmaps = _run_keypoint_net(
+        model, _get_rois_blob_batch(boxes, im_scales)
+    )
+    return _split_per_image(pred_heatmaps, boxes)
+
+
+def _run_keypoint_net(model, rois):
+    """Run the keypoint head on the given rois blob (see _get_rois_blob)."""
+    inputs = {'keypoint_rois': rois}
 
     # Add multi-level rois for FPN
     if cfg.FPN.MULTILEVEL_ROIS:
@@ -761,58 +1072,79 @@ def box_results_with_nms_and_limit(scores, boxes):
     box at `boxes[i, j * 4:(j + 1) * 4]`.
     """
     num_classes = cfg.MODEL.NUM_CLASSES
-    cls_boxes = [[] for _ in range(num_classes)]
-    # Apply threshold on detection probabilities and apply NMS
+    # Apply threshold on detection probabilities of all classes at once
     # Skip j = 0, because it's the background class
-    for j in range(1, num_classes):
-        inds = np.where(scores[:, j] > cfg.TEST.SCORE_THRESH)[0]
-        scores_j = scores[inds, j]
-        boxes_j = boxes[inds, j * 4:(j + 1) * 4]
-        dets_j = np.hstack((boxes_j, scores_j[:, np.newaxis])).astype(
-            np.float32, copy=False
-        )
-        if cfg.TEST.SOFT_NMS.ENABLED:
-            nms_dets, _ = box_utils.soft_nms(
-                dets_j,
-                sigma=cfg.TEST.SOFT_NMS.SIGMA,
-                overlap_thresh=cfg.TEST.NMS,
-                score_thresh=0.0001,
-                method=cfg.TEST.SOFT_NMS.METHOD
-            )
-        else:
-            keep = box_utils.nms(dets_j, cfg.TEST.NMS)
-            nms_dets = dets_j[keep, :]
-        # Refine the post-NMS boxes using bounding-box voting
-        if cfg.TEST.BBOX_VOTE.ENABLED:
-            nms_dets = box_utils.box_voting(
-                nms_dets,
-                dets_j,
-                cfg.TEST.BBOX_VOTE.VOTE_TH,
-                scoring_method=cfg.TEST.BBOX_VOTE.SCORING_METHOD
-            )
-        cls_boxes[j] = nms_dets
+    inds, classes = np.where(scores[:, 1:] > cfg.TEST.SCORE_THRESH)
+    classes += 1
+    # Group the detections by class; within a class they stay in the order of
+    # their rows, as when thresholding the scores of the class alone
+    order = np.argsort(classes, kind='mergesort')
+    inds = inds[order]
+    classes = classes[order]
+    boxes = boxes.reshape((-1, scores.shape[1], 4))[inds, classes]
+    dets = np.hstack((boxes, scores[inds, classes][:, np.newaxis])).astype(
+        np.float32, copy=False
+    )
+    _, starts = np.unique(classes, return_index=True)
+    # Apply NMS to the classes that have detections
+    if not cfg.TEST.SOFT_NMS.ENABLED and not cfg.TEST.BBOX_VOTE.ENABLED:
+        keep = box_utils.nms_per_class(dets, starts, cfg.TEST.NMS)
+        dets = dets[keep, :]
+        classes = classes[keep]
+    else:
+        ends = np.append(starts[1:], len(dets))
+        cls_dets = []
+        for start, end in zip(starts, ends):
+            dets_j = dets[start:end]
+            if cfg.TEST.SOFT_NMS.ENABLED:
+                nms_dets, _ = box_utils.soft_nms(
+                    dets_j,
+                    sigma=cfg.TEST.SOFT_NMS.SIGMA,
+                    overlap_thresh=cfg.TEST.NMS,
+                    score_thresh=0.0001,
+                    method=cfg.TEST.SOFT_NMS.METHOD
+                )
+            else:
+                keep = box_utils.nms(dets_j, cfg.TEST.NMS)
+                nms_dets = dets_j[keep, :]
+            # Refine the post-NMS boxes using bounding-box voting
+            if cfg.TEST.BBOX_VOTE.ENABLED:
+                nms_dets = box_utils.box_voting(
+                    nms_dets,
+                    dets_j,
+                    cfg.TEST.BBOX_VOTE.VOTE_TH,
+                    scoring_method=cfg.TEST.BBOX_VOTE.SCORING_METHOD
+                )
+            cls_dets.append(nms_dets)
+        classes = np.repeat(classes[starts], [len(d) for d in cls_dets])
+        dets = np.vstack([np.zeros((0, 5), dtype=np.float32)] + cls_dets)
 
     # Limit to max_per_image detections **over all classes**
-    if cfg.TEST.DETECTIONS_PER_IM > 0:
-        image_scores = np.hstack(
-            [cls_boxes[j][:, -1] for j in range(1, num_classes)]
-        )
-        if len(image_scores) > cfg.TEST.DETECTIONS_PER_IM:
-            image_thresh = np.sort(image_scores)[-cfg.TEST.DETECTIONS_PER_IM]
-            for j in range(1, num_classes):
-                keep = np.where(cls_boxes[j][:, -1] >= image_thresh)[0]
-                cls_boxes[j] = cls_boxes[j][keep, :]
-
-    im_results = np.vstack([cls_boxes[j] for j in range(1, num_classes)])
-    boxes = im_results[:, :-1]
-    scores = im_results[:, -1]
+    if cfg.TEST.DETECTIONS_PER_IM > 0 and \
+            len(dets) > cfg.TEST.DETECTIONS_PER_IM:
+        # Only the score of rank DETECTIONS_PER_IM is needed, which
+        # partitioning finds without sorting all the scores
+        image_thresh = np.partition(
+            dets[:, -1], -cfg.TEST.DETECTIONS_PER_IM
+        )[-cfg.TEST.DETECTIONS_PER_IM]
+        keep = np.where(dets[:, -1] >= image_thresh)[0]
+        dets = dets[keep, :]
+        classes = classes[keep]
+
+    cls_boxes = [[]] + [
+        np.zeros((0, 5), dtype=np.float32) for _ in range(1, num_classes)
+    ]
+    present_classes, starts = np.unique(classes, return_index=True)
+    for j, dets_j in zip(present_classes, np.split(dets, starts[1:])):
+        cls_boxes[j] = dets_j
+    boxes = dets[:, :-1]
+    scores = dets[:, -1]
     return scores, boxes, cls_boxes
 
 
 def segm_results(cls_boxes, masks, ref_boxes, im_h, im_w):
     num_classes = cfg.MODEL.NUM_CLASSES
     cls_segms = [[] for _ in range(num_classes)]
-    mask_ind = 0
     # To work around an issue with cv2.resize (it seems to automatically pad
     # with repeated border values), we manually zero-pad the masks by 1 pixel
     # prior to resizing back to the original image resolution. This prevents
@@ -822,48 +1154,57 @@ def segm_results(cls_boxes, masks, ref_boxes, im_h, im_w):
     scale = (M + 2.0) / M
     ref_boxes = box_utils.expand_boxes(ref_boxes, scale)
     ref_boxes = ref_boxes.astype(np.int32)
-    padded_mask = np.zeros((M + 2, M + 2), dtype=np.float32)
-
-    # skip j = 0, because it's the background class
-    for j in range(1, num_classes):
-        segms = []
-        for _ in range(cls_boxes[j].shape[0]):
-            if cfg.MRCNN.CLS_SPECIFIC_MASK:
-                padded_mask[1:-1, 1:-1] = masks[mask_ind, j, :, :]
-            else:
-                padded_mask[1:-1, 1:-1] = masks[mask_ind, 0, :, :]
-
-            ref_box = ref_boxes[mask_ind, :]
-            w = ref_box[2] - ref_box[0] + 1
-            h = ref_box[3] - ref_box[1] + 1
-            w = np.maximum(w, 1)
-            h = np.maximum(h, 1)
-
-            mask = cv2.resize(padded_mask, (w, h))
-            mask = np.array(mask > cfg.MRCNN.THRESH_BINARIZE, dtype=np.uint8)
-            im_mask = np.zeros((im_h, im_w), dtype=np.uint8)
-
-            x_0 = max(ref_box[0], 0)
-            x_1 = min(ref_box[2] + 1, im_w)
-            y_0 = max(ref_box[1], 0)
-            y_1 = min(ref_box[3] + 1, im_h)
-
-            im_mask[y_0:y_1, x_0:x_1] = mask[
-                (y_0 - ref_box[1]):(y_1 - ref_box[1]),
-                (x_0 - ref_box[0]):(x_1 - ref_box[0])
-            ]
 
-            # Get RLE encoding used by the COCO evaluation API
-            rle = mask_util.encode(
-                np.array(im_mask[:, :, np.newaxis], order='F')
-            )[0]
-            segms.append(rle)
-
-            mask_ind += 1
-
-        cls_segms[j] = segms
+    # Class of each mask; skip j = 0, because it's the background class
+    num_masks = [cls_boxes[j].shape[0] for j in range(1, num_classes)]
+    mask_classes = np.repeat(np.arange(1, num_classes), num_masks)
+    assert len(mask_classes) == masks.shape[0]
+    padded_masks = np.zeros(
+        (len(mask_classes), M + 2, M + 2), dtype=np.float32
+    )
+    if cfg.MRCNN.CLS_SPECIFIC_MASK:
+        padded_masks[:, 1:-1, 1:-1] = \
+            masks[np.arange(len(mask_classes)), mask_classes, :, :]
+    else:
+        padded_masks[:, 1:-1, 1:-1] = masks[:, 0, :, :]
+
+    ws = np.maximum(ref_boxes[:, 2] - ref_boxes[:, 0] + 1, 1)
+    hs = np.maximum(ref_boxes[:, 3] - ref_boxes[:, 1] + 1, 1)
+    # Masks with boxes of the same size are resized together, as the channels
+    # of a single image (cv2.resize handles up to 512 channels)
+    inds_per_size = defaultdict(list)
+    for mask_ind in range(len(mask_classes)):
+        inds_per_size[(ws[mask_ind], hs[mask_ind])].append(mask_ind)
+    rles = [None] * len(mask_classes)
+    for (w, h), inds in inds_per_size.items():
+        for k in range(0, len(inds), 512):
+            chunk = inds[k:k + 512]
+            resized = cv2.resize(
+                np.ascontiguousarray(padded_masks[chunk].transpose(1, 2, 0)),
+                (int(w), int(h))
+            ).reshape(h, w, -1)
+            resized = resized > cfg.MRCNN.THRESH_BINARIZE
+            for c, mask_ind in enumerate(chunk):
+                ref_box = ref_boxes[mask_ind, :]
+                x_0 = max(ref_box[0], 0)
+                x_1 = min(ref_box[2] + 1, im_w)
+                y_0 = max(ref_box[1], 0)
+                y_1 = min(ref_box[3] + 1, im_h)
+                x_1 = max(x_1, x_0)
+                y_1 = max(y_1, y_0)
+                # Get RLE encoding used by the COCO evaluation API, directly
+                # from the part of the mask that is inside of the image
+                rles[mask_ind] = segm_utils.mask_crop_to_rle(
+                    resized[
+                        (y_0 - ref_box[1]):(y_1 - ref_box[1]),
+                        (x_0 - ref_box[0]):(x_1 - ref_box[0]), c
+                    ], x_0, y_0, im_h, im_w
+                )
 
-    assert mask_ind == masks.shape[0]
+    mask_ind = 0
+    for j in range(1, num_classes):
+        cls_segms[j] = rles[mask_ind:mask_ind + num_masks[j - 1]]
+        mask_ind += num_masks[j - 1]
     return cls_segms
 
 
@@ -902,6 +1243,32 @@ def _get_rois_blob(im_rois, im_scale):
     return rois_blob.astype(np.float32, copy=False)
 
 
+def _get_rois_blob_batch(im_rois, im_scales):
+    """Converts the RoIs of the images of a batch into network inputs.
+
+    Arguments:
+        im_rois (list): R_i x 4 matrix of RoIs in original image coordinates
+            for each image
+        im_scales (list): image scales as returned by get_image_blob_batch
+
+    Returns:
+        blob (ndarray): sum(R_i) x 5 matrix of RoIs with columns
+            [batch index, x1, y1, x2, y2]
+    """
+    rois_blob = []
+    for i, (rois, im_scale) in enumerate(zip(im_rois, im_scales)):
+        rois, _ = _project_im_rois(rois, im_scale)
+        rois_blob.append(np.hstack((np.full((len(rois), 1), i), rois)))
+    rois_blob = np.vstack(rois_blob)
+    return rois_blob.astype(np.float32, copy=False)
+
+
+def _split_per_image(preds, im_rois):
+    """Split predictions for the rois of a batch into per image predictions."""
+    num_rois = [len(rois) for rois in im_rois]
+    return np.split(preds, np.cumsum(num_rois)[:-1])
+
+
 def _project_im_rois(im_rois, scales):
     """Project image RoIs into the image pyramid built by _get_image_blob.
 
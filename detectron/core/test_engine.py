@@ -21,11 +21,11 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from collections import defaultdict
-import cv2
 import datetime
 import logging
 import numpy as np
 import os
+import time
 import yaml
 
 from caffe2.python import workspace
@@ -35,13 +35,17 @@ from detectron.core.config import get_output_dir
 from detectron.core.rpn_generator import generate_rpn_on_dataset
 from detectron.core.rpn_generator import generate_rpn_on_range
 from detectron.core.test import im_detect_all
+from detectron.core.test import im_detect_all_batch
+from detectron.core.test import is_batch_inference_supported
 from detectron.datasets import task_evaluation
 from detectron.datasets.json_dataset import JsonDataset
 from detectron.modeling import model_builder
 from detectron.utils.io import save_object
 from detectron.utils.timer import Timer
+import detectron.core.test_pipeline as test_pipeline
 import detectron.utils.c2 as c2_utils
 import detectron.utils.env as envu
+import detectron.utils.image as image_utils
 import detectron.utils.net as net_utils
 import detectron.utils.subprocess as subprocess_utils
 import detectron.utils.vis as vis_utils
@@ -237,27 +241,26 @@ def test_net(
     num_classes = cfg.MODEL.NUM_CLASSES
     all_boxes, all_segms, all_keyps = empty_results(num_classes, num_images)
     timers = defaultdict(Timer)
-    for i, entry in enumerate(roidb):
-        if cfg.TEST.PRECOMPUTED_PROPOSALS:
-            # The roidb may contain ground-truth rois (for example, if the roidb
-            # comes from the training or val split). We only want to evaluate
-            # detection on the *non*-ground-truth rois. We select only the rois
-            # that have the gt_classes field set to 0, which means there's no
-            # ground truth.
-            box_proposals = entry['boxes'][entry['gt_classes'] == 0]
-            if len(box_proposals) == 0:
-                continue
-        else:
-            # Faster R-CNN type models generate proposals on-the-fly with an
-            # in-network RPN; 1-stage models don't require proposals.
-            box_proposals = None
-
-        im = cv2.imread(entry['image'])
-        with c2_utils.NamedCudaScope(gpu_id):
-            cls_boxes_i, cls_segms_i, cls_keyps_i = im_detect_all(
-                model, im, box_proposals, timers
-            )
-
+    if is_batch_inference_supported():
+        ims_per_batch = cfg.TEST.IMS_PER_BATCH
+    else:
+        ims_per_batch = 1
+    batches = get_test_batches(roidb, ims_per_batch)
+    pipelined = cfg.TEST.PIPELINE.ENABLED and test_pipeline.is_supported()
+    if pipelined:
+        pipeline = test_pipeline.InferencePipeline(
+            model,
+            gpu_id=gpu_id,
+            num_prefetch_threads=cfg.TEST.PIPELINE.NUM_PREFETCH_THREADS,
+            num_postprocess_threads=cfg.TEST.PIPELINE.NUM_POSTPROCESS_THREADS,
+            queue_size=cfg.TEST.PIPELINE.QUEUE_SIZE
+        )
+        results = pipeline.run(batches, timers)
+    else:
+        results = detect_batches(model, batches, gpu_id, timers)
+    start_time = time.time()
+    for num_done, (i, entry, im, im_results) in enumerate(results, 1):
+        cls_boxes_i, cls_segms_i, cls_keyps_i = im_results
         extend_results(i, all_boxes, cls_boxes_i)
         if cls_segms_i is not None:
             extend_results(i, all_segms, cls_segms_i)
@@ -265,19 +268,27 @@ def test_net(
             extend_results(i, all_keyps, cls_keyps_i)
 
         if i % 10 == 0:  # Reduce log file size
-            ave_total_time = np.sum([t.average_time for t in timers.values()])
+            if pipelined:
+                # The stages overlap, so the sum of their times overestimates
+                # the time per image
+                ave_total_time = (time.time() - start_time) / num_done
+            else:
+                # The timers measure whole batches
+                ave_total_time = np.sum(
+                    [t.average_time for t in timers.values()]
+                ) / ims_per_batch
             eta_seconds = ave_total_time * (num_images - i - 1)
             eta = str(datetime.timedelta(seconds=int(eta_seconds)))
             det_time = (
                 timers['im_detect_bbox'].average_time +
                 timers['im_detect_mask'].average_time +
                 timers['im_detect_keypoints'].average_time
-            )
+            ) / ims_per_batch
             misc_time = (
                 timers['misc_bbox'].average_time +
                 timers['misc_mask'].average_time +
                 timers['misc_keypoints'].average_time
-            )
+            ) / ims_per_batch
             logger.info(
                 (
                     'im_detect: range [{:d}, {:d}] of {:d}: '
@@ -321,6 +332,49 @@ def test_net(
     return all_boxes, all_segms, all_keyps
 
 
+def detect_batches(model, batches, gpu_id, timers):
+    """Run inference on batches of images one after the other (see
+    get_test_batches). Yields (index, entry, im, (cls_boxes, cls_segms,
+    cls_keyps)) for each image.
+    """
+    for batch in batches:
+        ims = [image_utils.read_image(entry['image']) for _, entry, _ in batch]
+        with c2_utils.NamedCudaScope(gpu_id):
+            if len(batch) == 1:
+                results = [im_detect_all(model, ims[0], batch[0][2], timers)]
+            else:
+                results = im_detect_all_batch(model, ims, timers=timers)
+        for (i, entry, _), im, im_results in zip(batch, ims, results):
+            yield i, entry, im, im_results
+
+
+def get_test_batches(roidb, ims_per_batch):
+    """Split the roidb into batches of (index, entry, box proposals) of
+    ims_per_batch images to run inference on.
+    """
+    batch = []
+    for i, entry in enumerate(roidb):
+        if cfg.TEST.PRECOMPUTED_PROPOSALS:
+            # The roidb may contain ground-truth rois (for example, if the roidb
+            # comes from the training or val split). We only want to evaluate
+            # detection on the *non*-ground-truth rois. We select only the rois
+            # that have the gt_classes field set to 0, which means there's no
+            # ground truth.
+            box_proposals = entry['boxes'][entry['gt_classes'] == 0]
+            if len(box_proposals) == 0:
+                continue
+        else:
+            # Faster R-CNN type models generate proposals on-the-fly with an
+            # in-network RPN; 1-stage models don't require proposals.
+            box_proposals = None
+        batch.append((i, entry, box_proposals))
+        if len(batch) == ims_per_batch:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
 def initialize_model_from_cfg(weights_file, gpu_id=0):
     """Initialize a model from the global cfg. Loads test-time weights and
     creates the networks in the Caffe2 workspace.
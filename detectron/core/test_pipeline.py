@@ -0,0 +1,279 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Pipelined inference: overlaps the decoding of upcoming images, the
+execution of the network and the postprocessing of previous images.
+
+The pipeline has three stages connected by bounded queues:
+  - prefetch threads read images and prepare the network inputs
+  - a single executor thread runs the networks
+  - postprocess threads turn the network outputs into detections (NMS, mask
+    and keypoint results)
+
+The mask and keypoint heads run on the features of the images that are in the
+workspace, so for models with these heads the executor also applies NMS to the
+boxes of the images before the next images are run. Results are returned in
+the order of the input batches.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import logging
+import Queue
+import threading
+import time
+
+from detectron.core.config import cfg
+from detectron.utils.coordinator import coordinated_get
+from detectron.utils.coordinator import coordinated_put
+from detectron.utils.coordinator import Coordinator
+from detectron.utils.timer import Timer
+import detectron.core.test as test
+import detectron.utils.blob as blob_utils
+import detectron.utils.c2 as c2_utils
+import detectron.utils.image as image_utils
+
+logger = logging.getLogger(__name__)
+
+
+def is_supported():
+    """Whether the images of the model can be run through the pipeline."""
+    return (
+        not cfg.RETINANET.RETINANET_ON and not cfg.TEST.BBOX_AUG.ENABLED and
+        not cfg.TEST.MASK_AUG.ENABLED and not cfg.TEST.KPS_AUG.ENABLED and
+        not cfg.TEST.TILING.ENABLED
+    )
+
+
+class InferencePipeline(object):
+    def __init__(
+        self,
+        model,
+        gpu_id=0,
+        num_prefetch_threads=2,
+        num_postprocess_threads=2,
+        queue_size=4
+    ):
+        self._model = model
+        self._gpu_id = gpu_id
+        self._num_prefetch_threads = num_prefetch_threads
+        self._num_postprocess_threads = num_postprocess_threads
+        self._queue_size = queue_size
+
+    def run(self, batches, timers=None):
+        """Run inference on batches of (index, roidb entry, box proposals)
+        tuples (see test_engine.get_test_batches). Yields (index, entry, im,
+        (cls_boxes, cls_segms, cls_keyps)) for each image, in order.
+        """
+        if timers is None:
+            timers = defaultdict(Timer)
+        coordinator = Coordinator()
+        batch_queue = Queue.Queue(maxsize=self._queue_size)
+        inputs_queue = Queue.Queue(maxsize=self._queue_size)
+        outputs_queue = Queue.Queue(maxsize=self._queue_size)
+        results_queue = Queue.Queue()
+        # Bounds the number of batches in the pipeline, including the ones
+        # that are done but wait for earlier batches to be returned first
+        slots = Queue.Queue(
+            maxsize=3 * self._queue_size + self._num_prefetch_threads +
+            self._num_postprocess_threads + 1
+        )
+        threads = [
+            threading.Thread(
+                target=self._feed,
+                args=(coordinator, batches, slots, batch_queue, results_queue)
+            ),
+            threading.Thread(
+                target=self._execute,
+                args=(coordinator, inputs_queue, outputs_queue)
+            )
+        ]
+        threads += [
+            threading.Thread(
+                target=self._prefetch,
+                args=(coordinator, batch_queue, inputs_queue)
+            ) for _ in range(self._num_prefetch_threads)
+        ]
+        threads += [
+            threading.Thread(
+                target=self._postprocess,
+                args=(coordinator, outputs_queue, results_queue)
+            ) for _ in range(self._num_postprocess_threads)
+        ]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        try:
+            done = {}
+            seq = 0
+            while True:
+                while seq not in done:
+                    done_seq, item = coordinated_get(coordinator, results_queue)
+                    done[done_seq] = item
+                item = done.pop(seq)
+                if item is None:
+                    # All batches were returned
+                    break
+                batch, ims, results, stage_times = item
+                for k, v in stage_times.items():
+                    timers[k].add(v)
+                for (i, entry, _), im, im_results in zip(batch, ims, results):
+                    yield i, entry, im, im_results
+                slots.get()
+                seq += 1
+        finally:
+            coordinator.request_stop()
+            for t in threads:
+                t.join()
+
+    def _feed(self, coordinator, batches, slots, batch_queue, results_queue):
+        with coordinator.stop_on_exception():
+            seq = 0
+            for batch in batches:
+                coordinated_put(coordinator, slots, seq)
+                coordinated_put(coordinator, batch_queue, (seq, batch))
+                seq += 1
+            # Marks the end of the batches
+            results_queue.put((seq, None))
+
+    def _prefetch(self, coordinator, batch_queue, inputs_queue):
+        with coordinator.stop_on_exception():
+            while not coordinator.should_stop():
+                seq, batch = coordinated_get(coordinator, batch_queue)
+                ims = [
+                    image_utils.read_image(entry['image'])
+                    for _, entry, _ in batch
+                ]
+                if len(batch) == 1:
+                    box_proposals = batch[0][2]
+                    inputs = test._get_blobs(
+                        ims[0], box_proposals, cfg.TEST.SCALE,
+                        cfg.TEST.MAX_SIZE
+                    )
+                else:
+                    inputs = {}
+                    inputs['data'], im_scales, inputs['im_info'] = \
+                        blob_utils.get_image_blob_batch(
+                            ims, cfg.TEST.SCALE, cfg.TEST.MAX_SIZE
+                        )
+                    inputs = (inputs, im_scales)
+                coordinated_put(
+                    coordinator, inputs_queue, (seq, batch, ims, inputs)
+                )
+
+    def _execute(self, coordinator, inputs_queue, outputs_queue):
+        with coordinator.stop_on_exception():
+            with c2_utils.NamedCudaScope(self._gpu_id):
+                while not coordinator.should_stop():
+                    seq, batch, ims, inputs = coordinated_get(
+                        coordinator, inputs_queue
+                    )
+                    stage_times = {}
+                    outputs = self._run_nets(batch, ims, inputs, stage_times)
+                    coordinated_put(
+                        coordinator, outputs_queue,
+                        (seq, batch, ims, outputs, stage_times)
+                    )
+
+    def _run_nets(self, batch, ims, inputs, stage_times):
+        """Run the networks on the prepared inputs of a batch of images."""
+        model = self._model
+        start_time = time.time()
+        if len(batch) == 1:
+            inputs, im_scale = inputs
+            scores, boxes, _ = test.im_detect_bbox_from_inputs(
+                model, inputs, im_scale, ims[0].shape, batch[0][2]
+            )
+            scores, boxes, im_scales = [scores], [boxes], [im_scale]
+        else:
+            inputs, im_scales = inputs
+            scores, boxes = test.im_detect_bbox_batch_from_inputs(
+                model, inputs, im_scales, [im.shape for im in ims]
+            )
+        stage_times['im_detect_bbox'] = time.time() - start_time
+        if not cfg.MODEL.MASK_ON and not cfg.MODEL.KEYPOINTS_ON:
+            return scores, boxes, None, None, None
+
+        start_time = time.time()
+        dets = [
+            test.box_results_with_nms_and_limit(scores_i, boxes_i)
+            for scores_i, boxes_i in zip(scores, boxes)
+        ]
+        stage_times['misc_bbox'] = time.time() - start_time
+        nms_boxes = [boxes_i for _, boxes_i, _ in dets]
+        masks = None
+        heatmaps = None
+        if sum(boxes_i.shape[0] for boxes_i in nms_boxes) > 0:
+            if cfg.MODEL.MASK_ON:
+                start_time = time.time()
+                masks = test.im_detect_mask_batch(model, im_scales, nms_boxes)
+                stage_times['im_detect_mask'] = time.time() - start_time
+            if cfg.MODEL.KEYPOINTS_ON:
+                start_time = time.time()
+                heatmaps = test.im_detect_keypoints_batch(
+                    model, im_scales, nms_boxes
+                )
+                stage_times['im_detect_keypoints'] = time.time() - start_time
+        return None, None, dets, masks, heatmaps
+
+    def _postprocess(self, coordinator, outputs_queue, results_queue):
+        with coordinator.stop_on_exception():
+            while not coordinator.should_stop():
+                seq, batch, ims, outputs, stage_times = coordinated_get(
+                    coordinator, outputs_queue
+                )
+                results = self._get_results(ims, outputs, stage_times)
+                results_queue.put((seq, (batch, ims, results, stage_times)))
+
+    def _get_results(self, ims, outputs, stage_times):
+        """Turn the network outputs for a batch of images into detections."""
+        scores, boxes, dets, masks, heatmaps = outputs
+        if dets is None:
+            start_time = time.time()
+            dets = [
+                test.box_results_with_nms_and_limit(scores_i, boxes_i)
+                for scores_i, boxes_i in zip(scores, boxes)
+            ]
+            stage_times['misc_bbox'] = time.time() - start_time
+
+        results = []
+        for i, im in enumerate(ims):
+            _, boxes_i, cls_boxes_i = dets[i]
+            cls_segms_i = None
+            cls_keyps_i = None
+            if masks is not None and boxes_i.shape[0] > 0:
+                start_time = time.time()
+                cls_segms_i = test.segm_results(
+                    cls_boxes_i, masks[i], boxes_i, im.shape[0], im.shape[1]
+                )
+                stage_times['misc_mask'] = (
+                    stage_times.get('misc_mask', 0.) + time.time() - start_time
+                )
+            if heatmaps is not None and boxes_i.shape[0] > 0:
+                start_time = time.time()
+                cls_keyps_i = test.keypoint_results(
+                    cls_boxes_i, heatmaps[i], boxes_i
+                )
+                stage_times['misc_keypoints'] = (
+                    stage_times.get('misc_keypoints', 0.) + time.time() -
+                    start_time
+                )
+            results.append((cls_boxes_i, cls_segms_i, cls_keyps_i))
+        return results
@@ -0,0 +1,154 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Columnar (struct-of-arrays) roidb representation.
+
+A roidb is normally a list of per-image dicts, each holding several small
+numpy arrays and a sparse gt_overlaps matrix. ColumnarRoidb stores the per box
+arrays of all images concatenated into a few flat arrays plus an offset index,
+which takes far less memory and pickles much faster. Indexing a ColumnarRoidb
+returns a per-image dict with the usual roidb entry fields whose arrays are
+(read-only) views into the flat arrays, so code that consumes roidb entries
+can use it unchanged.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import scipy.sparse
+
+# Per box fields that are stored as flat concatenated arrays
+_BOX_FIELDS = (
+    'boxes', 'gt_classes', 'seg_areas', 'is_crowd', 'box_to_gt_ind_map',
+    'max_classes', 'max_overlaps', 'bbox_targets'
+)
+# Per gt box fields (without rows for the proposals) that are stored as flat
+# concatenated arrays
+_GT_FIELDS = ('gt_keypoints', )
+# Per image fields that are stored as one array element per image
+_IMAGE_FIELDS = ('id', 'height', 'width', 'flipped', 'has_visible_keypoints')
+
+
+class ColumnarRoidb(object):
+    """A read-only roidb that stores its fields as flat arrays."""
+
+    def __init__(self, roidb):
+        num_images = len(roidb)
+        assert num_images > 0, 'Cannot build a columnar roidb from no entries'
+        num_boxes = np.array(
+            [entry['boxes'].shape[0] for entry in roidb], dtype=np.int64
+        )
+        self._offsets = np.zeros(num_images + 1, dtype=np.int64)
+        np.cumsum(num_boxes, out=self._offsets[1:])
+        self._gt_offsets = None
+
+        self._box_fields = {}
+        for k in _BOX_FIELDS:
+            if k in roidb[0]:
+                self._box_fields[k] = _read_only(
+                    np.concatenate([entry[k] for entry in roidb])
+                )
+        self._gt_fields = {}
+        for k in _GT_FIELDS:
+            if k in roidb[0]:
+                num_gt_boxes = [entry[k].shape[0] for entry in roidb]
+                self._gt_offsets = np.zeros(num_images + 1, dtype=np.int64)
+                np.cumsum(num_gt_boxes, out=self._gt_offsets[1:])
+                self._gt_fields[k] = _read_only(
+                    np.concatenate([entry[k] for entry in roidb])
+                )
+        self._image_fields = {}
+        for k in _IMAGE_FIELDS:
+            self._image_fields[k] = _read_only(
+                np.array([entry[k] for entry in roidb])
+            )
+
+        # gt_overlaps of all images stacked into one CSR matrix
+        gt_overlaps = scipy.sparse.vstack(
+            [entry['gt_overlaps'] for entry in roidb], format='csr'
+        )
+        self._num_classes = gt_overlaps.shape[1]
+        self._overlaps_data = _read_only(gt_overlaps.data)
+        self._overlaps_indices = _read_only(gt_overlaps.indices)
+        self._overlaps_indptr = _read_only(gt_overlaps.indptr)
+
+        self.datasets = []
+        self._dataset_inds = np.zeros(num_images, dtype=np.int32)
+        self._images = []
+        self._segms = []
+        # Remaining (rarely present) fields, stored per image only if needed
+        self._extra_fields = [None] * num_images
+        known_fields = set(
+            _BOX_FIELDS + _GT_FIELDS + _IMAGE_FIELDS +
+            ('gt_overlaps', 'dataset', 'image', 'segms')
+        )
+        for i, entry in enumerate(roidb):
+            if entry['dataset'] not in self.datasets:
+                self.datasets.append(entry['dataset'])
+            self._dataset_inds[i] = self.datasets.index(entry['dataset'])
+            self._images.append(entry['image'])
+            self._segms.append(entry['segms'])
+            extra = {k: v for k, v in entry.items() if k not in known_fields}
+            if len(extra) > 0:
+                self._extra_fields[i] = extra
+
+    def __len__(self):
+        return len(self._images)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('roidb index {} out of range'.format(i))
+        start, end = self._offsets[i], self._offsets[i + 1]
+        entry = {}
+        if self._extra_fields[i] is not None:
+            entry.update(self._extra_fields[i])
+        for k, v in self._image_fields.items():
+            entry[k] = v[i].item()
+        for k, v in self._box_fields.items():
+            entry[k] = v[start:end]
+        for k, v in self._gt_fields.items():
+            entry[k] = v[self._gt_offsets[i]:self._gt_offsets[i + 1]]
+        ptr_start = self._overlaps_indptr[start]
+        ptr_end = self._overlaps_indptr[end]
+        entry['gt_overlaps'] = scipy.sparse.csr_matrix(
+            (
+                self._overlaps_data[ptr_start:ptr_end],
+                self._overlaps_indices[ptr_start:ptr_end],
+                self._overlaps_indptr[start:end + 1] - ptr_start
+            ),
+            shape=(end - start, self._num_classes)
+        )
+        entry['dataset'] = self.datasets[self._dataset_inds[i]]
+        entry['image'] = self._images[i]
+        entry['segms'] = self._segms[i]
+        return entry
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_image_sizes(self):
+        """Return the heights and widths of all images as arrays."""
+        return self._image_fields['height'], self._image_fields['width']
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
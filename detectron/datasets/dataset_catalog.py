@@ -34,6 +34,9 @@ _ANN_FN = 'annotation_file'
 _IM_PREFIX = 'image_prefix'
 _DEVKIT_DIR = 'devkit_directory'
 _RAW_DIR = 'raw_dir'
+# Index file of the dataset's images packed into shards by
+# tools/pack_image_shards.py; if given, images are read from the shards
+_IM_SHARDS = 'image_shards'
 
 # Available datasets
 _DATASETS = {
@@ -550,6 +553,13 @@ def get_im_prefix(name):
     return _DATASETS[name][_IM_PREFIX] if _IM_PREFIX in _DATASETS[name] else ''
 
 
+def get_im_shards(name):
+    """Retrieve the image shard index file for the dataset ('' if the images
+    are not packed into shards).
+    """
+    return _DATASETS[name][_IM_SHARDS] if _IM_SHARDS in _DATASETS[name] else ''
+
+
 def get_devkit_dir(name):
     """Retrieve the devkit dir for the dataset."""
     return _DATASETS[name][_DEVKIT_DIR]
@@ -40,8 +40,11 @@ from detectron.pycocotools import mask as COCOmask
 from detectron.pycocotools.coco import COCO
 
 from detectron.core.config import cfg
+from detectron.datasets.streaming_coco import StreamingCOCO
+from detectron.utils.image_shards import ImageShardIndex
 from detectron.utils.timer import Timer
 import detectron.datasets.dataset_catalog as dataset_catalog
+import detectron.datasets.mapped_proposals as mapped_proposals
 import detectron.utils.boxes as box_utils
 
 logger = logging.getLogger(__name__)
@@ -53,15 +56,26 @@ class JsonDataset(object):
     def __init__(self, name):
         assert dataset_catalog.contains(name), \
             'Unknown dataset name: {}'.format(name)
-        assert os.path.exists(dataset_catalog.get_im_dir(name)), \
-            'Im dir \'{}\' not found'.format(dataset_catalog.get_im_dir(name))
+        im_shards = dataset_catalog.get_im_shards(name)
+        if im_shards:
+            assert os.path.exists(im_shards), \
+                'Im shards \'{}\' not found'.format(im_shards)
+        else:
+            assert os.path.exists(dataset_catalog.get_im_dir(name)), \
+                'Im dir \'{}\' not found'.format(
+                    dataset_catalog.get_im_dir(name)
+                )
         assert os.path.exists(dataset_catalog.get_ann_fn(name)), \
             'Ann fn \'{}\' not found'.format(dataset_catalog.get_ann_fn(name))
         logger.debug('Creating: {}'.format(name))
         self.name = name
         self.image_directory = dataset_catalog.get_im_dir(name)
         self.image_prefix = dataset_catalog.get_im_prefix(name)
-        self.COCO = COCO(dataset_catalog.get_ann_fn(name))
+        self.image_shards = ImageShardIndex(im_shards) if im_shards else None
+        if cfg.DATA_LOADER.STREAMING_JSON:
+            self.COCO = StreamingCOCO(dataset_catalog.get_ann_fn(name))
+        else:
+            self.COCO = COCO(dataset_catalog.get_ann_fn(name))
         self.debug_timer = Timer()
         # Set up dataset classes
         category_ids = self.COCO.getCatIds()
@@ -104,10 +118,9 @@ class JsonDataset(object):
         if gt:
             # Include ground-truth object annotations
             self.debug_timer.tic()
-            for entry in roidb:
-                self._add_gt_annotations(entry)
+            self._add_gt_annotations_bulk(roidb)
             logger.debug(
-                '_add_gt_annotations took {:.3f}s'.
+                '_add_gt_annotations_bulk took {:.3f}s'.
                 format(self.debug_timer.toc(average=False))
             )
         if proposal_file is not None:
@@ -128,12 +141,20 @@ class JsonDataset(object):
         """Adds empty metadata fields to an roidb entry."""
         # Reference back to the parent dataset
         entry['dataset'] = self
-        # Make file_name an abs path
-        im_path = os.path.join(
-            self.image_directory, self.image_prefix + entry['file_name']
-        )
-        assert os.path.exists(im_path), 'Image \'{}\' not found'.format(im_path)
-        entry['image'] = im_path
+        if self.image_shards is not None:
+            # Refer to the image inside its shard
+            im_file = self.image_prefix + entry['file_name']
+            assert im_file in self.image_shards, \
+                'Image \'{}\' not found in shards'.format(im_file)
+            entry['image'] = self.image_shards.get_image_ref(im_file)
+        else:
+            # Make file_name an abs path
+            im_path = os.path.join(
+                self.image_directory, self.image_prefix + entry['file_name']
+            )
+            assert os.path.exists(im_path), \
+                'Image \'{}\' not found'.format(im_path)
+            entry['image'] = im_path
         entry['flipped'] = False
         entry['has_visible_keypoints'] = False
         # Empty placeholders
@@ -245,15 +266,146 @@ class JsonDataset(object):
             )
             entry['has_visible_keypoints'] = im_has_visible_keypoints
 
+    def _add_gt_annotations_bulk(self, roidb):
+        """Add ground truth annotation metadata to all entries of an roidb
+        whose entries have no boxes yet. Equivalent to calling
+        _add_gt_annotations on each entry, but the per-image arrays are built
+        with numpy operations over the annotations of all images at once.
+        """
+        num_images = len(roidb)
+        # Group the annotations by image, in the order of getAnnIds
+        objs = []
+        num_objs = np.zeros(num_images, dtype=np.int64)
+        for i, entry in enumerate(roidb):
+            assert entry['boxes'].shape[0] == 0
+            image_objs = self.COCO.imgToAnns.get(entry['id'], [])
+            objs.extend(image_objs)
+            num_objs[i] = len(image_objs)
+        for obj in objs:
+            # crowd regions are RLE encoded and stored as dicts
+            if isinstance(obj['segmentation'], list):
+                # Valid polygons have >= 3 points, so require >= 6 coordinates
+                obj['segmentation'] = [
+                    p for p in obj['segmentation'] if len(p) >= 6
+                ]
+        obj_im_inds = np.repeat(np.arange(num_images), num_objs)
+        heights = np.array([entry['height'] for entry in roidb])[obj_im_inds]
+        widths = np.array([entry['width'] for entry in roidb])[obj_im_inds]
+        areas = np.array([obj['area'] for obj in objs], dtype=np.float64)
+        ignore = np.array(
+            ['ignore' in obj and obj['ignore'] == 1 for obj in objs],
+            dtype=np.bool
+        )
+        # Sanitize bboxes -- some are invalid
+        xywh = np.array(
+            [obj['bbox'] for obj in objs], dtype=np.float64
+        ).reshape(-1, 4)
+        xyxy = box_utils.xywh_to_xyxy(xywh)
+        x1, y1, x2, y2 = box_utils.clip_xyxy_to_image(
+            xyxy[:, 0], xyxy[:, 1], xyxy[:, 2], xyxy[:, 3], heights, widths
+        )
+        # Require non-zero seg area and more than 1x1 box size
+        valid = (
+            (areas >= cfg.TRAIN.GT_MIN_AREA) & ~ignore & (areas > 0) &
+            (x2 > x1) & (y2 > y1)
+        )
+        valid_inds = np.where(valid)[0]
+        valid_objs = [objs[j] for j in valid_inds]
+        valid_im_inds = obj_im_inds[valid_inds]
+        num_valid_objs = len(valid_objs)
+        # valid_offsets[i]:valid_offsets[i + 1] are the valid objects of image i
+        valid_offsets = np.zeros(num_images + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(valid_im_inds, minlength=num_images),
+            out=valid_offsets[1:]
+        )
+
+        boxes = np.stack(
+            (x1[valid_inds], y1[valid_inds], x2[valid_inds], y2[valid_inds]),
+            axis=1
+        ).astype(np.float32)
+        gt_classes = np.array(
+            [
+                self.json_category_id_to_contiguous_id[obj['category_id']]
+                for obj in valid_objs
+            ],
+            dtype=np.int32
+        )
+        seg_areas = areas[valid_inds].astype(np.float32)
+        is_crowd = np.array(
+            [bool(obj['iscrowd']) for obj in valid_objs], dtype=np.bool
+        )
+        box_to_gt_ind_map = (
+            np.arange(num_valid_objs) - valid_offsets[valid_im_inds]
+        ).astype(np.int32)
+        if self.keypoints is not None:
+            keypoints = np.array(
+                [obj['keypoints'] for obj in valid_objs]
+            ).reshape(num_valid_objs, 3 * self.num_keypoints)
+            # (x, y, v) triplets -> (3, num_keypoints) per object
+            gt_keypoints = keypoints.reshape(
+                num_valid_objs, self.num_keypoints, 3
+            ).transpose(0, 2, 1).astype(np.int32)
+            visible = np.sum(gt_keypoints[:, 2, :], axis=1) > 0
+            im_has_visible_keypoints = np.bincount(
+                valid_im_inds[visible], minlength=num_images
+            ) > 0
+
+        # Build the gt_overlaps CSR matrices of all images at once. Crowd
+        # objects have an overlap of -1 for all classes so they will be
+        # excluded during training; other objects have an overlap of 1 with
+        # their class.
+        nnz = np.where(is_crowd, self.num_classes, 1)
+        indptr = np.zeros(num_valid_objs + 1, dtype=np.int32)
+        np.cumsum(nnz, out=indptr[1:])
+        nnz_is_crowd = np.repeat(is_crowd, nnz)
+        overlaps_data = np.where(nnz_is_crowd, -1.0, 1.0).astype(np.float32)
+        overlaps_indices = np.where(
+            nnz_is_crowd,
+            np.arange(indptr[-1]) - np.repeat(indptr[:-1], nnz),
+            np.repeat(gt_classes, nnz)
+        ).astype(np.int32)
+
+        for i, entry in enumerate(roidb):
+            start, end = valid_offsets[i], valid_offsets[i + 1]
+            entry['boxes'] = boxes[start:end]
+            entry['segms'].extend(
+                [obj['segmentation'] for obj in valid_objs[start:end]]
+            )
+            entry['gt_classes'] = gt_classes[start:end]
+            entry['seg_areas'] = seg_areas[start:end]
+            ptr_start, ptr_end = indptr[start], indptr[end]
+            entry['gt_overlaps'] = scipy.sparse.csr_matrix(
+                (
+                    overlaps_data[ptr_start:ptr_end],
+                    overlaps_indices[ptr_start:ptr_end],
+                    indptr[start:end + 1] - ptr_start
+                ),
+                shape=(end - start, self.num_classes)
+            )
+            entry['is_crowd'] = is_crowd[start:end]
+            entry['box_to_gt_ind_map'] = box_to_gt_ind_map[start:end]
+            if self.keypoints is not None:
+                entry['gt_keypoints'] = gt_keypoints[start:end]
+                entry['has_visible_keypoints'] = bool(
+                    im_has_visible_keypoints[i]
+                )
+
     def _add_proposals_from_file(
         self, roidb, proposal_file, min_proposal_size, top_k, crowd_thresh
     ):
         """Add proposals from a proposals file to an roidb."""
         logger.info('Loading proposals from: {}'.format(proposal_file))
-        with open(proposal_file, 'r') as f:
-            proposals = pickle.load(f)
-        id_field = 'indexes' if 'indexes' in proposals else 'ids'  # compat fix
-        _sort_proposals(proposals, id_field)
+        if mapped_proposals.is_mapped_proposal_file(proposal_file):
+            # Mapped proposals are sorted by id and read per image on access
+            proposals = mapped_proposals.load_mapped_proposals(proposal_file)
+            id_field = 'ids'
+        else:
+            with open(proposal_file, 'r') as f:
+                proposals = pickle.load(f)
+            # compat fix
+            id_field = 'indexes' if 'indexes' in proposals else 'ids'
+            _sort_proposals(proposals, id_field)
         box_list = []
         for i, entry in enumerate(roidb):
             if i % 2500 == 0:
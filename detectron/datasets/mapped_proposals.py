@@ -0,0 +1,162 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Memory-mapped proposal file format.
+
+A pickled proposal file holds lists of per-image box and score arrays, which
+must be unpickled in full (and sorted) before any of them can be used. A
+mapped proposal "file" is instead a directory with the proposals of all images
+stored in flat .npy arrays:
+
+    boxes.npy    (num_boxes, 4) float32 boxes of all images, concatenated
+    scores.npy   (num_boxes,) float32 scores
+    ids.npy      (num_images,) int64 image ids, sorted
+    offsets.npy  (num_images + 1,) int64 offsets: the proposals of image ids[i]
+                 are boxes[offsets[i]:offsets[i + 1]]
+
+The arrays are memory-mapped when loaded, so the proposals of an image are only
+read when they are used. A mapped proposal file can be used wherever a pickled
+proposal file can (e.g., in TRAIN.PROPOSAL_FILES).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os
+import shutil
+
+# Files of a mapped proposal file
+_MAPPED_FILES = (
+    'boxes.npy', 'scores.npy', 'ids.npy', 'offsets.npy', 'cfg.yaml'
+)
+
+
+def is_mapped_proposal_file(proposal_file):
+    """Check whether proposal_file is in the mapped proposal format."""
+    return os.path.isfile(os.path.join(proposal_file, 'offsets.npy'))
+
+
+def save_mapped_proposals(boxes, scores, ids, proposal_dir, cfg_yaml=None):
+    """Save lists of per-image box and score arrays for the given image ids in
+    the mapped proposal format. Optionally save the config used to generate
+    the proposals. An existing mapped proposal file (or a partially written
+    one) at proposal_dir is replaced; any other existing file or directory is
+    an error.
+    """
+    assert len(boxes) == len(scores) == len(ids)
+    proposal_dir = proposal_dir.rstrip('/')
+    if os.path.exists(proposal_dir) and not _is_mapped_output(proposal_dir):
+        raise IOError(
+            'Cannot save mapped proposals to {}: it exists and is not a '
+            'mapped proposal file'.format(proposal_dir)
+        )
+    # Write to a temporary directory first so that a partially written
+    # proposal file is never used
+    tmp_dir = '{}.tmp{}'.format(proposal_dir, os.getpid())
+    if os.path.exists(tmp_dir):
+        # Left over by a failed process with the same pid
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    try:
+        _write_mapped_proposals(boxes, scores, ids, tmp_dir, cfg_yaml)
+        if os.path.exists(proposal_dir):
+            shutil.rmtree(proposal_dir)
+        os.rename(tmp_dir, proposal_dir)
+    finally:
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+
+
+def _is_mapped_output(proposal_dir):
+    """Check whether proposal_dir is a directory that only holds the files of
+    a (possibly partially written) mapped proposal file.
+    """
+    return (
+        os.path.isdir(proposal_dir) and
+        set(os.listdir(proposal_dir)) <= set(_MAPPED_FILES)
+    )
+
+
+def _write_mapped_proposals(boxes, scores, ids, tmp_dir, cfg_yaml):
+    order = np.argsort(ids, kind='mergesort')
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum([boxes[i].shape[0] for i in order], out=offsets[1:])
+    flat_boxes = np.lib.format.open_memmap(
+        os.path.join(tmp_dir, 'boxes.npy'),
+        mode='w+',
+        dtype=np.float32,
+        shape=(offsets[-1], 4)
+    )
+    flat_scores = np.lib.format.open_memmap(
+        os.path.join(tmp_dir, 'scores.npy'),
+        mode='w+',
+        dtype=np.float32,
+        shape=(offsets[-1], )
+    )
+    for j, i in enumerate(order):
+        flat_boxes[offsets[j]:offsets[j + 1]] = boxes[i]
+        flat_scores[offsets[j]:offsets[j + 1]] = np.ravel(scores[i])
+    del flat_boxes, flat_scores
+    np.save(
+        os.path.join(tmp_dir, 'ids.npy'),
+        np.array(ids, dtype=np.int64)[order]
+    )
+    np.save(os.path.join(tmp_dir, 'offsets.npy'), offsets)
+    if cfg_yaml is not None:
+        with open(os.path.join(tmp_dir, 'cfg.yaml'), 'w') as f:
+            f.write(cfg_yaml)
+
+
+def load_mapped_proposals(proposal_dir):
+    """Load a mapped proposal file. Returns a dict with the same fields as a
+    (sorted) pickled proposal file: 'boxes' and 'scores' are sequences of
+    per-image arrays that are read from disk when indexed, and 'ids' is an
+    array of image ids.
+    """
+    offsets = np.load(os.path.join(proposal_dir, 'offsets.npy'))
+    return dict(
+        boxes=FlatArraySlices(
+            np.load(os.path.join(proposal_dir, 'boxes.npy'), mmap_mode='r'),
+            offsets
+        ),
+        scores=FlatArraySlices(
+            np.load(os.path.join(proposal_dir, 'scores.npy'), mmap_mode='r'),
+            offsets
+        ),
+        ids=np.load(os.path.join(proposal_dir, 'ids.npy'))
+    )
+
+
+class FlatArraySlices(object):
+    """Sequence of the per-image arrays stored in a flat (memory-mapped)
+    array. Indexing returns an in-memory copy of the array of an image.
+    """
+
+    def __init__(self, flat_array, offsets):
+        self._flat_array = flat_array
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('index {} out of range'.format(i))
+        return np.array(self._flat_array[self._offsets[i]:self._offsets[i + 1]])
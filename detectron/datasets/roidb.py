@@ -20,12 +20,16 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from collections import OrderedDict
 from past.builtins import basestring
 import logging
 import numpy as np
+import threading
 
 from detectron.core.config import cfg
+from detectron.datasets.columnar_roidb import ColumnarRoidb
 from detectron.datasets.json_dataset import JsonDataset
+import detectron.datasets.roidb_cache as roidb_cache
 import detectron.utils.boxes as box_utils
 import detectron.utils.keypoints as keypoint_utils
 import detectron.utils.segms as segm_utils
@@ -45,7 +49,7 @@ def combined_roidb_for_training(dataset_names, proposal_files):
             proposal_file=proposal_file,
             crowd_filter_thresh=cfg.TRAIN.CROWD_FILTER_THRESH
         )
-        if cfg.TRAIN.USE_FLIPPED:
+        if cfg.TRAIN.USE_FLIPPED and not cfg.DATA_LOADER.LAZY_FLIPPED_ROIDB:
             logger.info('Appending horizontally-flipped training examples...')
             extend_with_flipped_entries(roidb, ds)
         logger.info('Loaded dataset: {:s}'.format(ds.name))
@@ -58,15 +62,35 @@ def combined_roidb_for_training(dataset_names, proposal_files):
     if len(proposal_files) == 0:
         proposal_files = (None, ) * len(dataset_names)
     assert len(dataset_names) == len(proposal_files)
-    roidbs = [get_roidb(*args) for args in zip(dataset_names, proposal_files)]
-    roidb = roidbs[0]
-    for r in roidbs[1:]:
-        roidb.extend(r)
-    roidb = filter_for_training(roidb)
+    roidb = None
+    if cfg.DATA_LOADER.ROIDB_CACHE_DIR:
+        cache_file = roidb_cache.get_cache_file(dataset_names, proposal_files)
+        roidb = roidb_cache.load_roidb(cache_file)
+    if roidb is None:
+        roidbs = [
+            get_roidb(*args) for args in zip(dataset_names, proposal_files)
+        ]
+        roidb = roidbs[0]
+        for r in roidbs[1:]:
+            roidb.extend(r)
+        roidb = filter_for_training(roidb)
 
-    logger.info('Computing bounding-box regression targets...')
-    add_bbox_regression_targets(roidb)
-    logger.info('done')
+        logger.info('Computing bounding-box regression targets...')
+        add_bbox_regression_targets(roidb)
+        logger.info('done')
+
+        if cfg.DATA_LOADER.COLUMNAR_ROIDB:
+            logger.info('Converting roidb to columnar layout...')
+            roidb = ColumnarRoidb(roidb)
+
+        if cfg.DATA_LOADER.ROIDB_CACHE_DIR:
+            roidb_cache.save_roidb(roidb, cache_file)
+
+    if cfg.TRAIN.USE_FLIPPED and cfg.DATA_LOADER.LAZY_FLIPPED_ROIDB:
+        logger.info('Appending lazily flipped training examples...')
+        roidb = LazyFlippedRoidb(
+            roidb, cache_size=cfg.DATA_LOADER.FLIPPED_ROIDB_CACHE_SIZE
+        )
 
     _compute_and_log_stats(roidb)
 
@@ -80,34 +104,94 @@ def extend_with_flipped_entries(roidb, dataset):
     "Flipping" an entry means that that image and associated metadata (e.g.,
     ground truth boxes and object proposals) are horizontally flipped.
     """
-    flipped_roidb = []
-    for entry in roidb:
-        width = entry['width']
-        boxes = entry['boxes'].copy()
-        oldx1 = boxes[:, 0].copy()
-        oldx2 = boxes[:, 2].copy()
-        boxes[:, 0] = width - oldx2 - 1
-        boxes[:, 2] = width - oldx1 - 1
-        assert (boxes[:, 2] >= boxes[:, 0]).all()
-        flipped_entry = {}
-        dont_copy = ('boxes', 'segms', 'gt_keypoints', 'flipped')
-        for k, v in entry.items():
-            if k not in dont_copy:
-                flipped_entry[k] = v
-        flipped_entry['boxes'] = boxes
-        flipped_entry['segms'] = segm_utils.flip_segms(
-            entry['segms'], entry['height'], entry['width']
-        )
-        if dataset.keypoints is not None:
-            flipped_entry['gt_keypoints'] = keypoint_utils.flip_keypoints(
-                dataset.keypoints, dataset.keypoint_flip_map,
-                entry['gt_keypoints'], entry['width']
-            )
-        flipped_entry['flipped'] = True
-        flipped_roidb.append(flipped_entry)
+    flipped_roidb = [get_flipped_entry(entry, dataset) for entry in roidb]
     roidb.extend(flipped_roidb)
 
 
+def get_flipped_entry(entry, dataset):
+    """Return a horizontally flipped copy of a roidb entry."""
+    width = entry['width']
+    boxes = entry['boxes'].copy()
+    oldx1 = boxes[:, 0].copy()
+    oldx2 = boxes[:, 2].copy()
+    boxes[:, 0] = width - oldx2 - 1
+    boxes[:, 2] = width - oldx1 - 1
+    assert (boxes[:, 2] >= boxes[:, 0]).all()
+    flipped_entry = {}
+    dont_copy = ('boxes', 'segms', 'gt_keypoints', 'flipped')
+    for k, v in entry.items():
+        if k not in dont_copy:
+            flipped_entry[k] = v
+    flipped_entry['boxes'] = boxes
+    flipped_entry['segms'] = segm_utils.flip_segms(
+        entry['segms'], entry['height'], entry['width']
+    )
+    if dataset.keypoints is not None:
+        flipped_entry['gt_keypoints'] = keypoint_utils.flip_keypoints(
+            dataset.keypoints, dataset.keypoint_flip_map,
+            entry['gt_keypoints'], entry['width']
+        )
+    flipped_entry['flipped'] = True
+    return flipped_entry
+
+
+class LazyFlippedRoidb(object):
+    """A roidb of 2N entries made of N unflipped entries followed by their N
+    horizontally flipped counterparts. Flipped entries are only built when
+    they are accessed, optionally keeping the most recently used ones in an
+    LRU cache.
+    """
+
+    def __init__(self, roidb, cache_size=0):
+        # Entries must already be filtered (which is invariant to flipping) and
+        # have their bounding-box regression targets
+        self.unflipped_roidb = roidb
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return 2 * len(self.unflipped_roidb)
+
+    def __getitem__(self, i):
+        num_unflipped = len(self.unflipped_roidb)
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('roidb index {} out of range'.format(i))
+        if i < num_unflipped:
+            return self.unflipped_roidb[i]
+        with self._lock:
+            if i in self._cache:
+                self._cache[i] = self._cache.pop(i)
+                return self._cache[i]
+        entry = self.unflipped_roidb[i - num_unflipped]
+        flipped_entry = get_flipped_entry(entry, entry['dataset'])
+        # Regression targets depend on the (flipped) box coordinates
+        flipped_entry['bbox_targets'] = compute_bbox_regression_targets(
+            flipped_entry
+        )
+        if self._cache_size > 0:
+            with self._lock:
+                self._cache[i] = flipped_entry
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return flipped_entry
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_image_sizes(self):
+        """Return the heights and widths of all images as arrays."""
+        if hasattr(self.unflipped_roidb, 'get_image_sizes'):
+            heights, widths = self.unflipped_roidb.get_image_sizes()
+        else:
+            heights = np.array([r['height'] for r in self.unflipped_roidb])
+            widths = np.array([r['width'] for r in self.unflipped_roidb])
+        return np.tile(heights, 2), np.tile(widths, 2)
+
+
 def filter_for_training(roidb):
     """Remove roidb entries that have no usable RoIs based on config settings.
     """
@@ -183,11 +267,15 @@ def _compute_and_log_stats(roidb):
 
     # Histogram of ground-truth objects
     gt_hist = np.zeros((len(classes)), dtype=np.int)
+    num_copies = 1
+    if isinstance(roidb, LazyFlippedRoidb):
+        # Flipped entries have the same objects; avoid building them here
+        roidb, num_copies = roidb.unflipped_roidb, 2
     for entry in roidb:
         gt_inds = np.where(
             (entry['gt_classes'] > 0) & (entry['is_crowd'] == 0))[0]
         gt_classes = entry['gt_classes'][gt_inds]
-        gt_hist += np.histogram(gt_classes, bins=hist_bins)[0]
+        gt_hist += num_copies * np.histogram(gt_classes, bins=hist_bins)[0]
     logger.debug('Ground-truth class histogram:')
     for i, v in enumerate(gt_hist):
         logger.debug(
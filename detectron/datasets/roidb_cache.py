@@ -0,0 +1,171 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""On-disk cache of prepared training roidbs.
+
+A cached roidb is stored under a file name derived from a hash of everything
+that goes into building it: the cache format version, the dataset names, the
+contents of the annotation and proposal files, and the config options that
+change the roidb. Changing any of these inputs yields a different file name,
+so a stale roidb is never loaded and the roidb is rebuilt automatically.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import hashlib
+import logging
+import os
+
+from detectron.core.config import cfg
+from detectron.datasets.columnar_roidb import ColumnarRoidb
+from detectron.utils.io import save_object
+import detectron.datasets.dataset_catalog as dataset_catalog
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the layout of roidb entries changes
+_ROIDB_CACHE_VERSION = 2
+
+# Config options that affect the contents of a training roidb
+_ROIDB_CFG_KEYS = [
+    'TRAIN.USE_FLIPPED',
+    'TRAIN.CROWD_FILTER_THRESH',
+    'TRAIN.GT_MIN_AREA',
+    'TRAIN.FG_THRESH',
+    'TRAIN.BG_THRESH_HI',
+    'TRAIN.BG_THRESH_LO',
+    'TRAIN.BBOX_THRESH',
+    'MODEL.CLS_AGNOSTIC_BBOX_REG',
+    'MODEL.BBOX_REG_WEIGHTS',
+    'MODEL.KEYPOINTS_ON',
+    'DATA_LOADER.COLUMNAR_ROIDB',
+    'DATA_LOADER.LAZY_FLIPPED_ROIDB',
+]
+
+
+class CachedDatasetInfo(object):
+    """Stands in for the JsonDataset referenced by the entries of a cached
+    roidb. It holds the dataset metadata (classes, category maps, keypoints)
+    but not the COCO API object or the image shard index, which are large and
+    slow to pickle.
+    """
+
+    def __init__(self, dataset):
+        for k, v in dataset.__dict__.items():
+            if k not in ('COCO', 'debug_timer', 'image_shards'):
+                setattr(self, k, v)
+
+
+def get_cache_file(dataset_names, proposal_files):
+    """Return the cache file for the roidb built from the given datasets and
+    proposal files under the current config.
+    """
+    key_parts = ['version={}'.format(_ROIDB_CACHE_VERSION)]
+    for name, proposal_file in zip(dataset_names, proposal_files):
+        key_parts += [
+            'dataset={}'.format(name),
+            'im_dir={}'.format(dataset_catalog.get_im_dir(name)),
+            'im_prefix={}'.format(dataset_catalog.get_im_prefix(name)),
+            'ann_fn={}'.format(
+                _get_file_md5sum(dataset_catalog.get_ann_fn(name))
+            ),
+        ]
+        im_shards = dataset_catalog.get_im_shards(name)
+        if im_shards:
+            # Image references point into the shards listed by the index
+            key_parts.append('im_shards={}'.format(_get_file_md5sum(im_shards)))
+        if proposal_file is not None:
+            key_parts.append(
+                'proposal_file={}'.format(_get_file_md5sum(proposal_file))
+            )
+    for key in _ROIDB_CFG_KEYS:
+        value = cfg
+        for k in key.split('.'):
+            value = value[k]
+        key_parts.append('{}={}'.format(key, value))
+    key_hash = hashlib.md5('\n'.join(key_parts).encode('utf-8')).hexdigest()
+    return os.path.join(
+        cfg.DATA_LOADER.ROIDB_CACHE_DIR,
+        'roidb_{}.pkl'.format(key_hash)
+    )
+
+
+def load_roidb(cache_file):
+    """Load a cached roidb. Returns None if there is no usable cache file."""
+    if not os.path.exists(cache_file):
+        return None
+    logger.info('Loading cached roidb from: {}'.format(cache_file))
+    try:
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        logger.warning(
+            'Failed to load cached roidb {} ({}); rebuilding'.format(
+                cache_file, e
+            )
+        )
+        return None
+
+
+def save_roidb(roidb, cache_file):
+    """Save a roidb to the cache. References to JsonDataset objects in the
+    roidb are replaced by CachedDatasetInfo objects.
+    """
+    if isinstance(roidb, ColumnarRoidb):
+        roidb.datasets = [_get_dataset_info(d) for d in roidb.datasets]
+    else:
+        infos = {}
+        for entry in roidb:
+            dataset = entry['dataset']
+            if id(dataset) not in infos:
+                infos[id(dataset)] = _get_dataset_info(dataset)
+            entry['dataset'] = infos[id(dataset)]
+    cache_dir = os.path.dirname(cache_file)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    # Write to a temporary file first so that concurrent jobs never see a
+    # partially written cache file
+    tmp_file = '{}.tmp{}'.format(cache_file, os.getpid())
+    save_object(roidb, tmp_file)
+    os.rename(tmp_file, cache_file)
+    logger.info('Wrote roidb cache to: {}'.format(cache_file))
+
+
+def _get_dataset_info(dataset):
+    if isinstance(dataset, CachedDatasetInfo):
+        return dataset
+    return CachedDatasetInfo(dataset)
+
+
+def _get_file_md5sum(file_name):
+    """Compute the md5 hash of a (possibly large) file, or of the files in a
+    directory (such as a mapped proposal file).
+    """
+    hash_obj = hashlib.md5()
+    if os.path.isdir(file_name):
+        file_names = [
+            os.path.join(file_name, f) for f in sorted(os.listdir(file_name))
+        ]
+    else:
+        file_names = [file_name]
+    for file_name in file_names:
+        with open(file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                hash_obj.update(chunk)
+    return hash_obj.hexdigest()
@@ -0,0 +1,259 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""COCO API object built by streaming the annotation file.
+
+The COCO API loads an annotation file with json.load, which holds the entire
+file contents and every parsed object in memory at once, and then builds
+several indexes over the parsed objects. For large annotation files this
+takes several GB of memory in every process that loads the dataset.
+StreamingCOCO instead reads the file in fixed size chunks and parses the
+images, categories and annotations one object at a time, dropping fields that
+Detectron does not use as it goes.
+
+Annotations are only loaded when they are first used (e.g., to build a
+training roidb or to evaluate results), by a second pass that reads just the
+annotation array of the file. Processes that only need the images and
+categories, such as the inference subprocesses started by test_net, never load
+the annotations.
+
+StreamingCOCO builds only the indexes used by JsonDataset and by the
+evaluation code (imgs, cats, anns and imgToAnns); dataset['images'] and
+dataset['categories'] are kept, but not dataset['annotations'] or catToImgs, so
+queries that rely on these (e.g., getImgIds(catIds=...) or getAnnIds() without
+imgIds) are not supported.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import json
+import logging
+import time
+
+from detectron.pycocotools.coco import COCO
+
+logger = logging.getLogger(__name__)
+
+# Annotation fields used by Detectron (including the evaluation code); other
+# fields are dropped
+ANNOTATION_FIELDS = (
+    'id', 'image_id', 'category_id', 'bbox', 'area', 'iscrowd', 'ignore',
+    'segmentation', 'keypoints', 'num_keypoints'
+)
+# Image fields that are never used by Detectron (and are removed from roidb
+# entries by JsonDataset)
+UNUSED_IMAGE_FIELDS = ('date_captured', 'url', 'license')
+
+_WHITESPACE = b' \t\n\r'
+
+
+class StreamingCOCO(COCO):
+    """COCO API object that is loaded incrementally from an annotation file.
+    """
+
+    def __init__(
+        self,
+        annotation_file,
+        annotation_fields=ANNOTATION_FIELDS,
+        chunk_size=2**22
+    ):
+        # Unlike COCO.__init__, anns and imgToAnns are not set here; they are
+        # created by _load_annotations when first accessed (see __getattr__)
+        self.annotation_file = annotation_file
+        self.cats = {}
+        self.imgs = {}
+        self.catToImgs = defaultdict(list)
+        # json decodes each streamed object separately, so equal dict keys of
+        # different objects are different string objects. Replacing them with
+        # a single instance per key saves a lot of memory.
+        self._annotation_fields = {k: k for k in annotation_fields}
+        self._image_fields = {}
+        self._chunk_size = chunk_size
+        self._annotations_offset = None
+        logger.info('Streaming annotation file: {}'.format(annotation_file))
+        tic = time.time()
+        images = []
+        categories = []
+
+        def add_image(img):
+            img = {
+                self._image_fields.setdefault(k, k): v
+                for k, v in img.items() if k not in UNUSED_IMAGE_FIELDS
+            }
+            images.append(img)
+            self.imgs[img['id']] = img
+
+        def add_category(cat):
+            categories.append(cat)
+            self.cats[cat['id']] = cat
+
+        def skip_annotation(ann):
+            pass
+
+        with open(annotation_file, 'rb') as f:
+            reader = _JsonStreamReader(f, chunk_size)
+            self.dataset = reader.read_object(
+                {
+                    'images': add_image,
+                    'categories': add_category,
+                    'annotations': skip_annotation,
+                }
+            )
+            self._annotations_offset = reader.array_offsets.get('annotations')
+        self.dataset['images'] = images
+        self.dataset['categories'] = categories
+        logger.info(
+            'Loaded {} images and {} categories in {:.2f}s'.format(
+                len(self.imgs), len(self.cats), time.time() - tic
+            )
+        )
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set
+        if name in ('anns', 'imgToAnns') and '_annotation_fields' in \
+                self.__dict__:
+            self._load_annotations()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def _load_annotations(self):
+        tic = time.time()
+        anns = {}
+        img_to_anns = defaultdict(list)
+
+        def add_annotation(ann):
+            ann = {
+                self._annotation_fields[k]: v
+                for k, v in ann.items() if k in self._annotation_fields
+            }
+            img_to_anns[ann['image_id']].append(ann)
+            anns[ann['id']] = ann
+
+        if self._annotations_offset is not None:
+            with open(self.annotation_file, 'rb') as f:
+                f.seek(self._annotations_offset)
+                reader = _JsonStreamReader(f, self._chunk_size)
+                reader.read_array(add_annotation)
+        self.anns = anns
+        self.imgToAnns = img_to_anns
+        logger.info(
+            'Loaded {} annotations in {:.2f}s'.format(
+                len(anns), time.time() - tic
+            )
+        )
+
+
+class _JsonStreamReader(object):
+    """Incremental reader of a JSON file whose top level value is an object.
+    The elements of selected top level arrays are parsed one at a time and
+    passed to a callback instead of being collected.
+    """
+
+    def __init__(self, f, chunk_size):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = b''
+        self._pos = 0
+        # File offset of the start of the buffer
+        self._buf_offset = f.tell()
+        self._eof = False
+        # File offsets of the streamed arrays, by key
+        self.array_offsets = {}
+
+    def read_object(self, array_callbacks):
+        """Read the top level object. Arrays under the keys of array_callbacks
+        are streamed to the corresponding callbacks; all other values are
+        returned in a dict.
+        """
+        values = {}
+        self._expect(b'{')
+        if self._peek() == b'}':
+            self._pos += 1
+            return values
+        while True:
+            key = self._read_value()
+            self._expect(b':')
+            if key in array_callbacks and self._peek() == b'[':
+                self.array_offsets[key] = self._buf_offset + self._pos
+                self.read_array(array_callbacks[key])
+            else:
+                values[key] = self._read_value()
+            if self._expect(b',}') == b'}':
+                return values
+
+    def read_array(self, callback):
+        """Read an array, passing each of its elements to callback."""
+        self._expect(b'[')
+        if self._peek() == b']':
+            self._pos += 1
+            return
+        while True:
+            callback(self._read_value())
+            if self._expect(b',]') == b']':
+                return
+
+    def _read_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # A number at the end of the buffer may be truncated
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except ValueError:
+                # Includes values that are truncated at the end of the buffer
+                if self._eof:
+                    raise
+            self._read_chunk()
+
+    def _peek(self):
+        """Skip whitespace and return the next character."""
+        while True:
+            while (
+                self._pos < len(self._buf) and
+                self._buf[self._pos] in _WHITESPACE
+            ):
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if self._eof:
+                raise ValueError('Unexpected end of JSON file')
+            self._read_chunk()
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c not in chars:
+            raise ValueError(
+                'Expected one of {} but found {} in JSON file'.format(
+                    repr(chars), repr(c)
+                )
+            )
+        self._pos += 1
+        return c
+
+    def _read_chunk(self):
+        chunk = self._f.read(self._chunk_size)
+        if len(chunk) == 0:
+            self._eof = True
+        # Drop the consumed part of the buffer
+        self._buf = self._buf[self._pos:] + chunk
+        self._buf_offset += self._pos
+        self._pos = 0
@@ -57,6 +57,8 @@ class DetectionModelHelper(cnn.CNNModelHelper):
         kwargs['cudnn_exhaustive_search'] = False
         super(DetectionModelHelper, self).__init__(**kwargs)
         self.roi_data_loader = None
+        # Saved roi_data_loader state to resume training from (if any)
+        self.roi_data_loader_state = None
         self.losses = []
         self.metrics = []
         self.do_not_update_params = []  # Param on this list are not updated
@@ -144,7 +146,8 @@ class DetectionModelHelper(cnn.CNNModelHelper):
 
         blobs_in:
           - 'rpn_rois': 2D tensor of RPN proposals output by GenerateProposals
-          - 'roidb': roidb entries that will be labeled
+          - 'roidb': roidb entries that will be labeled (serialized or
+            referenced in the roidb store; see roi_data.roidb_store)
           - 'im_info': See GenerateProposals doc.
 
         blobs_out:
@@ -78,14 +78,32 @@ def add_fast_rcnn_losses(model):
         ['cls_score', 'labels_int32'], ['cls_prob', 'loss_cls'],
         scale=model.GetLossScale()
     )
-    loss_bbox = model.net.SmoothL1Loss(
-        [
-            'bbox_pred', 'bbox_targets', 'bbox_inside_weights',
-            'bbox_outside_weights'
-        ],
-        'loss_bbox',
-        scale=model.GetLossScale()
-    )
+    if cfg.FAST_RCNN.COMPACT_BBOX_TARGETS:
+        # SelectSmoothL1Loss reads the 4 predictions at each location (roi_idx,
+        # 4 * class, 0, 0) of a 4D blob and averages the loss by the number of
+        # RoIs, as SmoothL1Loss does with expanded targets and weights
+        model.net.Reshape(
+            'bbox_pred', ['bbox_pred_4d', '_bbox_pred_shape'],
+            shape=(0, -1, 1, 1)
+        )
+        loss_bbox = model.net.SelectSmoothL1Loss(
+            [
+                'bbox_pred_4d', 'bbox_targets', 'bbox_target_locs',
+                'bbox_loss_normalizer'
+            ],
+            'loss_bbox',
+            beta=1.0,
+            scale=model.GetLossScale()
+        )
+    else:
+        loss_bbox = model.net.SmoothL1Loss(
+            [
+                'bbox_pred', 'bbox_targets', 'bbox_inside_weights',
+                'bbox_outside_weights'
+            ],
+            'loss_bbox',
+            scale=model.GetLossScale()
+        )
     loss_gradients = blob_utils.get_loss_gradients(model, [loss_cls, loss_bbox])
     model.Accuracy(['cls_prob', 'labels_int32'], 'accuracy_cls')
     model.AddLosses(['loss_cls', 'loss_bbox'])
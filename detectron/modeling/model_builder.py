@@ -385,7 +385,18 @@ def add_training_inputs(model, roidb=None):
             roidb,
             num_loaders=cfg.DATA_LOADER.NUM_THREADS,
             minibatch_queue_size=cfg.DATA_LOADER.MINIBATCH_QUEUE_SIZE,
-            blobs_queue_capacity=cfg.DATA_LOADER.BLOBS_QUEUE_CAPACITY
+            blobs_queue_capacity=cfg.DATA_LOADER.BLOBS_QUEUE_CAPACITY,
+            use_processes=cfg.DATA_LOADER.USE_PROCESSES,
+            use_shared_ring=cfg.DATA_LOADER.USE_SHARED_RING,
+            shared_ring_size=cfg.DATA_LOADER.SHARED_RING_SIZE,
+            min_loaders=(
+                cfg.DATA_LOADER.MIN_THREADS
+                if cfg.DATA_LOADER.AUTOSCALE else None
+            ),
+            max_loaders=(
+                cfg.DATA_LOADER.MAX_THREADS
+                if cfg.DATA_LOADER.AUTOSCALE else None
+            )
         )
     orig_num_op = len(model.net._net.op)
     blob_names = roi_data_minibatch.get_minibatch_blob_names(is_training=True)
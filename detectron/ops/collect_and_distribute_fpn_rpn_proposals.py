@@ -25,6 +25,7 @@ from detectron.datasets import json_dataset
 from detectron.datasets import roidb as roidb_utils
 import detectron.modeling.FPN as fpn
 import detectron.roi_data.fast_rcnn as fast_rcnn_roi_data
+import detectron.roi_data.roidb_store as roidb_store
 import detectron.utils.blob as blob_utils
 
 
@@ -48,7 +49,7 @@ class CollectAndDistributeFpnRpnProposalsOp(object):
             # im_info: [[im_height, im_width, im_scale], ...]
             im_info = inputs[-1].data
             im_scales = im_info[:, 2]
-            roidb = blob_utils.deserialize(inputs[-2].data)
+            roidb = roidb_store.roidb_from_blob(inputs[-2].data)
             # For historical consistency with the original Faster R-CNN
             # implementation we are *not* filtering crowd proposals.
             # This choice should be investigated in the future (it likely does
@@ -83,11 +84,30 @@ def collect(inputs, is_training):
     # Combine predictions across all levels and retain the top scoring
     rois = np.concatenate([blob.data for blob in roi_inputs])
     scores = np.concatenate([blob.data for blob in score_inputs]).squeeze()
-    inds = np.argsort(-scores)[:post_nms_topN]
+    if is_training:
+        inds = np.argsort(-scores)[:post_nms_topN]
+    else:
+        # Images inferred in a batch (TEST.IMS_PER_BATCH > 1) each keep their
+        # own top scoring proposals
+        inds = np.concatenate([
+            im_inds[np.argsort(-scores[im_inds])[:post_nms_topN]]
+            for im_inds in _get_inds_per_image(rois[:, 0])
+        ])
     rois = rois[inds, :]
     return rois
 
 
+def _get_inds_per_image(batch_inds):
+    """Return the indices of the rois of each image given their batch indices,
+    in increasing order of batch index.
+    """
+    if len(batch_inds) == 0:
+        return [np.zeros(0, dtype=np.int64)]
+    return [
+        np.where(batch_inds == i)[0] for i in np.unique(batch_inds)
+    ]
+
+
 def distribute(rois, label_blobs, outputs, train):
     """To understand the output blob order see return value of
     detectron.roi_data.fast_rcnn.get_fast_rcnn_blob_names(is_training=False)
@@ -22,6 +22,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from collections import namedtuple
+from collections import OrderedDict
 import logging
 import numpy as np
 import threading
@@ -43,9 +44,26 @@ FieldOfAnchors = namedtuple(
     ]
 )
 
+# Anchors of a field of anchors (or of several concatenated fields of anchors)
+# that are inside an image:
+#   - inds: indices of the inside anchors in the field of anchors
+#   - positions: position of each anchor of the field in inds (-1 for anchors
+#     outside the image), or None if all anchors are inside
+#   - anchors: the inside anchors (read-only)
+InsideAnchors = namedtuple('InsideAnchors', ['inds', 'positions', 'anchors'])
+
 # Cache for memoizing _get_field_of_anchors
 _threadlocal_foa = threading.local()
 
+# Cache for memoizing get_inside_anchors, bounded to the most recently used
+# image sizes (most images are scaled to one of a few sizes)
+_threadlocal_inside_anchors = threading.local()
+_INSIDE_ANCHORS_CACHE_SIZE = 8
+
+# Relative cost of computing the overlap of one anchor / gt box pair in
+# _match_anchors_to_gt_sparse and in the dense overlap matrix
+_SPARSE_MATCHING_COST = 10
+
 
 def get_field_of_anchors(
     stride, anchor_sizes, anchor_aspect_ratios, octave=None, aspect=None
@@ -101,6 +119,55 @@ def get_field_of_anchors(
     return foa
 
 
+def get_inside_anchors(
+    foas, all_anchors, im_height, im_width, straddle_thresh
+):
+    """Return the InsideAnchors of all_anchors, the concatenation of the fields
+    of anchors in foas, for an image of the given size. Anchors are inside if
+    they are inside the image by a margin of straddle_thresh; all anchors are
+    inside if straddle_thresh is negative.
+    """
+    global _threadlocal_inside_anchors
+    if not hasattr(_threadlocal_inside_anchors, 'cache'):
+        _threadlocal_inside_anchors.cache = OrderedDict()
+    cache = _threadlocal_inside_anchors.cache
+
+    # Fields of anchors are memoized (see get_field_of_anchors), so their
+    # arrays identify them
+    cache_key = (
+        tuple(id(foa.field_of_anchors) for foa in foas), im_height, im_width,
+        straddle_thresh
+    )
+    inside_anchors = cache.pop(cache_key, None)
+    if inside_anchors is None:
+        if straddle_thresh >= 0:
+            inds = np.where(
+                (all_anchors[:, 0] >= -straddle_thresh) &
+                (all_anchors[:, 1] >= -straddle_thresh) &
+                (all_anchors[:, 2] < im_width + straddle_thresh) &
+                (all_anchors[:, 3] < im_height + straddle_thresh)
+            )[0]
+            positions = np.empty((all_anchors.shape[0], ), dtype=np.int64)
+            positions.fill(-1)
+            positions[inds] = np.arange(len(inds))
+            anchors = all_anchors[inds, :]
+        else:
+            inds = np.arange(all_anchors.shape[0])
+            positions = None
+            anchors = all_anchors.copy()
+        for v in (inds, positions, anchors):
+            if v is not None:
+                v.flags.writeable = False
+        inside_anchors = InsideAnchors(
+            inds=inds, positions=positions, anchors=anchors
+        )
+        if len(cache) >= _INSIDE_ANCHORS_CACHE_SIZE:
+            cache.popitem(last=False)
+    # (Re)insert as the most recently used
+    cache[cache_key] = inside_anchors
+    return inside_anchors
+
+
 def unmap(data, count, inds, fill=0):
     """Unmap a subset of item (data) back to the original set of items (of
     size count)"""
@@ -123,3 +190,171 @@ def compute_targets(ex_rois, gt_rois, weights=(1.0, 1.0, 1.0, 1.0)):
     return box_utils.bbox_transform_inv(ex_rois, gt_rois, weights).astype(
         np.float32, copy=False
     )
+
+
+def match_anchors_to_gt(
+    foas, all_anchors, inds_inside, gt_boxes, inside_positions=None
+):
+    """Match the anchors all_anchors[inds_inside] to gt boxes. all_anchors must
+    be the concatenation of the fields of anchors in foas. inside_positions
+    optionally gives the position of each anchor in inds_inside (as in
+    InsideAnchors.positions).
+
+    Returns, as computed from the anchor by gt box overlap matrix:
+      - anchor_to_gt_argmax: index of the gt box with the highest overlap with
+        each anchor (the first one in case of ties; 0 if there is none)
+      - anchor_to_gt_max: highest overlap of each anchor with a gt box
+      - anchors_with_max_overlap: indices of the anchors that have the highest
+        overlap (including ties) with some gt box
+    """
+    if cfg.TRAIN.SPARSE_ANCHOR_MATCHING:
+        match = _match_anchors_to_gt_sparse(
+            foas, all_anchors, inds_inside, gt_boxes, inside_positions
+        )
+        if match is not None:
+            return match
+    return _match_anchors_to_gt_dense(all_anchors[inds_inside, :], gt_boxes)
+
+
+def _match_anchors_to_gt_dense(anchors, gt_boxes):
+    # Compute overlaps between the anchors and the gt boxes overlaps
+    anchor_by_gt_overlap = box_utils.bbox_overlaps(anchors, gt_boxes)
+    # Map from anchor to gt box that has highest overlap
+    anchor_to_gt_argmax = anchor_by_gt_overlap.argmax(axis=1)
+    # For each anchor, amount of overlap with most overlapping gt box
+    anchor_to_gt_max = anchor_by_gt_overlap[np.arange(anchors.shape[0]),
+                                            anchor_to_gt_argmax]
+    # Map from gt box to an anchor that has highest overlap
+    gt_to_anchor_argmax = anchor_by_gt_overlap.argmax(axis=0)
+    # For each gt box, amount of overlap with most overlapping anchor
+    gt_to_anchor_max = anchor_by_gt_overlap[
+        gt_to_anchor_argmax,
+        np.arange(anchor_by_gt_overlap.shape[1])
+    ]
+    # Find all anchors that share the max overlap amount
+    # (this includes many ties)
+    anchors_with_max_overlap = np.where(
+        anchor_by_gt_overlap == gt_to_anchor_max
+    )[0]
+    return anchor_to_gt_argmax, anchor_to_gt_max, anchors_with_max_overlap
+
+
+def _match_anchors_to_gt_sparse(
+    foas, all_anchors, inds_inside, gt_boxes, inside_positions=None
+):
+    """Same as _match_anchors_to_gt_dense(all_anchors[inds_inside], gt_boxes),
+    but only computes the overlaps of the anchors that can overlap each gt box.
+    These are found from the (regular) layout of the fields of anchors: an
+    anchor of a field is a cell anchor shifted by a multiple of the stride.
+
+    Returns None if some gt box does not overlap any anchor (then all anchors
+    tie for the highest overlap with it, zero), or if the candidate pairs are
+    not much fewer than all pairs (e.g., with large anchors at a small stride);
+    a dense match is then as fast.
+    """
+    num_gt = gt_boxes.shape[0]
+    num_inside = len(inds_inside)
+    if num_inside == 0:
+        return None
+    gt = gt_boxes.astype(np.float64)
+    fields = []
+    start_idx = 0
+    for foa in foas:
+        F = foa.field_size
+        A = foa.num_cell_anchors
+        stride = float(foa.stride)
+        # The anchors at grid cell (0, 0) are the cell anchors
+        cell_anchors = foa.field_of_anchors[:A].astype(np.float64)
+        # An anchor overlaps a gt box (i.e., bbox_overlaps is positive) if
+        #   anchor_x1 - 1 < gt_x2 and anchor_x2 + 1 > gt_x1
+        # (and similarly for y); find the range of grid cells at which each
+        # (gt box, cell anchor) pair satisfies this, in shape (num_gt, A)
+        x_lo = np.floor((gt[:, [0]] - 1 - cell_anchors[:, 2]) / stride)
+        x_hi = np.ceil((gt[:, [2]] + 1 - cell_anchors[:, 0]) / stride)
+        y_lo = np.floor((gt[:, [1]] - 1 - cell_anchors[:, 3]) / stride)
+        y_hi = np.ceil((gt[:, [3]] + 1 - cell_anchors[:, 1]) / stride)
+        x_lo, x_hi, y_lo, y_hi = [
+            np.clip(v, 0, F - 1).astype(np.int64)
+            for v in (x_lo, x_hi, y_lo, y_hi)
+        ]
+        nx = np.maximum(x_hi - x_lo + 1, 0).ravel()
+        ny = np.maximum(y_hi - y_lo + 1, 0).ravel()
+        fields.append((start_idx, F, A, x_lo.ravel(), y_lo.ravel(), nx, ny))
+        start_idx += F * F * A
+    assert start_idx == all_anchors.shape[0], \
+        'Fields of anchors do not match all_anchors'
+    # Computing the overlaps of a candidate pair costs about as much as
+    # computing _SPARSE_MATCHING_COST overlaps in the dense overlap matrix
+    num_cand = sum(np.sum(f[5] * f[6]) for f in fields)
+    if num_cand * _SPARSE_MATCHING_COST > num_inside * num_gt:
+        return None
+
+    cand_anchor_inds = []
+    cand_gt_inds = []
+    for start_idx, F, A, x_lo, y_lo, nx, ny in fields:
+        counts = nx * ny
+        num_field_cand = counts.sum()
+        if num_field_cand == 0:
+            continue
+        # Enumerate the cells of each (gt box, cell anchor) pair
+        groups = np.repeat(np.arange(num_gt * A), counts)
+        cells = np.arange(num_field_cand) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        a = groups % A
+        nx = nx[groups]
+        x = x_lo[groups] + cells % nx
+        y = y_lo[groups] + cells // nx
+        cand_anchor_inds.append(start_idx + (y * F + x) * A + a)
+        cand_gt_inds.append(groups // A)
+    if len(cand_anchor_inds) == 0:
+        return None
+    cand_anchor_inds = np.concatenate(cand_anchor_inds)
+    cand_gt_inds = np.concatenate(cand_gt_inds)
+
+    # Map the candidates to indices into inds_inside
+    if num_inside < all_anchors.shape[0]:
+        if inside_positions is None:
+            inside_positions = np.empty(
+                (all_anchors.shape[0], ), dtype=np.int64
+            )
+            inside_positions.fill(-1)
+            inside_positions[inds_inside] = np.arange(num_inside)
+        cand_pos = inside_positions[cand_anchor_inds]
+        keep = cand_pos >= 0
+        cand_anchor_inds = cand_anchor_inds[keep]
+        cand_gt_inds = cand_gt_inds[keep]
+        cand_pos = cand_pos[keep]
+    else:
+        cand_pos = cand_anchor_inds
+    order = np.argsort(cand_gt_inds, kind='mergesort')
+    cand_anchor_inds = cand_anchor_inds[order]
+    cand_pos = cand_pos[order]
+    gt_counts = np.bincount(cand_gt_inds, minlength=num_gt)
+    gt_ends = np.cumsum(gt_counts)
+
+    anchor_to_gt_argmax = np.zeros((num_inside, ), dtype=np.int64)
+    anchor_to_gt_max = np.zeros((num_inside, ), dtype=np.float32)
+    anchors_with_max_overlap = []
+    for j in range(num_gt):
+        start, end = gt_ends[j] - gt_counts[j], gt_ends[j]
+        if start == end:
+            return None
+        pos = cand_pos[start:end]
+        # Computed per pair exactly as in the dense overlap matrix
+        overlaps = box_utils.bbox_overlaps(
+            all_anchors[cand_anchor_inds[start:end], :], gt_boxes[j:j + 1, :]
+        )[:, 0]
+        gt_max = overlaps.max()
+        if gt_max <= 0:
+            return None
+        anchors_with_max_overlap.append(pos[overlaps == gt_max])
+        # Update the best match of each anchor only on a strictly higher
+        # overlap, so that ties go to the first gt box (as with argmax)
+        better = overlaps > anchor_to_gt_max[pos]
+        anchor_to_gt_max[pos[better]] = overlaps[better]
+        anchor_to_gt_argmax[pos[better]] = j
+    anchors_with_max_overlap = np.unique(
+        np.concatenate(anchors_with_max_overlap)
+    )
+    return anchor_to_gt_argmax, anchor_to_gt_max, anchors_with_max_overlap
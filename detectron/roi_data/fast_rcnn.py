@@ -31,6 +31,7 @@ from detectron.core.config import cfg
 import detectron.modeling.FPN as fpn
 import detectron.roi_data.keypoint_rcnn as keypoint_rcnn_roi_data
 import detectron.roi_data.mask_rcnn as mask_rcnn_roi_data
+import detectron.roi_data.minibatch_stats as minibatch_stats
 import detectron.utils.blob as blob_utils
 import detectron.utils.boxes as box_utils
 
@@ -47,7 +48,16 @@ def get_fast_rcnn_blob_names(is_training=True):
         # labels_int32 blob: R categorical labels in [0, ..., K] for K
         # foreground classes plus background
         blob_names += ['labels_int32']
-    if is_training:
+    if is_training and cfg.FAST_RCNN.COMPACT_BBOX_TARGETS:
+        # bbox_targets blob: F bounding-box regression targets, 4 per fg roi
+        blob_names += ['bbox_targets']
+        # bbox_target_locs blob: F locations of the predictions for the
+        # targets in bbox_targets; each row is (roi_idx, 4 * class, 0, 0)
+        blob_names += ['bbox_target_locs']
+        # bbox_loss_normalizer blob: number of rois R, by which the bbox
+        # regression loss is averaged
+        blob_names += ['bbox_loss_normalizer']
+    elif is_training:
         # bbox_targets blob: R bounding-box regression targets with 4
         # targets per class
         blob_names += ['bbox_targets']
@@ -116,6 +126,8 @@ def add_fast_rcnn_blobs(blobs, im_scales, roidb):
     for k, v in blobs.items():
         if isinstance(v, list) and len(v) > 0:
             blobs[k] = np.concatenate(v)
+    # Expand the bbox regression targets of all RoIs at once
+    _add_bbox_target_blobs(blobs)
     # Add FPN multilevel training RoIs, if configured
     if cfg.FPN.FPN_ON and cfg.FPN.MULTILEVEL_ROIS:
         _add_multilevel_rois(blobs)
@@ -170,42 +182,70 @@ def _sample_rois(roidb, im_scale, batch_idx):
     sampled_labels[fg_rois_per_this_image:] = 0  # Label bg RoIs with class 0
     sampled_boxes = roidb['boxes'][keep_inds]
 
-    bbox_targets, bbox_inside_weights = _expand_bbox_targets(
-        roidb['bbox_targets'][keep_inds, :]
-    )
-    bbox_outside_weights = np.array(
-        bbox_inside_weights > 0, dtype=bbox_inside_weights.dtype
-    )
-
     # Scale rois and format as (batch_idx, x1, y1, x2, y2)
     sampled_rois = sampled_boxes * im_scale
     repeated_batch_idx = batch_idx * blob_utils.ones((sampled_rois.shape[0], 1))
     sampled_rois = np.hstack((repeated_batch_idx, sampled_rois))
 
-    # Base Fast R-CNN blobs
+    # Base Fast R-CNN blobs; bbox targets are kept in their compact roidb form
+    # until the blobs of all images are concatenated (see
+    # _add_bbox_target_blobs)
     blob_dict = dict(
         labels_int32=sampled_labels.astype(np.int32, copy=False),
         rois=sampled_rois,
-        bbox_targets=bbox_targets,
-        bbox_inside_weights=bbox_inside_weights,
-        bbox_outside_weights=bbox_outside_weights
+        bbox_targets=roidb['bbox_targets'][keep_inds, :]
     )
 
     # Optionally add Mask R-CNN blobs
     if cfg.MODEL.MASK_ON:
-        mask_rcnn_roi_data.add_mask_rcnn_blobs(
-            blob_dict, sampled_boxes, roidb, im_scale, batch_idx
-        )
+        with minibatch_stats.stage_timer('mask_targets'):
+            mask_rcnn_roi_data.add_mask_rcnn_blobs(
+                blob_dict, sampled_boxes, roidb, im_scale, batch_idx
+            )
 
     # Optionally add Keypoint R-CNN blobs
     if cfg.MODEL.KEYPOINTS_ON:
-        keypoint_rcnn_roi_data.add_keypoint_rcnn_blobs(
-            blob_dict, roidb, fg_rois_per_image, fg_inds, im_scale, batch_idx
-        )
+        with minibatch_stats.stage_timer('keypoint_targets'):
+            keypoint_rcnn_roi_data.add_keypoint_rcnn_blobs(
+                blob_dict, roidb, fg_rois_per_image, fg_inds, im_scale,
+                batch_idx
+            )
 
     return blob_dict
 
 
+def _add_bbox_target_blobs(blobs):
+    """Replace the compact bbox regression targets (class, 4 targets) of the
+    minibatch RoIs in blobs['bbox_targets'] by the bbox regression blobs used
+    by the network.
+    """
+    bbox_target_data = blobs['bbox_targets']
+    if cfg.FAST_RCNN.COMPACT_BBOX_TARGETS:
+        # Only the targets of fg RoIs, along with the locations of their
+        # predictions in the (R, 4K, 1, 1) bbox_pred blob (see
+        # fast_rcnn_heads.add_fast_rcnn_losses)
+        inds = np.where(bbox_target_data[:, 0] > 0)[0]
+        bbox_target_locs = blob_utils.zeros((len(inds), 4))
+        bbox_target_locs[:, 0] = inds
+        bbox_target_locs[:, 1] = 4 * bbox_target_data[inds, 0]
+        blobs['bbox_targets'] = bbox_target_data[inds, 1:].astype(
+            np.float32, copy=False
+        )
+        blobs['bbox_target_locs'] = bbox_target_locs
+        blobs['bbox_loss_normalizer'] = np.array(
+            [bbox_target_data.shape[0]], dtype=np.float32
+        )
+    else:
+        bbox_targets, bbox_inside_weights = _expand_bbox_targets(
+            bbox_target_data
+        )
+        blobs['bbox_targets'] = bbox_targets
+        blobs['bbox_inside_weights'] = bbox_inside_weights
+        blobs['bbox_outside_weights'] = np.array(
+            bbox_inside_weights > 0, dtype=bbox_inside_weights.dtype
+        )
+
+
 def _expand_bbox_targets(bbox_target_data):
     """Bounding-box regression targets are stored in a compact form in the
     roidb.
@@ -226,12 +266,10 @@ def _expand_bbox_targets(bbox_target_data):
     bbox_targets = blob_utils.zeros((clss.size, 4 * num_bbox_reg_classes))
     bbox_inside_weights = blob_utils.zeros(bbox_targets.shape)
     inds = np.where(clss > 0)[0]
-    for ind in inds:
-        cls = int(clss[ind])
-        start = 4 * cls
-        end = start + 4
-        bbox_targets[ind, start:end] = bbox_target_data[ind, 1:]
-        bbox_inside_weights[ind, start:end] = (1.0, 1.0, 1.0, 1.0)
+    # Columns 4 * cls, ..., 4 * cls + 3 of each fg RoI
+    cols = 4 * clss[inds].astype(np.int64)[:, np.newaxis] + np.arange(4)
+    bbox_targets[inds[:, np.newaxis], cols] = bbox_target_data[inds, 1:]
+    bbox_inside_weights[inds[:, np.newaxis], cols] = 1.0
     return bbox_targets, bbox_inside_weights
 
 
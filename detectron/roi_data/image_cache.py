@@ -0,0 +1,236 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Cache of decoded training images.
+
+Without a cache every sampled image is read and decoded from disk, once per
+epoch for each of its unflipped and flipped roidb entries. The caches in this
+module hold decoded uint8 images (optionally already resized to a training
+scale) under a byte budget, evicting the least recently used images first.
+
+Two caches are provided:
+  - ImageCache keeps images in the memory of the process; it is shared by the
+    loader threads of that process.
+  - MappedImageCache stores images as .npy files in a directory and memory-maps
+    them on access, so that (when the directory is on a RAM backed file system
+    such as /dev/shm) all loader worker processes share a single copy.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import cv2
+import hashlib
+import logging
+import numpy as np
+import os
+import threading
+
+from detectron.core.config import cfg
+import detectron.utils.blob as blob_utils
+import detectron.utils.image as image_utils
+
+logger = logging.getLogger(__name__)
+
+# When a MappedImageCache is over budget, evict images until its size is
+# below this fraction of the budget, so that eviction (which scans the cache
+# directory) does not happen on every insertion
+_EVICT_TO_FRACTION = 0.9
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+class ImageCache(object):
+    """In-memory LRU cache of images with a byte budget. Thread safe."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached image for key, or None on a miss."""
+        with self._lock:
+            im = self._images.pop(key, None)
+            if im is not None:
+                # Reinsert to mark as most recently used
+                self._images[key] = im
+            return im
+
+    def put(self, key, im):
+        if im.nbytes > self.max_bytes:
+            return
+        # Cached images are shared by all callers and must not be modified
+        im.flags.writeable = False
+        with self._lock:
+            old_im = self._images.pop(key, None)
+            if old_im is not None:
+                self.nbytes -= old_im.nbytes
+            self._images[key] = im
+            self.nbytes += im.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted_im = self._images.popitem(last=False)
+                self.nbytes -= evicted_im.nbytes
+
+
+class MappedImageCache(object):
+    """LRU cache of images stored as memory-mapped .npy files in a directory.
+    The cache directory may be shared by several processes (and jobs); each
+    process keeps an estimate of the total cache size and rescans the
+    directory, evicting the least recently used files, when it exceeds the
+    budget.
+    """
+
+    def __init__(self, max_bytes, cache_dir):
+        self.max_bytes = int(max_bytes)
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # Created concurrently by another process
+                assert os.path.isdir(cache_dir)
+        self.nbytes = sum(size for _, size, _ in self._list_files())
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached image for key (as a read-only memory-mapped
+        array), or None on a miss.
+        """
+        path = self._get_path(key)
+        try:
+            im = np.load(path, mmap_mode='r')
+            # Mark as most recently used
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            # Missing, evicted or (never visible) partially written file
+            return None
+        return im
+
+    def put(self, key, im):
+        if im.nbytes > self.max_bytes:
+            return
+        path = self._get_path(key)
+        # Write to a temporary file first so that other processes never see a
+        # partially written image
+        tmp_path = '{}.tmp{}.{}'.format(
+            path, os.getpid(), threading.current_thread().ident
+        )
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(im))
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            logger.warning('Failed to cache image {} ({})'.format(key, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self.nbytes += os.path.getsize(path)
+            if self.nbytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        files = sorted(self._list_files())
+        total = sum(size for _, size, _ in files)
+        target = _EVICT_TO_FRACTION * self.max_bytes
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Already evicted by another process
+                pass
+            total -= size
+        self.nbytes = total
+
+    def _list_files(self):
+        """Return (mtime, size, path) of all cached image files."""
+        files = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith('.npy'):
+                continue
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _get_path(self, key):
+        file_name = hashlib.md5(key.encode('utf-8')).hexdigest() + '.npy'
+        return os.path.join(self.cache_dir, file_name)
+
+
+def get_image_cache():
+    """Return the image cache of this process as configured by the
+    DATA_LOADER.IMAGE_CACHE_* options, or None if caching is disabled.
+    """
+    global _image_cache
+    if cfg.DATA_LOADER.IMAGE_CACHE_MB <= 0:
+        return None
+    with _image_cache_lock:
+        if _image_cache is None:
+            max_bytes = cfg.DATA_LOADER.IMAGE_CACHE_MB * 1024**2
+            if cfg.DATA_LOADER.IMAGE_CACHE_DIR:
+                _image_cache = MappedImageCache(
+                    max_bytes, cfg.DATA_LOADER.IMAGE_CACHE_DIR
+                )
+            else:
+                _image_cache = ImageCache(max_bytes)
+        return _image_cache
+
+
+def read_training_image(entry, target_size):
+    """Read the (unflipped) image of a roidb entry as a uint8 BGR array
+    through the image cache.
+
+    Returns the image and its scale: if DATA_LOADER.IMAGE_CACHE_RESIZED is set
+    the image has already been resized to target_size (subject to
+    TRAIN.MAX_SIZE) and the scale is returned; otherwise the image is at its
+    original resolution and the scale is None. Cached images are read-only.
+    """
+    cache = get_image_cache()
+    resized = cache is not None and cfg.DATA_LOADER.IMAGE_CACHE_RESIZED
+    im_scale = None
+    if resized:
+        im_scale = blob_utils.get_target_scale(
+            (entry['height'], entry['width']), target_size, cfg.TRAIN.MAX_SIZE
+        )
+        key = '{}@{}_{}'.format(entry['image'], target_size, cfg.TRAIN.MAX_SIZE)
+    else:
+        key = entry['image']
+    im = cache.get(key) if cache is not None else None
+    if im is None:
+        im = image_utils.read_image(entry['image'])
+        if resized:
+            im = cv2.resize(
+                im,
+                None,
+                None,
+                fx=im_scale,
+                fy=im_scale,
+                interpolation=cv2.INTER_LINEAR
+            )
+        if cache is not None:
+            cache.put(key, im)
+    return im, im_scale
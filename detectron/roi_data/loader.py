@@ -33,6 +33,37 @@ minibatch queue, feeds the minibatch blobs into the workspace, and then runs
 an EnqueueBlobsOp to place the minibatch blobs into the GPU's blobs queue.
 During each fprop the first thing the network does is run a DequeueBlobsOp
 in order to populate the workspace with the blobs from a queued minibatch.
+
+When using worker processes (cfg.DATA_LOADER.USE_PROCESSES) the loader threads
+are replaced by:
+
+inds feeder thread -> inds queue -> worker process -> shared memory buffer
+                                                   -> receiver thread
+                                                   -> minibatch queue
+
+Each worker process builds minibatches from the roidb indices it is given and
+copies the blobs into its own shared memory buffer. A receiver thread in the
+trainer process copies them back out and puts them on the minibatch queue.
+
+When also using the shared ring (cfg.DATA_LOADER.USE_SHARED_RING) worker
+processes build each minibatch in a free slot of a preallocated shared memory
+ring instead of their own buffer (the image blob is built in place, the other
+blobs are copied into the slot) and only a reference to the slot goes through
+the minibatch queue. The enqueue threads feed the blobs straight from the slot
+and then return it to the ring.
+
+When autoscaling (cfg.DATA_LOADER.AUTOSCALE) max_loaders loader threads (or
+worker processes) are created, but only the first ones are active. A monitor
+thread samples the occupancy of the minibatch queue and activates one more
+loader when the queue drains or stays nearly empty, or parks one when the queue
+stays full. Parked loaders sleep until they are activated again.
+
+Minibatches are numbered in the order their roidb indices are drawn. The loader
+keeps track of the minibatches that have not reached the GPUs yet, so that
+get_state can return the state of the minibatch stream as consumed by the
+network (the roidb permutation and cursor of the first unconsumed minibatch,
+the shuffling RNG state and the later minibatches already consumed) and
+set_state can resume the stream from it exactly.
 """
 
 from __future__ import absolute_import
@@ -41,13 +72,17 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from collections import deque
+from collections import namedtuple
 from collections import OrderedDict
+import functools
 import logging
+import multiprocessing
 import numpy as np
 import Queue
 import signal
 import threading
 import time
+import traceback
 import uuid
 
 from caffe2.python import core, workspace
@@ -58,10 +93,37 @@ from detectron.roi_data.minibatch import get_minibatch_blob_names
 from detectron.utils.coordinator import coordinated_get
 from detectron.utils.coordinator import coordinated_put
 from detectron.utils.coordinator import Coordinator
+from detectron.utils.logging import SmoothedValue
+from detectron.utils.shared_memory import SharedBlobsBuffer
+from detectron.utils.shared_memory import SharedBlobsRing
+import detectron.roi_data.minibatch_stats as minibatch_stats
+import detectron.roi_data.roidb_store as roidb_store
 import detectron.utils.c2 as c2_utils
 
 logger = logging.getLogger(__name__)
 
+# Number of recent minibatches over which minibatch stats are averaged
+_MINIBATCH_STATS_WINDOW = 100
+# Number of recent minibatches over which percentiles of the time of each stage
+# of their construction are computed (see cfg.DATA_LOADER.PROFILE_STAGES)
+_STAGE_TIMES_WINDOW = 1000
+_STAGE_TIME_PERCENTILES = (50, 90, 99)
+
+# Seconds between two samples of the minibatch queue occupancy when autoscaling
+_AUTOSCALE_SAMPLE_INTERVAL = 0.5
+# A loader is parked when the minibatch queue stays above this fraction of its
+# size, and one is activated when it drains by this fraction of its size (from
+# the first to the second half of the samples) or stays below _AUTOSCALE_LOW on
+# average
+_AUTOSCALE_FULL = 0.9
+_AUTOSCALE_DRAIN = 0.1
+_AUTOSCALE_LOW = 0.25
+# Seconds between two checks of whether a parked loader has been activated
+_PARKED_LOADER_SLEEP = 0.1
+
+# Reference to a minibatch stored in a slot of the shared ring
+_RingMinibatch = namedtuple('_RingMinibatch', ['slot_id', 'layout'])
+
 
 class RoIDataLoader(object):
     def __init__(
@@ -69,16 +131,44 @@ class RoIDataLoader(object):
         roidb,
         num_loaders=4,
         minibatch_queue_size=64,
-        blobs_queue_capacity=8
+        blobs_queue_capacity=8,
+        use_processes=False,
+        use_shared_ring=False,
+        shared_ring_size=8,
+        min_loaders=None,
+        max_loaders=None
     ):
         self._roidb = roidb
+        # Handle of the roidb in the roidb store (if used); it is registered
+        # before any worker process is forked
+        self._roidb_handle = None
+        if cfg.DATA_LOADER.ROIDB_STORE:
+            self._roidb_handle = roidb_store.register(roidb)
         self._lock = threading.Lock()
         self._perm = deque(range(len(self._roidb)))
         self._cur = 0  # _perm cursor
+        # Random generator used to shuffle the roidb
+        self._rng = np.random.RandomState(
+            cfg.RNG_SEED if cfg.DATA_LOADER.DETERMINISTIC else
+            np.random.randint(2**31 - 1)
+        )
+        self._num_drawn = 0  # Number of the next minibatch to draw
+        # Numbers of the drawn minibatches that are neither enqueued to a GPU
+        # nor discarded
+        self._in_flight = set()
+        # Numbers of the minibatches to skip when resuming (see set_state)
+        self._skip = set()
+        # (first minibatch number, permutation, RNG state after shuffling) of
+        # the epochs that unconsumed minibatches may belong to
+        self._epochs = deque()
         # The minibatch queue holds prepared training data in host (CPU) memory
         # When training with N > 1 GPUs, each element in the minibatch queue
         # is actually a partial minibatch which contributes 1 / N of the
         # examples to the overall minibatch
+        if use_shared_ring and use_processes:
+            # The minibatch queue can only hold as many minibatches as there
+            # are ring slots for them
+            minibatch_queue_size = min(minibatch_queue_size, shared_ring_size)
         self._minibatch_queue = Queue.Queue(maxsize=minibatch_queue_size)
         self._blobs_queue_capacity = blobs_queue_capacity
         # Random queue name in case one instantiates multple RoIDataLoaders
@@ -87,92 +177,489 @@ class RoIDataLoader(object):
         # Loader threads construct (partial) minibatches and put them on the
         # minibatch queue
         self._num_loaders = num_loaders
+        # If min_loaders and max_loaders are given, the number of active
+        # loaders is adapted between them to the minibatch queue occupancy
+        self._autoscale = min_loaders is not None and max_loaders is not None
+        if self._autoscale:
+            assert min_loaders <= num_loaders <= max_loaders, \
+                'Number of loaders {} is not in [{}, {}]'.format(
+                    num_loaders, min_loaders, max_loaders
+                )
+            self._min_loaders = min_loaders
+            self._num_loaders = max_loaders
+        # Shared with the worker processes
+        self._num_active_loaders = multiprocessing.Value(
+            'i', num_loaders, lock=False
+        )
+        self._use_processes = use_processes
         self._num_gpus = cfg.NUM_GPUS
+        # Numbers of the minibatches last enqueued (or being enqueued) to each
+        # GPU's blobs queue (all of the unconsumed ones are among them) and
+        # total counts
+        self._enqueued = [
+            deque(maxlen=blobs_queue_capacity + 1)
+            for _ in range(self._num_gpus)
+        ]
+        self._num_enqueued = [0] * self._num_gpus
         self.coordinator = Coordinator()
+        self._ring = None
+        if use_shared_ring and use_processes:
+            # Enough slots for a full minibatch queue plus one slot being
+            # written by each worker and one being fed by each enqueuer
+            self._ring = SharedBlobsRing(
+                minibatch_queue_size + self._num_loaders + self._num_gpus,
+                _get_minibatch_buffer_capacity()
+            )
+        elif use_shared_ring:
+            # Loader threads pass their arrays by reference already
+            logger.warning(
+                'The shared ring is only used with worker processes'
+            )
+
+        self._minibatch_stats = {}
+        self._minibatch_stats_lock = threading.Lock()
 
         self._output_names = get_minibatch_blob_names()
         self._shuffle_roidb_inds()
         self.create_threads()
 
-    def minibatch_loader_thread(self):
+    def minibatch_loader_thread(self, loader_idx):
         """Load mini-batches and put them onto the mini-batch queue."""
         with self.coordinator.stop_on_exception():
             while not self.coordinator.should_stop():
-                blobs = self.get_next_minibatch()
-                # Blobs must be queued in the order specified by
-                # self.get_output_names
-                ordered_blobs = OrderedDict()
-                for key in self.get_output_names():
-                    assert blobs[key].dtype in (np.int32, np.float32), \
-                        'Blob {} of dtype {} must have dtype of ' \
-                        'np.int32 or np.float32'.format(key, blobs[key].dtype)
-                    ordered_blobs[key] = blobs[key]
+                if loader_idx >= self._num_active_loaders.value:
+                    # Parked
+                    time.sleep(_PARKED_LOADER_SLEEP)
+                    continue
+                seq, blobs = self._get_next_minibatch()
+                ordered_blobs = self._get_ordered_blobs(blobs)
                 coordinated_put(
-                    self.coordinator, self._minibatch_queue, ordered_blobs
+                    self.coordinator, self._minibatch_queue,
+                    (seq, ordered_blobs)
                 )
         logger.info('Stopping mini-batch loading thread')
 
+    def _get_ordered_blobs(self, blobs):
+        # Blobs must be queued in the order specified by self.get_output_names
+        ordered_blobs = OrderedDict()
+        for key in self.get_output_names():
+            assert blobs[key].dtype in (np.int32, np.float32), \
+                'Blob {} of dtype {} must have dtype of ' \
+                'np.int32 or np.float32'.format(key, blobs[key].dtype)
+            ordered_blobs[key] = blobs[key]
+        return ordered_blobs
+
+    def _write_to_ring(self, slot_id, arrays):
+        """Copy a minibatch into a ring slot (except the arrays built in the
+        slot) and return the reference to put on the minibatch queue.
+        """
+        layout = self._ring.write(slot_id, arrays)
+        if layout is None:
+            # Too large for a slot; pass copies of the arrays themselves as
+            # the slot can be reused as soon as it is released
+            arrays = [np.array(array) for array in arrays]
+            self._ring.release(slot_id)
+            return OrderedDict(zip(self.get_output_names(), arrays))
+        return _RingMinibatch(slot_id, layout)
+
+    def minibatch_inds_feeder_thread(self):
+        """Put the roidb indices of future minibatches onto the inds queue that
+        is shared by the worker processes.
+        """
+        with self.coordinator.stop_on_exception():
+            while not self.coordinator.should_stop():
+                coordinated_put(
+                    self.coordinator, self._inds_queue,
+                    self._get_next_minibatch_inds()
+                )
+        logger.info('Stopping mini-batch inds feeder thread')
+
+    def minibatch_worker_process(self, worker):
+        """Build mini-batches from the roidb indices on the inds queue and send
+        them to the trainer process through the worker's shared buffer. Runs
+        in a forked process.
+        """
+        # SIGINT is handled by the trainer process, which stops the workers
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # Don't let exiting block on flushing results nobody will read
+        worker.result_queue.cancel_join_thread()
+        # Forked workers inherit the parent's RNG state, so reseed each one
+        np.random.seed(worker.seed)
+        minibatch_stats.enable()
+        try:
+            while not self._stop_event.is_set():
+                if worker.idx >= self._num_active_loaders.value:
+                    # Parked
+                    time.sleep(_PARKED_LOADER_SLEEP)
+                    continue
+                try:
+                    seq, db_inds = self._inds_queue.get(block=True, timeout=1.0)
+                except Queue.Empty:
+                    continue
+                if cfg.DATA_LOADER.DETERMINISTIC:
+                    np.random.seed([cfg.RNG_SEED, seq])
+                slot_id = None
+                alloc = None
+                if self._ring is not None:
+                    # Build the minibatch in a free ring slot
+                    slot_id = self._get_free_ring_slot()
+                    if slot_id is None:
+                        return
+                    alloc = functools.partial(self._ring.empty, slot_id)
+                blobs, valid = self._get_minibatch(db_inds, alloc=alloc)
+                if not valid:
+                    if slot_id is not None:
+                        self._ring.clear(slot_id)
+                        self._ring.release(slot_id)
+                    minibatch_stats.pop_values()
+                    worker.result_queue.put(('invalid', seq, None, {}))
+                    continue
+                arrays = self._get_ordered_blobs(blobs).values()
+                if slot_id is not None:
+                    with minibatch_stats.stage_timer('serialize'):
+                        ring_minibatch = self._write_to_ring(slot_id, arrays)
+                    worker.result_queue.put((
+                        'ring', seq, ring_minibatch,
+                        minibatch_stats.pop_values()
+                    ))
+                    continue
+                # Wait until the receiver thread is done with the buffer
+                while not worker.buffer_free.acquire(True, 1.0):
+                    if self._stop_event.is_set():
+                        return
+                with minibatch_stats.stage_timer('serialize'):
+                    layout = worker.buffer.write(arrays)
+                stats = minibatch_stats.pop_values()
+                if layout is None:
+                    # Too large for the buffer; fall back to pickling
+                    worker.buffer_free.release()
+                    worker.result_queue.put(('arrays', seq, arrays, stats))
+                else:
+                    worker.result_queue.put(('layout', seq, layout, stats))
+        except Exception:
+            worker.result_queue.put(
+                ('error', None, traceback.format_exc(), {})
+            )
+
+    def _get_free_ring_slot(self):
+        """Wait for a free ring slot in a worker process. Returns None if the
+        loader is stopped while waiting.
+        """
+        while not self._stop_event.is_set():
+            try:
+                return self._ring.get(block=True, timeout=1.0)
+            except Queue.Empty:
+                continue
+        return None
+
+    def minibatch_receiver_thread(self, worker):
+        """Receive mini-batches from a worker process and put them onto the
+        mini-batch queue.
+        """
+        with self.coordinator.stop_on_exception():
+            while not self.coordinator.should_stop():
+                kind, seq, payload, stats = coordinated_get(
+                    self.coordinator, worker.result_queue
+                )
+                if kind == 'error':
+                    raise Exception(
+                        'Mini-batch worker process failed:\n' + payload
+                    )
+                elif kind == 'invalid':
+                    self._retire_minibatch(seq)
+                    continue
+                self._add_minibatch_stats(stats)
+                if kind == 'ring':
+                    # Only the reference to the ring slot is passed on
+                    coordinated_put(
+                        self.coordinator, self._minibatch_queue,
+                        (seq, payload)
+                    )
+                    continue
+                elif kind == 'layout':
+                    arrays = worker.buffer.read(payload, copy=True)
+                    worker.buffer_free.release()
+                else:
+                    arrays = payload
+                ordered_blobs = OrderedDict(
+                    zip(self.get_output_names(), arrays)
+                )
+                coordinated_put(
+                    self.coordinator, self._minibatch_queue,
+                    (seq, ordered_blobs)
+                )
+        logger.info('Stopping mini-batch receiver thread')
+
     def enqueue_blobs_thread(self, gpu_id, blob_names):
         """Transfer mini-batches from a mini-batch queue to a BlobsQueue."""
         with self.coordinator.stop_on_exception():
             while not self.coordinator.should_stop():
                 if self._minibatch_queue.qsize == 0:
                     logger.warning('Mini-batch queue is empty')
-                blobs = coordinated_get(self.coordinator, self._minibatch_queue)
-                self.enqueue_blobs(gpu_id, blob_names, blobs.values())
+                seq, blobs = coordinated_get(
+                    self.coordinator, self._minibatch_queue
+                )
+                # The network may consume the minibatch as soon as it is in
+                # the blobs queue, so it is counted as enqueued beforehand
+                self._retire_minibatch(seq, gpu_id=gpu_id)
+                try:
+                    if isinstance(blobs, _RingMinibatch):
+                        arrays = self._ring.read(blobs.slot_id, blobs.layout)
+                        self.enqueue_blobs(gpu_id, blob_names, arrays)
+                        self._ring.release(blobs.slot_id)
+                    else:
+                        self.enqueue_blobs(gpu_id, blob_names, blobs.values())
+                except Exception:
+                    self._unretire_enqueued_minibatch(seq, gpu_id)
+                    raise
                 logger.debug(
                     'batch queue size {}'.format(self._minibatch_queue.qsize())
                 )
             logger.info('Stopping enqueue thread')
 
+    def autoscale_thread(self):
+        """Activate or park loaders depending on the occupancy of the minibatch
+        queue over each period of cfg.DATA_LOADER.AUTOSCALE_PERIOD seconds.
+        """
+        num_samples = max(
+            int(cfg.DATA_LOADER.AUTOSCALE_PERIOD / _AUTOSCALE_SAMPLE_INTERVAL),
+            2
+        )
+        with self.coordinator.stop_on_exception():
+            occupancy = []
+            while not self.coordinator.should_stop():
+                time.sleep(_AUTOSCALE_SAMPLE_INTERVAL)
+                occupancy.append(self._minibatch_queue.qsize())
+                if len(occupancy) < num_samples:
+                    continue
+                num_active_loaders = int(np.clip(
+                    self._num_active_loaders.value + _get_num_loaders_change(
+                        occupancy, self._minibatch_queue.maxsize
+                    ), self._min_loaders, self._num_loaders
+                ))
+                if num_active_loaders != self._num_active_loaders.value:
+                    logger.info(
+                        'Mini-batch queue occupancy {:.1f}/{:d}: using {:d} '
+                        'loaders instead of {:d}'.format(
+                            np.mean(occupancy), self._minibatch_queue.maxsize,
+                            num_active_loaders,
+                            self._num_active_loaders.value
+                        )
+                    )
+                    self._num_active_loaders.value = num_active_loaders
+                occupancy = []
+        logger.info('Stopping autoscale thread')
+
+    def get_num_active_loaders(self):
+        """Return the number of loaders that are not parked."""
+        return self._num_active_loaders.value
+
     def get_next_minibatch(self):
         """Return the blobs to be used for the next minibatch. Thread safe."""
+        seq, blobs = self._get_next_minibatch()
+        # The minibatch is handed over to the caller
+        self._retire_minibatch(seq)
+        return blobs
+
+    def _get_next_minibatch(self):
+        """Return the number and blobs of the next valid minibatch, which
+        remains in flight. Thread safe.
+        """
+        minibatch_stats.enable()
         valid = False
         while not valid:
-            db_inds = self._get_next_minibatch_inds()
-            minibatch_db = [self._roidb[i] for i in db_inds]
-            blobs, valid = get_minibatch(minibatch_db)
-        return blobs
+            seq, db_inds = self._get_next_minibatch_inds()
+            blobs, valid = self._get_minibatch(db_inds)
+            stats = minibatch_stats.pop_values()
+            if not valid:
+                self._retire_minibatch(seq)
+        self._add_minibatch_stats(stats)
+        return seq, blobs
+
+    def _get_minibatch(self, db_inds, alloc=None):
+        """Construct a minibatch from the roidb entries db_inds. If given,
+        alloc is used to allocate the image blob (see get_minibatch).
+        """
+        minibatch_db = [self._roidb[i] for i in db_inds]
+        if self._roidb_handle is None:
+            return get_minibatch(minibatch_db, alloc=alloc)
+        return get_minibatch(
+            minibatch_db,
+            roidb_blob=roidb_store.get_roidb_blob(self._roidb_handle, db_inds),
+            alloc=alloc
+        )
+
+    def _add_minibatch_stats(self, stats):
+        """Add the stats (see roi_data.minibatch_stats) of a minibatch."""
+        with self._minibatch_stats_lock:
+            for name, values in stats.items():
+                if name not in self._minibatch_stats:
+                    self._minibatch_stats[name] = SmoothedValue(
+                        _STAGE_TIMES_WINDOW if _is_stage_time(name) else
+                        _MINIBATCH_STATS_WINDOW
+                    )
+                for value in values:
+                    self._minibatch_stats[name].AddValue(value)
+
+    def get_minibatch_stats(self):
+        """Return the minibatch stats (see roi_data.minibatch_stats) averaged
+        over recent minibatches, as a dict of stat name -> average value. The
+        stage times are given as percentiles ('<name>_p<percentile>' keys)
+        instead. Thread safe.
+        """
+        stats = {}
+        with self._minibatch_stats_lock:
+            for name, v in self._minibatch_stats.items():
+                if _is_stage_time(name):
+                    for q in _STAGE_TIME_PERCENTILES:
+                        stats['{}_p{}'.format(name, q)] = \
+                            v.GetPercentileValue(q)
+                else:
+                    stats[name] = v.GetAverageValue()
+        return stats
 
     def _shuffle_roidb_inds(self):
         """Randomly permute the training roidb. Not thread safe."""
         if cfg.TRAIN.ASPECT_GROUPING:
-            widths = np.array([r['width'] for r in self._roidb])
-            heights = np.array([r['height'] for r in self._roidb])
-            horz = (widths >= heights)
-            vert = np.logical_not(horz)
-            horz_inds = np.where(horz)[0]
-            vert_inds = np.where(vert)[0]
-
-            horz_inds = np.random.permutation(horz_inds)
-            vert_inds = np.random.permutation(vert_inds)
+            heights, widths = _get_image_sizes(self._roidb)
+            if len(cfg.TRAIN.ASPECT_RATIO_BINS) > 0:
+                # Group images by aspect ratio bin
+                bins = cfg.TRAIN.ASPECT_RATIO_BINS
+                group_ids = np.digitize(heights / widths, bins)
+                num_groups = len(bins) + 1
+            else:
+                # Group horizontal and vertical images
+                group_ids = (widths < heights).astype(np.int32)
+                num_groups = 2
             mb = cfg.TRAIN.IMS_PER_BATCH
-            horz_inds = horz_inds[:(len(horz_inds) // mb) * mb]
-            vert_inds = vert_inds[:(len(vert_inds) // mb) * mb]
-            inds = np.hstack((horz_inds, vert_inds))
+            group_inds = []
+            for group_id in range(num_groups):
+                inds = self._rng.permutation(np.where(group_ids == group_id)[0])
+                group_inds.append(inds[:(len(inds) // mb) * mb])
+            inds = np.hstack(group_inds)
 
             inds = np.reshape(inds, (-1, mb))
-            row_perm = np.random.permutation(np.arange(inds.shape[0]))
+            row_perm = self._rng.permutation(np.arange(inds.shape[0]))
             inds = np.reshape(inds[row_perm, :], (-1, ))
             self._perm = inds
         else:
-            self._perm = np.random.permutation(np.arange(len(self._roidb)))
+            self._perm = self._rng.permutation(np.arange(len(self._roidb)))
+        # Forget the epochs that no unconsumed minibatch belongs to
+        first_seq = min(
+            [self._num_drawn] + list(self._in_flight) +
+            [seq for enqueued in self._enqueued for seq in enqueued]
+        )
+        while len(self._epochs) > 1 and self._epochs[1][0] <= first_seq:
+            self._epochs.popleft()
+        self._epochs.append(
+            (self._num_drawn, self._perm, self._rng.get_state())
+        )
         self._perm = deque(self._perm)
         self._cur = 0
 
     def _get_next_minibatch_inds(self):
-        """Return the roidb indices for the next minibatch. Thread safe."""
+        """Return the number and roidb indices of the next minibatch. The
+        minibatch is in flight until it is retired with _retire_minibatch.
+        Thread safe.
+        """
+        with self._lock:
+            while True:
+                seq = self._num_drawn
+                # We use a deque and always take the *first* IMS_PER_BATCH
+                # items followed by *rotating* the deque so that we see fresh
+                # items each time. If the length of _perm is not divisible by
+                # IMS_PER_BATCH, then we end up wrapping around the
+                # permutation.
+                db_inds = [
+                    self._perm[i] for i in range(cfg.TRAIN.IMS_PER_BATCH)
+                ]
+                self._perm.rotate(-cfg.TRAIN.IMS_PER_BATCH)
+                self._cur += cfg.TRAIN.IMS_PER_BATCH
+                self._num_drawn += 1
+                if self._cur >= len(self._perm):
+                    self._shuffle_roidb_inds()
+                if seq in self._skip:
+                    # Consumed before the state we resumed from was saved
+                    self._skip.remove(seq)
+                    continue
+                self._in_flight.add(seq)
+                return seq, db_inds
+
+    def _retire_minibatch(self, seq, gpu_id=None):
+        """Mark a minibatch as no longer in flight, either because it was
+        enqueued to the blobs queue of GPU gpu_id or because it was discarded
+        or handed over (gpu_id is None). Thread safe.
+        """
+        with self._lock:
+            self._in_flight.discard(seq)
+            if gpu_id is not None:
+                self._enqueued[gpu_id].append(seq)
+                self._num_enqueued[gpu_id] += 1
+
+    def _unretire_enqueued_minibatch(self, seq, gpu_id):
+        """Put back in flight the minibatch last retired with gpu_id, which
+        could not be enqueued. Thread safe.
+        """
+        with self._lock:
+            assert self._enqueued[gpu_id].pop() == seq
+            self._num_enqueued[gpu_id] -= 1
+            self._in_flight.add(seq)
+
+    def get_state(self, num_iters):
+        """Return the state of the minibatch stream after each GPU has consumed
+        num_iters minibatches since the loader was started. The state can be
+        pickled and passed to set_state to resume the stream. Thread safe.
+        """
         with self._lock:
-            # We use a deque and always take the *first* IMS_PER_BATCH items
-            # followed by *rotating* the deque so that we see fresh items
-            # each time. If the length of _perm is not divisible by
-            # IMS_PER_BATCH, then we end up wrapping around the permutation.
-            db_inds = [self._perm[i] for i in range(cfg.TRAIN.IMS_PER_BATCH)]
-            self._perm.rotate(-cfg.TRAIN.IMS_PER_BATCH)
-            self._cur += cfg.TRAIN.IMS_PER_BATCH
-            if self._cur >= len(self._perm):
-                self._shuffle_roidb_inds()
-        return db_inds
+            unconsumed = set(self._in_flight)
+            for gpu_id in range(self._num_gpus):
+                num_queued = self._num_enqueued[gpu_id] - num_iters
+                assert 0 <= num_queued <= len(self._enqueued[gpu_id]), \
+                    'GPU {} consumed {} of {} enqueued minibatches'.format(
+                        gpu_id, num_iters, self._num_enqueued[gpu_id]
+                    )
+                if num_queued > 0:
+                    unconsumed.update(
+                        list(self._enqueued[gpu_id])[-num_queued:]
+                    )
+            first_seq = min(unconsumed) if unconsumed else self._num_drawn
+            epoch_seq, perm, rng_state = [
+                epoch for epoch in self._epochs if epoch[0] <= first_seq
+            ][-1]
+            # Minibatches drawn after the first unconsumed one and consumed
+            skip_seqs = (
+                set(range(first_seq, self._num_drawn)) - unconsumed
+            ) | self._skip
+            return {
+                'num_entries': len(self._roidb),
+                'perm': perm,
+                'cur': (first_seq - epoch_seq) * cfg.TRAIN.IMS_PER_BATCH,
+                'rng_state': rng_state,
+                'seq': first_seq,
+                'skip_seqs': sorted(skip_seqs),
+            }
+
+    def set_state(self, state):
+        """Resume the minibatch stream from a state returned by get_state. Must
+        be called before the loader is started.
+        """
+        if state['num_entries'] != len(self._roidb):
+            logger.warning(
+                'Not restoring a data loader state for {} roidb entries with '
+                '{} entries'.format(state['num_entries'], len(self._roidb))
+            )
+            return
+        with self._lock:
+            self._rng.set_state(state['rng_state'])
+            self._perm = deque(state['perm'])
+            self._perm.rotate(-state['cur'])
+            self._cur = state['cur']
+            self._num_drawn = state['seq']
+            self._epochs = deque([(
+                state['seq'] - state['cur'] // cfg.TRAIN.IMS_PER_BATCH,
+                state['perm'], state['rng_state']
+            )])
+            self._skip = set(state['skip_seqs'])
 
     def get_output_names(self):
         return self._output_names
@@ -203,12 +690,18 @@ class RoIDataLoader(object):
         )
 
     def create_threads(self):
-        # Create mini-batch loader threads, each of which builds mini-batches
-        # and places them into a queue in CPU memory
-        self._workers = [
-            threading.Thread(target=self.minibatch_loader_thread)
-            for _ in range(self._num_loaders)
-        ]
+        if self._use_processes:
+            self._workers = self.create_worker_processes()
+        else:
+            # Create mini-batch loader threads, each of which builds
+            # mini-batches and places them into a queue in CPU memory
+            self._workers = [
+                threading.Thread(
+                    target=self.minibatch_loader_thread, args=(loader_idx, )
+                ) for loader_idx in range(self._num_loaders)
+            ]
+        if self._autoscale:
+            self._workers.append(threading.Thread(target=self.autoscale_thread))
 
         # Create one BlobsQueue per GPU
         # (enqueue_blob_names are unscoped)
@@ -222,7 +715,49 @@ class RoIDataLoader(object):
             ) for gpu_id in range(self._num_gpus)
         ]
 
+    def create_worker_processes(self):
+        """Create the mini-batch worker processes and return the threads that
+        feed and drain them.
+        """
+        self._inds_queue = multiprocessing.Queue(maxsize=2 * self._num_loaders)
+        # The feeder thread may be stopped with indices still in the queue
+        self._inds_queue.cancel_join_thread()
+        self._stop_event = multiprocessing.Event()
+        buffer_capacity = _get_minibatch_buffer_capacity()
+        logger.info(
+            'Using {} mini-batch worker processes with {:.1f} MB shared '
+            'buffers'.format(self._num_loaders, buffer_capacity / 1024**2)
+        )
+        self._worker_processes = []
+        threads = [threading.Thread(target=self.minibatch_inds_feeder_thread)]
+        for worker_idx in range(self._num_loaders):
+            # Workers write into the shared ring if there is one
+            worker = _MinibatchWorker(
+                idx=worker_idx,
+                buffer=(
+                    SharedBlobsBuffer(buffer_capacity)
+                    if self._ring is None else None
+                ),
+                buffer_free=multiprocessing.Semaphore(1),
+                result_queue=multiprocessing.Queue(),
+                seed=np.random.randint(2**31 - 1)
+            )
+            worker.process = multiprocessing.Process(
+                target=self.minibatch_worker_process, args=(worker, )
+            )
+            worker.process.daemon = True
+            self._worker_processes.append(worker)
+            threads.append(
+                threading.Thread(
+                    target=self.minibatch_receiver_thread, args=(worker, )
+                )
+            )
+        return threads
+
     def start(self, prefill=False):
+        # Fork the worker processes before starting any threads
+        for worker in getattr(self, '_worker_processes', []):
+            worker.process.start()
         for w in self._workers + self._enqueuers:
             w.start()
         if prefill:
@@ -246,6 +781,14 @@ class RoIDataLoader(object):
         self.close_blobs_queues()
         for w in self._workers + self._enqueuers:
             w.join()
+        if self._use_processes:
+            self._stop_event.set()
+            for worker in self._worker_processes:
+                worker.process.join(timeout=10.0)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+        if self._roidb_handle is not None:
+            roidb_store.unregister(self._roidb_handle)
 
     def create_blobs_queues(self):
         """Create one BlobsQueue for each GPU to hold mini-batches."""
@@ -289,3 +832,80 @@ class RoIDataLoader(object):
             self.shutdown()
 
         signal.signal(signal.SIGINT, signal_handler)
+
+
+class _MinibatchWorker(object):
+    """State shared between a worker process and its receiver thread."""
+
+    def __init__(self, idx, buffer, buffer_free, result_queue, seed):
+        self.idx = idx
+        self.buffer = buffer
+        self.buffer_free = buffer_free
+        self.result_queue = result_queue
+        self.seed = seed
+        self.process = None
+
+
+def _get_num_loaders_change(occupancy, maxsize):
+    """Return the change (-1, 0 or 1) of the number of active loaders given the
+    sampled occupancy of a minibatch queue of maximum size maxsize.
+    """
+    if min(occupancy) >= _AUTOSCALE_FULL * maxsize:
+        # Loaders keep up even with one less
+        return -1
+    half = len(occupancy) // 2
+    drain = np.mean(occupancy[:half]) - np.mean(occupancy[-half:])
+    if (drain >= max(_AUTOSCALE_DRAIN * maxsize, 1) or
+            np.mean(occupancy) < _AUTOSCALE_LOW * maxsize):
+        # The network consumes minibatches faster than they are loaded
+        return 1
+    return 0
+
+
+def _is_stage_time(stat_name):
+    return stat_name.startswith(minibatch_stats.STAGE_TIME_PREFIX)
+
+
+def _get_image_sizes(roidb):
+    """Return the heights and widths of all images in the roidb."""
+    if hasattr(roidb, 'get_image_sizes'):
+        # Roidb containers that can do this without building every entry
+        return roidb.get_image_sizes()
+    heights = np.array([r['height'] for r in roidb])
+    widths = np.array([r['width'] for r in roidb])
+    return heights, widths
+
+
+def _get_minibatch_buffer_capacity():
+    """Return a size in bytes that should hold every blob of a minibatch. The
+    size is driven by the data blob and, for RPN and RetinaNet, by the dense
+    per anchor targets.
+    """
+    stride = cfg.FPN.COARSEST_STRIDE if cfg.FPN.FPN_ON else 1
+    max_size = int(np.ceil(cfg.TRAIN.MAX_SIZE / stride) * stride)
+    min_size = min(max(cfg.TRAIN.SCALES), cfg.TRAIN.MAX_SIZE)
+    min_size = int(np.ceil(min_size / stride) * stride)
+    nbytes = 3 * max_size * min_size * 4
+    if cfg.RPN.RPN_ON or cfg.RETINANET.RETINANET_ON:
+        if cfg.FPN.FPN_ON or cfg.RETINANET.RETINANET_ON:
+            strides = [
+                2**lvl
+                for lvl in range(cfg.FPN.RPN_MIN_LEVEL, cfg.FPN.RPN_MAX_LEVEL + 1)
+            ]
+            num_cell_anchors = len(cfg.FPN.RPN_ASPECT_RATIOS)
+            if cfg.RETINANET.RETINANET_ON:
+                num_cell_anchors = (
+                    cfg.RETINANET.SCALES_PER_OCTAVE *
+                    len(cfg.RETINANET.ASPECT_RATIOS)
+                )
+        else:
+            strides = [cfg.RPN.STRIDE]
+            num_cell_anchors = len(cfg.RPN.SIZES) * len(cfg.RPN.ASPECT_RATIOS)
+        num_anchors = sum(
+            int(np.ceil(cfg.TRAIN.MAX_SIZE / s))**2 * num_cell_anchors
+            for s in strides
+        )
+        # One label, four targets and eight weights per anchor
+        nbytes += num_anchors * 13 * 4
+    # Headroom for the remaining (RoI, mask, keypoint, roidb) blobs
+    return cfg.TRAIN.IMS_PER_BATCH * nbytes + 32 * 1024**2
@@ -25,14 +25,19 @@ from __future__ import unicode_literals
 
 import logging
 import numpy as np
+import threading
 
 from detectron.core.config import cfg
+from detectron.roi_data.image_cache import ImageCache
 import detectron.utils.blob as blob_utils
 import detectron.utils.boxes as box_utils
 import detectron.utils.segms as segm_utils
 
 logger = logging.getLogger(__name__)
 
+_mask_bitmap_cache = None
+_mask_bitmap_cache_lock = threading.Lock()
+
 
 def add_mask_rcnn_blobs(blobs, sampled_boxes, roidb, im_scale, batch_idx):
     """Add Mask R-CNN specific blobs to the input blob dictionary."""
@@ -65,15 +70,21 @@ def add_mask_rcnn_blobs(blobs, sampled_boxes, roidb, im_scale, batch_idx):
         fg_polys_inds = np.argmax(overlaps_bbfg_bbpolys, axis=1)
 
         # add fg targets
-        for i in range(rois_fg.shape[0]):
-            fg_polys_ind = fg_polys_inds[i]
-            poly_gt = polys_gt[fg_polys_ind]
-            roi_fg = rois_fg[i]
-            # Rasterize the portion of the polygon mask within the given fg roi
-            # to an M x M binary image
-            mask = segm_utils.polys_to_mask_wrt_box(poly_gt, roi_fg, M)
-            mask = np.array(mask > 0, dtype=np.int32)  # Ensure it's binary
-            masks[i, :] = np.reshape(mask, M**2)
+        if cfg.MRCNN.MASK_BITMAP_SIZE > 0:
+            bitmaps = _get_mask_bitmaps(roidb, polys_gt, boxes_from_polys)
+            masks[:] = _crop_and_resize_bitmaps(
+                bitmaps, boxes_from_polys, fg_polys_inds, rois_fg, M
+            ).reshape((-1, M**2))
+        else:
+            for i in range(rois_fg.shape[0]):
+                fg_polys_ind = fg_polys_inds[i]
+                poly_gt = polys_gt[fg_polys_ind]
+                roi_fg = rois_fg[i]
+                # Rasterize the portion of the polygon mask within the given
+                # fg roi to an M x M binary image
+                mask = segm_utils.polys_to_mask_wrt_box(poly_gt, roi_fg, M)
+                mask = np.array(mask > 0, dtype=np.int32)  # Ensure it's binary
+                masks[i, :] = np.reshape(mask, M**2)
     else:  # If there are no fg masks (it does happen)
         # The network cannot handle empty blobs, so we must provide a mask
         # We simply take the first bg roi, given it an all -1's mask (ignore
@@ -102,6 +113,72 @@ def add_mask_rcnn_blobs(blobs, sampled_boxes, roidb, im_scale, batch_idx):
     blobs['masks_int32'] = masks
 
 
+def _get_mask_bitmaps(entry, polys_gt, boxes_from_polys):
+    """Return the gt mask bitmaps of a roidb entry (see
+    cfg.MRCNN.MASK_BITMAP_SIZE) as an array of shape (len(polys_gt), S**2 / 8)
+    of packed bits. Each bitmap is the rasterization of the polygons of a gt
+    mask w.r.t. their bounding box. Bitmaps are computed on first use and then
+    cached.
+    """
+    global _mask_bitmap_cache
+    S = cfg.MRCNN.MASK_BITMAP_SIZE
+    with _mask_bitmap_cache_lock:
+        if _mask_bitmap_cache is None:
+            _mask_bitmap_cache = ImageCache(
+                cfg.MRCNN.MASK_BITMAP_CACHE_MB * 1024**2
+            )
+    key = (entry['image'], entry['flipped'])
+    bitmaps = _mask_bitmap_cache.get(key)
+    if bitmaps is None:
+        bitmaps = np.zeros((len(polys_gt), (S**2 + 7) // 8), dtype=np.uint8)
+        for i, poly_gt in enumerate(polys_gt):
+            bitmap = segm_utils.polys_to_mask_wrt_box(
+                poly_gt, boxes_from_polys[i], S
+            )
+            bitmaps[i, :] = np.packbits(bitmap.ravel() > 0)
+        _mask_bitmap_cache.put(key, bitmaps)
+    return bitmaps
+
+
+def _crop_and_resize_bitmaps(bitmaps, bitmap_boxes, bitmap_inds, rois, M):
+    """Compute the M x M binary mask targets of rois, the mask of each roi
+    being the bitmap (in packed bits, of the region bitmap_boxes[i] of the
+    image) with index bitmap_inds[i]. Each target pixel takes the value of the
+    bitmap pixel at its center (zero outside of the bitmap).
+    """
+    S = cfg.MRCNN.MASK_BITMAP_SIZE
+    # Only unpack the bitmaps that are used
+    unique_inds, roi_bitmap_inds = np.unique(bitmap_inds, return_inverse=True)
+    bitmaps = np.unpackbits(bitmaps[unique_inds], axis=1)[:, :S**2].reshape(
+        (-1, S, S)
+    )
+    bitmap_boxes = bitmap_boxes[bitmap_inds].astype(np.float64)
+    rois = rois.astype(np.float64)
+    # Box sizes as in segm_utils.polys_to_mask_wrt_box
+    bitmap_sizes = np.maximum(bitmap_boxes[:, 2:4] - bitmap_boxes[:, 0:2], 1)
+    roi_sizes = np.maximum(rois[:, 2:4] - rois[:, 0:2], 1)
+    # Image coordinates of the target pixel centers, shape (R, M, 2) ...
+    centers = (
+        rois[:, np.newaxis, 0:2] +
+        (np.arange(M)[np.newaxis, :, np.newaxis] + 0.5) *
+        roi_sizes[:, np.newaxis, :] / M
+    )
+    # ... and the bitmap pixels they fall in
+    pixels = np.floor(
+        (centers - bitmap_boxes[:, np.newaxis, 0:2]) * S /
+        bitmap_sizes[:, np.newaxis, :]
+    )
+    valid = (pixels >= 0) & (pixels < S)
+    pixels = np.clip(pixels, 0, S - 1).astype(np.int64)
+    x, y = pixels[:, :, 0], pixels[:, :, 1]
+    masks = bitmaps[
+        roi_bitmap_inds[:, np.newaxis, np.newaxis], y[:, :, np.newaxis],
+        x[:, np.newaxis, :]
+    ]
+    masks &= valid[:, :, np.newaxis, 1] & valid[:, np.newaxis, :, 0]
+    return masks.astype(np.int32)
+
+
 def _expand_to_class_specific_mask_targets(masks, mask_class_labels):
     """Expand masks from shape (#masks, M ** 2) to (#masks, #classes * M ** 2)
     to encode class specific mask targets.
@@ -114,13 +191,14 @@ def _expand_to_class_specific_mask_targets(masks, mask_class_labels):
         (masks.shape[0], cfg.MODEL.NUM_CLASSES * M**2), int32=True
     )
 
-    for i in range(masks.shape[0]):
-        cls = int(mask_class_labels[i])
-        start = M**2 * cls
-        end = start + M**2
-        # Ignore background instance
-        # (only happens when there is no fg samples in an image)
-        if cls > 0:
-            mask_targets[i, start:end] = masks[i, :]
+    # Ignore background instance
+    # (only happens when there is no fg samples in an image)
+    inds = np.where(mask_class_labels > 0)[0]
+    # Columns M**2 * cls, ..., M**2 * (cls + 1) - 1 of each instance
+    cols = (
+        M**2 * mask_class_labels[inds].astype(np.int64)[:, np.newaxis] +
+        np.arange(M**2)
+    )
+    mask_targets[inds[:, np.newaxis], cols] = masks[inds, :]
 
     return mask_targets
@@ -28,12 +28,13 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import cv2
 import logging
 import numpy as np
 
 from detectron.core.config import cfg
 import detectron.roi_data.fast_rcnn as fast_rcnn_roi_data
+import detectron.roi_data.image_cache as image_cache
+import detectron.roi_data.minibatch_stats as minibatch_stats
 import detectron.roi_data.retinanet as retinanet_roi_data
 import detectron.roi_data.rpn as rpn_roi_data
 import detectron.utils.blob as blob_utils
@@ -61,56 +62,86 @@ def get_minibatch_blob_names(is_training=True):
     return blob_names
 
 
-def get_minibatch(roidb):
-    """Given a roidb, construct a minibatch sampled from it."""
+def get_minibatch(roidb, roidb_blob=None, alloc=None):
+    """Given a roidb, construct a minibatch sampled from it. If given,
+    roidb_blob references the roidb entries in the roidb store (see
+    roi_data.roidb_store) and alloc is used to allocate the image blob (see
+    blob_utils.im_list_to_blob).
+    """
     # We collect blobs from each image onto a list and then concat them into a
     # single tensor, hence we initialize each blob to an empty list
     blobs = {k: [] for k in get_minibatch_blob_names()}
     # Get the input image blob, formatted for caffe2
-    im_blob, im_scales = _get_image_blob(roidb)
+    im_blob, im_scales = _get_image_blob(roidb, alloc=alloc)
     blobs['data'] = im_blob
     if cfg.RPN.RPN_ON:
         # RPN-only or end-to-end Faster/Mask R-CNN
-        valid = rpn_roi_data.add_rpn_blobs(blobs, im_scales, roidb)
+        with minibatch_stats.stage_timer('rpn_targets'):
+            valid = rpn_roi_data.add_rpn_blobs(
+                blobs, im_scales, roidb, roidb_blob=roidb_blob
+            )
     elif cfg.RETINANET.RETINANET_ON:
         im_width, im_height = im_blob.shape[3], im_blob.shape[2]
         # im_width, im_height corresponds to the network input: padded image
         # (if needed) width and height. We pass it as input and slice the data
         # accordingly so that we don't need to use SampleAsOp
-        valid = retinanet_roi_data.add_retinanet_blobs(
-            blobs, im_scales, roidb, im_width, im_height
-        )
+        with minibatch_stats.stage_timer('retinanet_targets'):
+            valid = retinanet_roi_data.add_retinanet_blobs(
+                blobs, im_scales, roidb, im_width, im_height
+            )
     else:
         # Fast R-CNN like models trained on precomputed proposals
-        valid = fast_rcnn_roi_data.add_fast_rcnn_blobs(blobs, im_scales, roidb)
+        with minibatch_stats.stage_timer('roi_sampling'):
+            valid = fast_rcnn_roi_data.add_fast_rcnn_blobs(
+                blobs, im_scales, roidb
+            )
     return blobs, valid
 
 
-def _get_image_blob(roidb):
+def _get_image_blob(roidb, alloc=None):
     """Builds an input blob from the images in the roidb at the specified
     scales.
     """
     num_images = len(roidb)
     # Sample random scales to use for each image in this batch
-    scale_inds = np.random.randint(
-        0, high=len(cfg.TRAIN.SCALES), size=num_images
-    )
+    if cfg.TRAIN.SCALE_PER_MINIBATCH:
+        scale_inds = np.repeat(
+            np.random.randint(0, high=len(cfg.TRAIN.SCALES)), num_images
+        )
+    else:
+        scale_inds = np.random.randint(
+            0, high=len(cfg.TRAIN.SCALES), size=num_images
+        )
     processed_ims = []
     im_scales = []
     for i in range(num_images):
-        im = cv2.imread(roidb[i]['image'])
-        assert im is not None, \
-            'Failed to read image \'{}\''.format(roidb[i]['image'])
+        target_size = cfg.TRAIN.SCALES[scale_inds[i]]
+        with minibatch_stats.stage_timer('imread'):
+            im, im_scale = image_cache.read_training_image(
+                roidb[i], target_size
+            )
         if roidb[i]['flipped']:
             im = im[:, ::-1, :]
-        target_size = cfg.TRAIN.SCALES[scale_inds[i]]
-        im, im_scale = blob_utils.prep_im_for_blob(
-            im, cfg.PIXEL_MEANS, target_size, cfg.TRAIN.MAX_SIZE
-        )
+        with minibatch_stats.stage_timer('resize'):
+            if im_scale is None:
+                im, im_scale = blob_utils.prep_im_for_blob(
+                    im, cfg.PIXEL_MEANS, target_size, cfg.TRAIN.MAX_SIZE
+                )
+            else:
+                # The image cache has already resized the image
+                im = im.astype(np.float32)
+                im -= cfg.PIXEL_MEANS
         im_scales.append(im_scale)
         processed_ims.append(im)
 
     # Create a blob to hold the input images
-    blob = blob_utils.im_list_to_blob(processed_ims)
+    with minibatch_stats.stage_timer('blob'):
+        blob = blob_utils.im_list_to_blob(processed_ims, alloc=alloc)
+    # Fraction of the blob that is padding
+    im_area = sum(im.shape[0] * im.shape[1] for im in processed_ims)
+    minibatch_stats.add_value(
+        'pad_fraction',
+        1. - im_area / (blob.shape[0] * blob.shape[2] * blob.shape[3])
+    )
 
     return blob, im_scales
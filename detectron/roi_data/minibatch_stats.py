@@ -0,0 +1,103 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Statistics of the construction of minibatches (e.g., the fraction of the
+data blob that is padding).
+
+Values are recorded by the thread (or worker process) that builds a minibatch,
+with add_value, and are collected after the minibatch is built, with
+pop_values, by the data loader, which reports them in the training stats.
+Only the data loader threads and processes, which call enable, record values.
+
+With cfg.DATA_LOADER.PROFILE_STAGES, the wall time of each stage of the
+construction of a minibatch (e.g., image reading or RPN targets) is recorded as
+well, as a 'time_<stage>' value. Stages are timed with stage_timer; the time of
+a nested stage is not counted in the enclosing stage.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import contextlib
+import threading
+import time
+
+from detectron.core.config import cfg
+
+# Prefix of the names of stage time statistics
+STAGE_TIME_PREFIX = 'time_'
+
+_threadlocal = threading.local()
+
+
+def enable():
+    """Record the values of the current thread from now on."""
+    if _get_values() is None:
+        _threadlocal.values = {}
+        _threadlocal.stage_times = {}
+        # Time of the nested stages of each running stage
+        _threadlocal.nested_times = []
+
+
+def add_value(name, value):
+    """Record a value of a statistic of the minibatch being built by the
+    current thread.
+    """
+    values = _get_values()
+    if values is not None:
+        values.setdefault(name, []).append(value)
+
+
+@contextlib.contextmanager
+def stage_timer(stage):
+    """Time a stage of the construction of the minibatch being built by the
+    current thread (if cfg.DATA_LOADER.PROFILE_STAGES).
+    """
+    if not cfg.DATA_LOADER.PROFILE_STAGES or _get_values() is None:
+        yield
+        return
+    nested_times = _threadlocal.nested_times
+    nested_times.append(0.)
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        duration = time.time() - start_time
+        stage_time = duration - nested_times.pop()
+        if len(nested_times) > 0:
+            nested_times[-1] += duration
+        stage_times = _threadlocal.stage_times
+        stage_times[stage] = stage_times.get(stage, 0.) + stage_time
+
+
+def pop_values():
+    """Return the values recorded by the current thread since the last call,
+    as a dict of statistic name -> list of values. The total time of each
+    stage is a single value.
+    """
+    values = _get_values()
+    if values is None:
+        return {}
+    for stage, stage_time in _threadlocal.stage_times.items():
+        values[STAGE_TIME_PREFIX + stage] = [stage_time]
+    _threadlocal.values = {}
+    _threadlocal.stage_times = {}
+    return values
+
+
+def _get_values():
+    return getattr(_threadlocal, 'values', None)
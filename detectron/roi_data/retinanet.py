@@ -23,7 +23,6 @@ from __future__ import unicode_literals
 import numpy as np
 import logging
 
-import detectron.utils.boxes as box_utils
 import detectron.roi_data.data_utils as data_utils
 from detectron.core.config import cfg
 
@@ -198,23 +197,10 @@ def _get_retinanet_blobs(
     labels = np.empty((num_inside, ), dtype=np.float32)
     labels.fill(-1)
     if len(gt_boxes) > 0:
-        # Compute overlaps between the anchors and the gt boxes overlaps
-        anchor_by_gt_overlap = box_utils.bbox_overlaps(anchors, gt_boxes)
-        # Map from anchor to gt box that has highest overlap
-        anchor_to_gt_argmax = anchor_by_gt_overlap.argmax(axis=1)
-        # For each anchor, amount of overlap with most overlapping gt box
-        anchor_to_gt_max = anchor_by_gt_overlap[
-            np.arange(num_inside), anchor_to_gt_argmax]
-
-        # Map from gt box to an anchor that has highest overlap
-        gt_to_anchor_argmax = anchor_by_gt_overlap.argmax(axis=0)
-        # For each gt box, amount of overlap with most overlapping anchor
-        gt_to_anchor_max = anchor_by_gt_overlap[
-            gt_to_anchor_argmax, np.arange(anchor_by_gt_overlap.shape[1])]
-        # Find all anchors that share the max overlap amount
-        # (this includes many ties)
-        anchors_with_max_overlap = np.where(
-            anchor_by_gt_overlap == gt_to_anchor_max)[0]
+        # Match anchors to gt boxes by their overlaps
+        anchor_to_gt_argmax, anchor_to_gt_max, anchors_with_max_overlap = \
+            data_utils.match_anchors_to_gt(
+                foas, all_anchors, inds_inside, gt_boxes)
 
         # Fg label: for each gt use anchors with highest overlap
         # (including ties)
@@ -0,0 +1,94 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Registry of the training roidbs shared by the data loader and the Python
+ops of the network.
+
+During end-to-end training the GenerateProposalLabels and
+CollectAndDistributeFpnRpnProposals ops label the RPN proposals using the
+roidb entries of the minibatch, which they get from the 'roidb' blob. By
+default the entries are pickled into the blob (see blob_utils.serialize). With
+cfg.DATA_LOADER.ROIDB_STORE the data loader registers its roidb here and the
+blob only holds the int32 array [handle, roidb index, roidb index, ...]; the
+ops look the entries up in the registered roidb, which is never modified.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import itertools
+import numpy as np
+import threading
+
+import detectron.utils.blob as blob_utils
+
+# Keys of the roidb entries used to label the RPN proposals (image and flipped
+# identify the entry, e.g., for cfg.MRCNN.MASK_BITMAP_SIZE)
+_MINIMAL_ROIDB_KEYS = [
+    'image', 'flipped', 'has_visible_keypoints', 'boxes', 'segms', 'seg_areas',
+    'gt_classes', 'gt_overlaps', 'is_crowd', 'box_to_gt_ind_map',
+    'gt_keypoints'
+]
+
+_roidbs = {}
+_roidbs_lock = threading.Lock()
+_handles = itertools.count()
+
+
+def register(roidb):
+    """Register a roidb and return its handle. The roidb must not be modified
+    while it is registered.
+    """
+    with _roidbs_lock:
+        handle = next(_handles)
+        _roidbs[handle] = roidb
+    return handle
+
+
+def unregister(handle):
+    with _roidbs_lock:
+        del _roidbs[handle]
+
+
+def get_roidb_blob(handle, db_inds):
+    """Return the 'roidb' blob referencing the entries db_inds of the roidb
+    registered with handle.
+    """
+    return np.array([handle] + list(db_inds), dtype=np.int32)
+
+
+def get_minimal_roidb(roidb):
+    """Return shallow copies of the roidb entries restricted to the keys used
+    to label the RPN proposals. Labeling replaces (and does not modify) the
+    values of the copies.
+    """
+    return [
+        {k: entry[k] for k in _MINIMAL_ROIDB_KEYS if k in entry}
+        for entry in roidb
+    ]
+
+
+def roidb_from_blob(blob):
+    """Return the minimal roidb entries (see get_minimal_roidb) held by, or
+    referenced by, a 'roidb' blob.
+    """
+    if blob.dtype != np.int32:
+        return blob_utils.deserialize(blob)
+    handle, db_inds = int(blob[0]), blob[1:]
+    with _roidbs_lock:
+        roidb = _roidbs[handle]
+    return get_minimal_roidb([roidb[int(i)] for i in db_inds])
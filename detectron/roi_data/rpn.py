@@ -26,8 +26,9 @@ import numpy.random as npr
 
 from detectron.core.config import cfg
 import detectron.roi_data.data_utils as data_utils
+import detectron.roi_data.minibatch_stats as minibatch_stats
+import detectron.roi_data.roidb_store as roidb_store
 import detectron.utils.blob as blob_utils
-import detectron.utils.boxes as box_utils
 
 logger = logging.getLogger(__name__)
 
@@ -59,8 +60,12 @@ def get_rpn_blob_names(is_training=True):
     return blob_names
 
 
-def add_rpn_blobs(blobs, im_scales, roidb):
-    """Add blobs needed training RPN-only and end-to-end Faster R-CNN models."""
+def add_rpn_blobs(blobs, im_scales, roidb, roidb_blob=None):
+    """Add blobs needed training RPN-only and end-to-end Faster R-CNN models.
+    If given, roidb_blob references the roidb entries in the roidb store (see
+    roi_data.roidb_store) and is used as the 'roidb' blob instead of the
+    serialized entries.
+    """
     if cfg.FPN.FPN_ON and cfg.FPN.MULTILEVEL_RPN:
         # RPN applied to many feature levels, as in the FPN paper
         k_max = cfg.FPN.RPN_MAX_LEVEL
@@ -119,16 +124,13 @@ def add_rpn_blobs(blobs, im_scales, roidb):
         if isinstance(v, list) and len(v) > 0:
             blobs[k] = np.concatenate(v)
 
-    valid_keys = [
-        'has_visible_keypoints', 'boxes', 'segms', 'seg_areas', 'gt_classes',
-        'gt_overlaps', 'is_crowd', 'box_to_gt_ind_map', 'gt_keypoints'
-    ]
-    minimal_roidb = [{} for _ in range(len(roidb))]
-    for i, e in enumerate(roidb):
-        for k in valid_keys:
-            if k in e:
-                minimal_roidb[i][k] = e[k]
-    blobs['roidb'] = blob_utils.serialize(minimal_roidb)
+    if roidb_blob is not None:
+        blobs['roidb'] = roidb_blob
+    else:
+        with minibatch_stats.stage_timer('serialize'):
+            blobs['roidb'] = blob_utils.serialize(
+                roidb_store.get_minimal_roidb(roidb)
+            )
 
     # Always return valid=True, since RPN minibatches are valid by design
     return True
@@ -138,21 +140,14 @@ def _get_rpn_blobs(im_height, im_width, foas, all_anchors, gt_boxes):
     total_anchors = all_anchors.shape[0]
     straddle_thresh = cfg.TRAIN.RPN_STRADDLE_THRESH
 
-    if straddle_thresh >= 0:
-        # Only keep anchors inside the image by a margin of straddle_thresh
-        # Set TRAIN.RPN_STRADDLE_THRESH to -1 (or a large value) to keep all
-        # anchors
-        inds_inside = np.where(
-            (all_anchors[:, 0] >= -straddle_thresh) &
-            (all_anchors[:, 1] >= -straddle_thresh) &
-            (all_anchors[:, 2] < im_width + straddle_thresh) &
-            (all_anchors[:, 3] < im_height + straddle_thresh)
-        )[0]
-        # keep only inside anchors
-        anchors = all_anchors[inds_inside, :]
-    else:
-        inds_inside = np.arange(all_anchors.shape[0])
-        anchors = all_anchors
+    # Only keep anchors inside the image by a margin of straddle_thresh
+    # Set TRAIN.RPN_STRADDLE_THRESH to -1 (or a large value) to keep all
+    # anchors
+    inside_anchors = data_utils.get_inside_anchors(
+        foas, all_anchors, im_height, im_width, straddle_thresh
+    )
+    inds_inside = inside_anchors.inds
+    anchors = inside_anchors.anchors
     num_inside = len(inds_inside)
 
     logger.debug('total_anchors: {}'.format(total_anchors))
@@ -164,26 +159,12 @@ def _get_rpn_blobs(im_height, im_width, foas, all_anchors, gt_boxes):
     labels = np.empty((num_inside, ), dtype=np.int32)
     labels.fill(-1)
     if len(gt_boxes) > 0:
-        # Compute overlaps between the anchors and the gt boxes overlaps
-        anchor_by_gt_overlap = box_utils.bbox_overlaps(anchors, gt_boxes)
-        # Map from anchor to gt box that has highest overlap
-        anchor_to_gt_argmax = anchor_by_gt_overlap.argmax(axis=1)
-        # For each anchor, amount of overlap with most overlapping gt box
-        anchor_to_gt_max = anchor_by_gt_overlap[np.arange(num_inside),
-                                                anchor_to_gt_argmax]
-
-        # Map from gt box to an anchor that has highest overlap
-        gt_to_anchor_argmax = anchor_by_gt_overlap.argmax(axis=0)
-        # For each gt box, amount of overlap with most overlapping anchor
-        gt_to_anchor_max = anchor_by_gt_overlap[
-            gt_to_anchor_argmax,
-            np.arange(anchor_by_gt_overlap.shape[1])
-        ]
-        # Find all anchors that share the max overlap amount
-        # (this includes many ties)
-        anchors_with_max_overlap = np.where(
-            anchor_by_gt_overlap == gt_to_anchor_max
-        )[0]
+        # Match anchors to gt boxes by their overlaps
+        anchor_to_gt_argmax, anchor_to_gt_max, anchors_with_max_overlap = \
+            data_utils.match_anchors_to_gt(
+                foas, all_anchors, inds_inside, gt_boxes,
+                inside_positions=inside_anchors.positions
+            )
 
         # Fg label: for each gt use anchors with highest overlap
         # (including ties)
@@ -211,8 +192,16 @@ def _get_rpn_blobs(im_height, im_width, foas, all_anchors, gt_boxes):
         labels[enable_inds] = 0
     bg_inds = np.where(labels == 0)[0]
 
-    bbox_targets = np.zeros((num_inside, 4), dtype=np.float32)
-    bbox_targets[fg_inds, :] = data_utils.compute_targets(
+    # Outputs are computed directly for the original set of anchors, only
+    # setting the entries of sampled anchors (all other anchors are ignored)
+    labels_inside = labels
+    sampled_inds = np.where(labels_inside >= 0)[0]
+    labels = np.empty((total_anchors, ), dtype=np.int32)
+    labels.fill(-1)
+    labels[inds_inside[sampled_inds]] = labels_inside[sampled_inds]
+
+    bbox_targets = np.zeros((total_anchors, 4), dtype=np.float32)
+    bbox_targets[inds_inside[fg_inds], :] = data_utils.compute_targets(
         anchors[fg_inds, :], gt_boxes[anchor_to_gt_argmax[fg_inds], :]
     )
 
@@ -221,31 +210,20 @@ def _get_rpn_blobs(im_height, im_width, foas, all_anchors, gt_boxes):
     # Inside weights allow us to set zero loss on an element-wise basis
     # Bbox regression is only trained on positive examples so we set their
     # weights to 1.0 (or otherwise if config is different) and 0 otherwise
-    bbox_inside_weights = np.zeros((num_inside, 4), dtype=np.float32)
-    bbox_inside_weights[labels == 1, :] = (1.0, 1.0, 1.0, 1.0)
+    bbox_inside_weights = np.zeros((total_anchors, 4), dtype=np.float32)
+    bbox_inside_weights[inds_inside[labels_inside == 1], :] = (
+        1.0, 1.0, 1.0, 1.0
+    )
 
     # The bbox regression loss only averages by the number of images in the
     # mini-batch, whereas we need to average by the total number of example
     # anchors selected
     # Outside weights are used to scale each element-wise loss so the final
     # average over the mini-batch is correct
-    bbox_outside_weights = np.zeros((num_inside, 4), dtype=np.float32)
+    bbox_outside_weights = np.zeros((total_anchors, 4), dtype=np.float32)
     # uniform weighting of examples (given non-uniform sampling)
-    num_examples = np.sum(labels >= 0)
-    bbox_outside_weights[labels == 1, :] = 1.0 / num_examples
-    bbox_outside_weights[labels == 0, :] = 1.0 / num_examples
-
-    # Map up to original set of anchors
-    labels = data_utils.unmap(labels, total_anchors, inds_inside, fill=-1)
-    bbox_targets = data_utils.unmap(
-        bbox_targets, total_anchors, inds_inside, fill=0
-    )
-    bbox_inside_weights = data_utils.unmap(
-        bbox_inside_weights, total_anchors, inds_inside, fill=0
-    )
-    bbox_outside_weights = data_utils.unmap(
-        bbox_outside_weights, total_anchors, inds_inside, fill=0
-    )
+    num_examples = np.sum(labels_inside >= 0)
+    bbox_outside_weights[inds_inside[sampled_inds], :] = 1.0 / num_examples
 
     # Split the generated labels, etc. into labels per each field of anchors
     blobs_out = []
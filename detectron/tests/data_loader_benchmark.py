@@ -21,6 +21,12 @@
 #   DATA_LOADER.NUM_THREADS 4 \
 #   DATA_LOADER.MINIBATCH_QUEUE_SIZE 64 \
 #   DATA_LOADER.BLOBS_QUEUE_CAPACITY 8
+#
+# To compare the time of sparse and dense anchor matching for RPN / RetinaNet
+# targets (see TRAIN.SPARSE_ANCHOR_MATCHING), add --anchor-matching
+#
+# To find which stages of the construction of minibatches (image reading,
+# resizing, RPN targets, ...) take the most time, add --stage-profile
 
 from __future__ import absolute_import
 from __future__ import division
@@ -44,8 +50,14 @@ from detectron.core.config import merge_cfg_from_file
 from detectron.core.config import merge_cfg_from_list
 from detectron.datasets.roidb import combined_roidb_for_training
 from detectron.roi_data.loader import RoIDataLoader
+from detectron.roi_data.minibatch import get_minibatch
+from detectron.roi_data.retinanet import _get_retinanet_blobs
+from detectron.roi_data.rpn import _get_rpn_blobs
 from detectron.utils.logging import setup_logging
 from detectron.utils.timer import Timer
+import detectron.roi_data.data_utils as data_utils
+import detectron.roi_data.minibatch_stats as minibatch_stats
+import detectron.utils.blob as blob_utils
 
 
 def parse_args():
@@ -67,6 +79,16 @@ def parse_args():
     parser.add_argument(
         '--profiler', dest='profiler', help='profile minibatch load time',
         action='store_true')
+    parser.add_argument(
+        '--anchor-matching', dest='anchor_matching',
+        help='benchmark sparse vs. dense anchor matching of --num-batches '
+        'images instead of the data loader',
+        action='store_true')
+    parser.add_argument(
+        '--stage-profile', dest='stage_profile',
+        help='print percentiles of the time of each stage of the construction '
+        'of --num-batches minibatches instead of running the data loader',
+        action='store_true')
     parser.add_argument(
         'opts', help='See detectron/core/config.py for all options', default=None,
         nargs=argparse.REMAINDER)
@@ -86,6 +108,115 @@ def loader_loop(roi_data_loader):
         load_timer.toc()
         print('{:d}/{:d}: Average get_next_minibatch time: {:.3f}s'.format(
               i + 1, iters, load_timer.average_time))
+    print('Minibatch stats: {}'.format(roi_data_loader.get_minibatch_stats()))
+
+
+def get_anchor_targets(entry, foas, all_anchors):
+    scale = blob_utils.get_target_scale(
+        (entry['height'], entry['width']), cfg.TRAIN.SCALES[0],
+        cfg.TRAIN.MAX_SIZE)
+    im_height = np.round(entry['height'] * scale)
+    im_width = np.round(entry['width'] * scale)
+    gt_inds = np.where(
+        (entry['gt_classes'] > 0) & (entry['is_crowd'] == 0))[0]
+    gt_rois = entry['boxes'][gt_inds, :] * scale
+    if cfg.RETINANET.RETINANET_ON:
+        blobs = _get_retinanet_blobs(
+            foas, all_anchors, gt_rois, entry['gt_classes'][gt_inds],
+            im_width, im_height)[0]
+    else:
+        blobs = _get_rpn_blobs(
+            im_height, im_width, foas, all_anchors, gt_rois)
+    return blobs if isinstance(blobs, list) else [blobs]
+
+
+def anchor_matching_benchmark(roidb, num_images):
+    """Time the RPN (or RetinaNet) targets of num_images images with sparse
+    and dense anchor matching, and check that they are the same."""
+    logger = logging.getLogger(__name__)
+    if cfg.RETINANET.RETINANET_ON:
+        foas = []
+        for lvl in range(cfg.FPN.RPN_MIN_LEVEL, cfg.FPN.RPN_MAX_LEVEL + 1):
+            stride = 2.**lvl
+            for octave in range(cfg.RETINANET.SCALES_PER_OCTAVE):
+                octave_scale = 2**(
+                    octave / float(cfg.RETINANET.SCALES_PER_OCTAVE))
+                for idx, aspect_ratio in enumerate(
+                        cfg.RETINANET.ASPECT_RATIOS):
+                    foas.append(data_utils.get_field_of_anchors(
+                        stride,
+                        (stride * octave_scale * cfg.RETINANET.ANCHOR_SCALE, ),
+                        (aspect_ratio, ), octave, idx))
+    elif cfg.FPN.FPN_ON and cfg.FPN.MULTILEVEL_RPN:
+        k_min = cfg.FPN.RPN_MIN_LEVEL
+        foas = [
+            data_utils.get_field_of_anchors(
+                2.**lvl,
+                (cfg.FPN.RPN_ANCHOR_START_SIZE * 2.**(lvl - k_min), ),
+                cfg.FPN.RPN_ASPECT_RATIOS)
+            for lvl in range(k_min, cfg.FPN.RPN_MAX_LEVEL + 1)]
+    else:
+        foas = [data_utils.get_field_of_anchors(
+            cfg.RPN.STRIDE, cfg.RPN.SIZES, cfg.RPN.ASPECT_RATIOS)]
+    all_anchors = np.concatenate([f.field_of_anchors for f in foas])
+    logger.info('{:d} anchors'.format(all_anchors.shape[0]))
+    roidb = [
+        e for e in roidb
+        if np.any((e['gt_classes'] > 0) & (e['is_crowd'] == 0))
+    ][:num_images]
+    timers = {True: Timer(), False: Timer()}
+    for i, entry in enumerate(roidb):
+        blobs = {}
+        for sparse in (False, True):
+            cfg.TRAIN.SPARSE_ANCHOR_MATCHING = sparse
+            # Same sampling of fg / bg anchors for both
+            np.random.seed(i)
+            timers[sparse].tic()
+            blobs[sparse] = get_anchor_targets(entry, foas, all_anchors)
+            timers[sparse].toc()
+        for dense_level, sparse_level in zip(blobs[False], blobs[True]):
+            for k, v in dense_level.items():
+                assert np.array_equal(v, sparse_level[k]), \
+                    'Sparse and dense anchor matching differ in ' + k
+        logger.info(
+            '{:d}/{:d}: {:d} gt boxes, average target time: dense {:.4f}s, '
+            'sparse {:.4f}s'.format(
+                i + 1, len(roidb), len(entry['boxes']),
+                timers[False].average_time, timers[True].average_time))
+
+
+def stage_profile_benchmark(roidb, num_batches):
+    """Build num_batches minibatches and print percentiles of the time of each
+    stage of their construction (see cfg.DATA_LOADER.PROFILE_STAGES)."""
+    logger = logging.getLogger(__name__)
+    minibatch_stats.enable()
+    prefix = minibatch_stats.STAGE_TIME_PREFIX
+    stage_times = {}
+    total_times = np.zeros(num_batches)
+    timer = Timer()
+    for i in range(num_batches):
+        db_inds = np.random.choice(
+            len(roidb), cfg.TRAIN.IMS_PER_BATCH, replace=False)
+        timer.tic()
+        get_minibatch([roidb[j] for j in db_inds])
+        total_times[i] = timer.toc(average=False)
+        for name, values in minibatch_stats.pop_values().items():
+            if name.startswith(prefix):
+                stage = name[len(prefix):]
+                if stage not in stage_times:
+                    stage_times[stage] = np.zeros(num_batches)
+                stage_times[stage][i] = sum(values)
+        logger.info('{:d}/{:d}: Average minibatch time: {:.3f}s'.format(
+            i + 1, num_batches, timer.average_time))
+    stage_times['other'] = total_times - sum(stage_times.values())
+    stage_times['total'] = total_times
+    print('{:<20s} {:>10s} {:>10s} {:>10s} {:>8s}'.format(
+        'stage', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'share'))
+    for stage, times in sorted(
+            stage_times.items(), key=lambda item: -item[1].sum()):
+        p50, p90, p99 = 1000 * np.percentile(times, (50, 90, 99))
+        print('{:<20s} {:10.2f} {:10.2f} {:10.2f} {:7.1f}%'.format(
+            stage, p50, p90, p99, 100 * times.sum() / total_times.sum()))
 
 
 def main(opts):
@@ -93,11 +224,26 @@ def main(opts):
     roidb = combined_roidb_for_training(
         cfg.TRAIN.DATASETS, cfg.TRAIN.PROPOSAL_FILES)
     logger.info('{:d} roidb entries'.format(len(roidb)))
+    if opts.anchor_matching:
+        anchor_matching_benchmark(roidb, opts.num_batches)
+        return
+    if opts.stage_profile:
+        stage_profile_benchmark(roidb, opts.num_batches)
+        return
     roi_data_loader = RoIDataLoader(
         roidb,
         num_loaders=cfg.DATA_LOADER.NUM_THREADS,
         minibatch_queue_size=cfg.DATA_LOADER.MINIBATCH_QUEUE_SIZE,
-        blobs_queue_capacity=cfg.DATA_LOADER.BLOBS_QUEUE_CAPACITY
+        blobs_queue_capacity=cfg.DATA_LOADER.BLOBS_QUEUE_CAPACITY,
+        use_processes=cfg.DATA_LOADER.USE_PROCESSES,
+        use_shared_ring=cfg.DATA_LOADER.USE_SHARED_RING,
+        shared_ring_size=cfg.DATA_LOADER.SHARED_RING_SIZE,
+        min_loaders=(
+            cfg.DATA_LOADER.MIN_THREADS if cfg.DATA_LOADER.AUTOSCALE else None
+        ),
+        max_loaders=(
+            cfg.DATA_LOADER.MAX_THREADS if cfg.DATA_LOADER.AUTOSCALE else None
+        )
     )
     blob_names = roi_data_loader.get_output_names()
 
@@ -133,10 +279,12 @@ def main(opts):
             workspace.RunNetOnce(net)
         total_time += (time.time() - start_t) / opts.x_factor
         logger.info(
-            '{:d}/{:d}: Averge dequeue time: {:.3f}s  [{:d}/{:d}]'.format(
+            '{:d}/{:d}: Averge dequeue time: {:.3f}s  [{:d}/{:d}]  '
+            '{:d} loaders'.format(
                 i + 1, opts.num_batches, total_time / (i + 1),
                 roi_data_loader._minibatch_queue.qsize(),
-                cfg.DATA_LOADER.MINIBATCH_QUEUE_SIZE
+                cfg.DATA_LOADER.MINIBATCH_QUEUE_SIZE,
+                roi_data_loader.get_num_active_loaders()
             )
         )
         # Sleep to simulate the time taken by running a little network
@@ -161,6 +309,8 @@ if __name__ == '__main__':
         merge_cfg_from_file(args.cfg_file)
     if args.opts is not None:
         merge_cfg_from_list(args.opts)
+    if args.stage_profile:
+        cfg.DATA_LOADER.PROFILE_STAGES = True
     assert_and_infer_cfg()
     logger.info('Running with config:')
     logger.info(pprint.pformat(cfg))
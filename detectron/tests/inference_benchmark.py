@@ -0,0 +1,154 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+# Measures the inference throughput (images / second) of a model for several
+# numbers of images per forward pass (see core.test.im_detect_all_batch).
+#
+# Example usage:
+# inference_benchmark.par \
+#   --cfg configs/12_2017_baselines/e2e_mask_rcnn_R-101-FPN_2x.yaml \
+#   --wts /path/to/model_final.pkl \
+#   --batch-sizes 1,2,4,8 \
+#   /path/to/images
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import argparse
+import cv2  # NOQA (Must import before importing caffe2 due to bug in cv2)
+import glob
+import logging
+import os
+import sys
+import time
+
+from caffe2.python import workspace
+
+from detectron.core.config import assert_and_infer_cfg
+from detectron.core.config import cfg
+from detectron.core.config import merge_cfg_from_file
+from detectron.core.config import merge_cfg_from_list
+from detectron.utils.io import cache_url
+from detectron.utils.logging import setup_logging
+from detectron.utils.timer import Timer
+import detectron.core.test as test
+import detectron.core.test_engine as test_engine
+import detectron.utils.c2 as c2_utils
+
+c2_utils.import_detectron_ops()
+cv2.ocl.setUseOpenCL(False)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--cfg', dest='cfg_file', help='config file', default=None,
+        type=str)
+    parser.add_argument(
+        '--wts', dest='weights', help='weights model file', default=None,
+        type=str)
+    parser.add_argument(
+        '--batch-sizes', dest='batch_sizes',
+        help='comma separated numbers of images per forward pass',
+        default='1,2,4,8', type=str)
+    parser.add_argument(
+        '--num-images', dest='num_images',
+        help='number of images to run for each batch size',
+        default=200, type=int)
+    parser.add_argument(
+        '--image-ext', dest='image_ext', help='image file name extension',
+        default='jpg', type=str)
+    parser.add_argument(
+        'im_folder', help='folder of images', default=None)
+    parser.add_argument(
+        'opts', help='See detectron/core/config.py for all options', default=None,
+        nargs=argparse.REMAINDER)
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+    args = parser.parse_args()
+    return args
+
+
+def run_batches(model, ims, ims_per_batch, num_images):
+    """Run inference on num_images images (cycling through ims) in batches of
+    ims_per_batch images and return the timers and the total time.
+    """
+    timers = defaultdict(Timer)
+    start_t = time.time()
+    for i in range(0, num_images, ims_per_batch):
+        batch = [
+            ims[j % len(ims)]
+            for j in range(i, min(i + ims_per_batch, num_images))
+        ]
+        with c2_utils.NamedCudaScope(0):
+            test.im_detect_all_batch(model, batch, timers=timers)
+    return timers, time.time() - start_t
+
+
+def main(opts):
+    logger = logging.getLogger(__name__)
+    if not test.is_batch_inference_supported():
+        logger.warning(
+            'Images of this model are inferred one at a time; all batch sizes '
+            'are expected to give the same throughput'
+        )
+    im_names = sorted(
+        glob.glob(os.path.join(opts.im_folder, '*.' + opts.image_ext))
+    )
+    assert len(im_names) > 0, 'No images found in {}'.format(opts.im_folder)
+    ims = [cv2.imread(im_name) for im_name in im_names[:opts.num_images]]
+    model = test_engine.initialize_model_from_cfg(opts.weights)
+    batch_sizes = [int(n) for n in opts.batch_sizes.split(',')]
+
+    # Warm up (caches and auto-tuning) with every batch size
+    for ims_per_batch in batch_sizes:
+        run_batches(model, ims, ims_per_batch, ims_per_batch)
+
+    for ims_per_batch in batch_sizes:
+        timers, total_time = run_batches(
+            model, ims, ims_per_batch, opts.num_images
+        )
+        logger.info(
+            'Batch size {:d}: {:.2f} images/s ({:.3f}s per batch)'.format(
+                ims_per_batch, opts.num_images / total_time,
+                total_time * ims_per_batch / opts.num_images
+            )
+        )
+        for k, v in sorted(timers.items()):
+            logger.info(
+                ' | {}: {:.3f}s per image'.format(
+                    k, v.total_time / opts.num_images
+                )
+            )
+
+
+if __name__ == '__main__':
+    workspace.GlobalInit(['caffe2', '--caffe2_log_level=0'])
+    logger = setup_logging(__name__)
+    args = parse_args()
+    logger.info('Called with args:')
+    logger.info(args)
+    if args.cfg_file is not None:
+        merge_cfg_from_file(args.cfg_file)
+    if args.opts is not None:
+        merge_cfg_from_list(args.opts)
+    cfg.NUM_GPUS = 1
+    args.weights = cache_url(args.weights, cfg.DOWNLOAD_CACHE)
+    assert_and_infer_cfg(cache_urls=False)
+    main(args)
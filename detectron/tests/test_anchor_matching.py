@@ -0,0 +1,203 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import unittest
+
+from detectron.core.config import cfg
+import detectron.roi_data.data_utils as data_utils
+import detectron.roi_data.retinanet as retinanet_roi_data
+import detectron.roi_data.rpn as rpn_roi_data
+
+
+def random_gt_boxes(rng, num_boxes, im_width, im_height):
+    # Mix of tiny, small and large boxes, some extending beyond the image
+    x1 = rng.uniform(-20, im_width, size=num_boxes)
+    y1 = rng.uniform(-20, im_height, size=num_boxes)
+    w = rng.choice([0, 1.5, 4, 10, 30, 100, 600], size=num_boxes)
+    h = rng.choice([0, 2, 7.5, 15, 50, 200, 500], size=num_boxes)
+    return np.vstack((x1, y1, x1 + w, y1 + h)).transpose().astype(np.float32)
+
+
+def get_fpn_foas():
+    foas = []
+    for lvl in range(cfg.FPN.RPN_MIN_LEVEL, cfg.FPN.RPN_MAX_LEVEL + 1):
+        foas.append(
+            data_utils.get_field_of_anchors(
+                2.**lvl, (32 * 2.**(lvl - cfg.FPN.RPN_MIN_LEVEL), ),
+                (0.5, 1, 2)
+            )
+        )
+    return foas
+
+
+class TestAnchorMatching(unittest.TestCase):
+    def setUp(self):
+        # Always use the sparse match (unless a gt box overlaps no anchor)
+        self.sparse_matching_cost = data_utils._SPARSE_MATCHING_COST
+        data_utils._SPARSE_MATCHING_COST = 0
+
+    def tearDown(self):
+        data_utils._SPARSE_MATCHING_COST = self.sparse_matching_cost
+
+    def _check_match(self, foas, inds_inside, gt_boxes, sparse=True):
+        all_anchors = np.concatenate([f.field_of_anchors for f in foas])
+        dense_match = data_utils._match_anchors_to_gt_dense(
+            all_anchors[inds_inside], gt_boxes
+        )
+        sparse_match = data_utils._match_anchors_to_gt_sparse(
+            foas, all_anchors, inds_inside, gt_boxes
+        )
+        if not sparse:
+            self.assertIsNone(sparse_match)
+            return
+        self.assertIsNotNone(sparse_match)
+        argmax, max_overlap, with_max = sparse_match
+        np.testing.assert_array_equal(argmax, dense_match[0])
+        self.assertEqual(max_overlap.dtype, dense_match[1].dtype)
+        np.testing.assert_array_equal(max_overlap, dense_match[1])
+        np.testing.assert_array_equal(with_max, np.unique(dense_match[2]))
+
+    def test_fpn_anchors(self):
+        rng = np.random.RandomState(0)
+        foas = get_fpn_foas()
+        all_anchors = np.concatenate([f.field_of_anchors for f in foas])
+        for _ in range(10):
+            im_width, im_height = rng.randint(200, cfg.TRAIN.MAX_SIZE, size=2)
+            inds_inside = np.where(
+                (all_anchors[:, 0] >= 0) & (all_anchors[:, 1] >= 0) &
+                (all_anchors[:, 2] < im_width) &
+                (all_anchors[:, 3] < im_height)
+            )[0]
+            # Gt boxes are clipped to the image (as in the roidb), so that
+            # they overlap some anchor inside the image
+            gt_boxes = np.clip(
+                random_gt_boxes(rng, 30, im_width, im_height), 0,
+                [im_width - 1, im_height - 1, im_width - 1, im_height - 1]
+            ).astype(np.float32)
+            # Duplicate gt boxes tie for the same anchors
+            gt_boxes[-1] = gt_boxes[0]
+            self._check_match(foas, inds_inside, gt_boxes)
+
+    def test_single_level_anchors(self):
+        rng = np.random.RandomState(1)
+        foa = data_utils.get_field_of_anchors(
+            16, (32, 64, 128, 256, 512), (0.5, 1, 2)
+        )
+        inds_inside = np.arange(foa.field_of_anchors.shape[0])
+        gt_boxes = random_gt_boxes(rng, 20, 800, 600)
+        self._check_match([foa], inds_inside, gt_boxes)
+
+    def test_gt_box_without_overlap(self):
+        foa = data_utils.get_field_of_anchors(16, (32, ), (1, ))
+        inds_inside = np.arange(foa.field_of_anchors.shape[0])
+        max_size = foa.field_size * foa.stride
+        gt_boxes = np.array(
+            [[10, 10, 50, 50], [max_size + 100, 0, max_size + 200, 100]],
+            dtype=np.float32
+        )
+        self._check_match([foa], inds_inside, gt_boxes, sparse=False)
+        # All anchors that do not overlap the second gt box have the highest
+        # overlap with it; the dense match is used instead
+        match = data_utils.match_anchors_to_gt(
+            [foa], foa.field_of_anchors, inds_inside, gt_boxes
+        )
+        self.assertGreater(len(match[2]), len(inds_inside) // 2)
+
+    def test_inside_anchors(self):
+        foas = get_fpn_foas()
+        all_anchors = np.concatenate([f.field_of_anchors for f in foas])
+        for im_height, im_width in ((600., 800.), (800., 600.), (600., 800.)):
+            for straddle_thresh in (-1, 0, 10):
+                inside_anchors = data_utils.get_inside_anchors(
+                    foas, all_anchors, im_height, im_width, straddle_thresh
+                )
+                if straddle_thresh < 0:
+                    inds = np.arange(all_anchors.shape[0])
+                    self.assertIsNone(inside_anchors.positions)
+                else:
+                    inds = np.where(
+                        (all_anchors[:, 0] >= -straddle_thresh) &
+                        (all_anchors[:, 1] >= -straddle_thresh) &
+                        (all_anchors[:, 2] < im_width + straddle_thresh) &
+                        (all_anchors[:, 3] < im_height + straddle_thresh)
+                    )[0]
+                    np.testing.assert_array_equal(
+                        inside_anchors.positions[inds], np.arange(len(inds))
+                    )
+                    self.assertEqual(
+                        np.sum(inside_anchors.positions >= 0), len(inds)
+                    )
+                np.testing.assert_array_equal(inside_anchors.inds, inds)
+                np.testing.assert_array_equal(
+                    inside_anchors.anchors, all_anchors[inds]
+                )
+        # Cached per image size
+        inside_anchors = data_utils.get_inside_anchors(
+            foas, all_anchors, 600., 800., 0
+        )
+        self.assertIs(
+            data_utils.get_inside_anchors(foas, all_anchors, 600., 800., 0),
+            inside_anchors
+        )
+        for im_height in range(100, 300):
+            data_utils.get_inside_anchors(
+                foas, all_anchors, im_height, 800., 0
+            )
+        self.assertEqual(
+            len(data_utils._threadlocal_inside_anchors.cache),
+            data_utils._INSIDE_ANCHORS_CACHE_SIZE
+        )
+
+    def test_rpn_and_retinanet_blobs(self):
+        rng = np.random.RandomState(2)
+        foas = get_fpn_foas()
+        all_anchors = np.concatenate([f.field_of_anchors for f in foas])
+        im_height, im_width = 600., 900.
+        gt_boxes = random_gt_boxes(rng, 40, im_width, im_height)
+        gt_classes = rng.randint(1, 81, size=40)
+        sparse_anchor_matching = cfg.TRAIN.SPARSE_ANCHOR_MATCHING
+        num_classes = cfg.MODEL.NUM_CLASSES
+        cfg.MODEL.NUM_CLASSES = 81
+        try:
+            blobs = []
+            for sparse in (False, True):
+                cfg.TRAIN.SPARSE_ANCHOR_MATCHING = sparse
+                np.random.seed(3)
+                rpn_blobs = rpn_roi_data._get_rpn_blobs(
+                    im_height, im_width, foas, all_anchors, gt_boxes
+                )
+                retinanet_blobs = retinanet_roi_data._get_retinanet_blobs(
+                    foas, all_anchors, gt_boxes, gt_classes, im_width,
+                    im_height
+                )
+                blobs.append((rpn_blobs, retinanet_blobs[0]))
+        finally:
+            cfg.TRAIN.SPARSE_ANCHOR_MATCHING = sparse_anchor_matching
+            cfg.MODEL.NUM_CLASSES = num_classes
+        for dense_blobs, sparse_blobs in zip(*blobs):
+            for dense_level, sparse_level in zip(dense_blobs, sparse_blobs):
+                self.assertEqual(set(dense_level), set(sparse_level))
+                for k, v in dense_level.items():
+                    np.testing.assert_array_equal(v, sparse_level[k])
+
+
+if __name__ == '__main__':
+    unittest.main()
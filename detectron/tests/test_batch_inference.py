@@ -0,0 +1,129 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import unittest
+
+from detectron.core.config import cfg
+import detectron.core.test as test
+import detectron.ops.collect_and_distribute_fpn_rpn_proposals as collect_op
+import detectron.utils.blob as blob_utils
+
+
+class Blob(object):
+    def __init__(self, data):
+        self.data = data
+
+
+def random_proposals(rng, batch_ind, num_rois):
+    xy = rng.uniform(0, 500, size=(num_rois, 2))
+    wh = rng.uniform(1, 200, size=(num_rois, 2))
+    rois = np.hstack(
+        (np.full((num_rois, 1), batch_ind), xy, xy + wh)
+    ).astype(np.float32)
+    scores = rng.uniform(size=(num_rois, 1)).astype(np.float32)
+    return rois, scores
+
+
+class TestBatchInference(unittest.TestCase):
+    def setUp(self):
+        self.fpn_on = cfg.FPN.FPN_ON
+        self.post_nms_top_n = cfg.TEST.RPN_POST_NMS_TOP_N
+        cfg.FPN.FPN_ON = True
+
+    def tearDown(self):
+        cfg.FPN.FPN_ON = self.fpn_on
+        cfg.TEST.RPN_POST_NMS_TOP_N = self.post_nms_top_n
+
+    def test_image_blob_batch(self):
+        rng = np.random.RandomState(0)
+        ims = [
+            rng.randint(0, 256, size=(h, w, 3)).astype(np.uint8)
+            for h, w in ((480, 640), (375, 500), (640, 427))
+        ]
+        blob, im_scales, im_info = blob_utils.get_image_blob_batch(
+            ims, 600, 1000
+        )
+        self.assertEqual(blob.shape[0], 3)
+        self.assertEqual(im_info.shape, (3, 3))
+        for i, im in enumerate(ims):
+            blob_i, im_scale_i, im_info_i = blob_utils.get_image_blob(
+                im, 600, 1000
+            )
+            self.assertEqual(im_scales[i], im_scale_i)
+            np.testing.assert_array_equal(im_info[i], im_info_i[0])
+            h, w = blob_i.shape[2:]
+            np.testing.assert_array_equal(blob[i, :, :h, :w], blob_i[0])
+            self.assertTrue(np.all(blob[i, :, h:, :] == 0))
+            self.assertTrue(np.all(blob[i, :, :, w:] == 0))
+
+    def test_collect_per_image(self):
+        rng = np.random.RandomState(1)
+        cfg.TEST.RPN_POST_NMS_TOP_N = 50
+        num_lvls = cfg.FPN.RPN_MAX_LEVEL - cfg.FPN.RPN_MIN_LEVEL + 1
+        rois_per_im = []
+        for i in range(3):
+            rois_per_im.append([
+                random_proposals(rng, i, rng.randint(0, 40))
+                for _ in range(num_lvls)
+            ])
+        # Levels of a batch hold the proposals of all the images
+        roi_inputs = [
+            Blob(np.vstack([rois_per_im[i][lvl][0] for i in range(3)]))
+            for lvl in range(num_lvls)
+        ]
+        score_inputs = [
+            Blob(np.vstack([rois_per_im[i][lvl][1] for i in range(3)]))
+            for lvl in range(num_lvls)
+        ]
+        inputs = roi_inputs + score_inputs
+        rois = collect_op.collect(inputs, False)
+        for i in range(3):
+            # Same as collecting the proposals of the image alone
+            expected_rois = collect_op.collect(
+                [Blob(rois_per_im[i][lvl][0]) for lvl in range(num_lvls)] +
+                [Blob(rois_per_im[i][lvl][1]) for lvl in range(num_lvls)],
+                False
+            )
+            np.testing.assert_array_equal(rois[rois[:, 0] == i], expected_rois)
+        self.assertEqual(
+            len(rois), sum(
+                min(sum(len(r) for r, _ in rois_per_im[i]), 50)
+                for i in range(3)
+            )
+        )
+
+    def test_rois_blob_batch(self):
+        rng = np.random.RandomState(2)
+        im_rois = [rng.uniform(0, 500, size=(n, 4)) for n in (3, 0, 5)]
+        im_scales = [0.5, 1.0, 2.0]
+        rois_blob = test._get_rois_blob_batch(im_rois, im_scales)
+        self.assertEqual(rois_blob.dtype, np.float32)
+        self.assertEqual(rois_blob.shape, (8, 5))
+        np.testing.assert_array_equal(rois_blob[:, 0], [0, 0, 0, 2, 2, 2, 2, 2])
+        preds = test._split_per_image(rois_blob[:, 1:], im_rois)
+        for pred, rois, im_scale in zip(preds, im_rois, im_scales):
+            np.testing.assert_array_equal(
+                pred, test._get_rois_blob(rois, im_scale)[:, 1:]
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import unittest
+
+from detectron.core.config import cfg
+import detectron.core.test as test
+import detectron.utils.boxes as box_utils
+
+
+def box_results_with_nms_and_limit_per_class(scores, boxes):
+    """Apply NMS class by class (reference for box_results_with_nms_and_limit).
+    """
+    num_classes = cfg.MODEL.NUM_CLASSES
+    cls_boxes = [[] for _ in range(num_classes)]
+    for j in range(1, num_classes):
+        inds = np.where(scores[:, j] > cfg.TEST.SCORE_THRESH)[0]
+        scores_j = scores[inds, j]
+        boxes_j = boxes[inds, j * 4:(j + 1) * 4]
+        dets_j = np.hstack((boxes_j, scores_j[:, np.newaxis])).astype(
+            np.float32, copy=False
+        )
+        if cfg.TEST.SOFT_NMS.ENABLED:
+            nms_dets, _ = box_utils.soft_nms(
+                dets_j,
+                sigma=cfg.TEST.SOFT_NMS.SIGMA,
+                overlap_thresh=cfg.TEST.NMS,
+                score_thresh=0.0001,
+                method=cfg.TEST.SOFT_NMS.METHOD
+            )
+        else:
+            keep = box_utils.nms(dets_j, cfg.TEST.NMS)
+            nms_dets = dets_j[keep, :]
+        if cfg.TEST.BBOX_VOTE.ENABLED:
+            nms_dets = box_utils.box_voting(
+                nms_dets,
+                dets_j,
+                cfg.TEST.BBOX_VOTE.VOTE_TH,
+                scoring_method=cfg.TEST.BBOX_VOTE.SCORING_METHOD
+            )
+        cls_boxes[j] = nms_dets
+
+    if cfg.TEST.DETECTIONS_PER_IM > 0:
+        image_scores = np.hstack(
+            [cls_boxes[j][:, -1] for j in range(1, num_classes)]
+        )
+        if len(image_scores) > cfg.TEST.DETECTIONS_PER_IM:
+            image_thresh = np.sort(image_scores)[-cfg.TEST.DETECTIONS_PER_IM]
+            for j in range(1, num_classes):
+                keep = np.where(cls_boxes[j][:, -1] >= image_thresh)[0]
+                cls_boxes[j] = cls_boxes[j][keep, :]
+
+    im_results = np.vstack([cls_boxes[j] for j in range(1, num_classes)])
+    boxes = im_results[:, :-1]
+    scores = im_results[:, -1]
+    return scores, boxes, cls_boxes
+
+
+def random_detections(rng, num_rois, num_classes):
+    # Proposals clustered around a few objects, with class scores that are
+    # mostly low and quantized to give ties
+    centers = rng.uniform(100, 500, size=(10, 2))
+    xy = centers[rng.randint(0, 10, size=num_rois)][:, np.newaxis, :] + \
+        rng.normal(0, 10, size=(num_rois, num_classes, 2))
+    wh = rng.uniform(30, 60, size=(num_rois, num_classes, 2))
+    boxes = np.concatenate((xy, xy + wh), axis=2).reshape(num_rois, -1)
+    scores = rng.dirichlet(0.05 * np.ones(num_classes), size=num_rois)
+    scores = np.round(scores, 2).astype(np.float32)
+    return scores, boxes.astype(np.float32)
+
+
+class TestBoxResults(unittest.TestCase):
+    def setUp(self):
+        self.num_classes = cfg.MODEL.NUM_CLASSES
+        self.detections_per_im = cfg.TEST.DETECTIONS_PER_IM
+        self.soft_nms = cfg.TEST.SOFT_NMS.ENABLED
+        self.bbox_vote = cfg.TEST.BBOX_VOTE.ENABLED
+        cfg.MODEL.NUM_CLASSES = 221
+
+    def tearDown(self):
+        cfg.MODEL.NUM_CLASSES = self.num_classes
+        cfg.TEST.DETECTIONS_PER_IM = self.detections_per_im
+        cfg.TEST.SOFT_NMS.ENABLED = self.soft_nms
+        cfg.TEST.BBOX_VOTE.ENABLED = self.bbox_vote
+
+    def check_box_results(self, scores, boxes):
+        results = test.box_results_with_nms_and_limit(scores, boxes)
+        expected_results = box_results_with_nms_and_limit_per_class(
+            scores, boxes
+        )
+        for res, expected_res in zip(results[:2], expected_results[:2]):
+            self.assertEqual(res.dtype, expected_res.dtype)
+            np.testing.assert_array_equal(res, expected_res)
+        for j in range(1, cfg.MODEL.NUM_CLASSES):
+            self.assertEqual(results[2][j].dtype, np.float32)
+            np.testing.assert_array_equal(
+                results[2][j], expected_results[2][j]
+            )
+        return len(results[0])
+
+    def test_box_results(self):
+        rng = np.random.RandomState(0)
+        for detections_per_im, soft_nms, bbox_vote in (
+            (100, False, False), (0, False, False), (20, True, False),
+            (100, False, True)
+        ):
+            cfg.TEST.DETECTIONS_PER_IM = detections_per_im
+            cfg.TEST.SOFT_NMS.ENABLED = soft_nms
+            cfg.TEST.BBOX_VOTE.ENABLED = bbox_vote
+            scores, boxes = random_detections(rng, 1000, 221)
+            num_dets = self.check_box_results(scores, boxes)
+            if detections_per_im > 0:
+                self.assertLessEqual(num_dets, 2 * detections_per_im)
+            self.assertGreater(num_dets, 0)
+
+    def test_no_box_results(self):
+        rng = np.random.RandomState(1)
+        scores, boxes = random_detections(rng, 100, 221)
+        scores[:, 1:] = 0
+        self.assertEqual(self.check_box_results(scores, boxes), 0)
+        self.assertEqual(self.check_box_results(scores[:0], boxes[:0]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from detectron.roi_data.image_cache import ImageCache
+from detectron.roi_data.image_cache import MappedImageCache
+
+
+def random_image(height=20, width=30):
+    return np.random.randint(0, 256, size=(height, width, 3)).astype(np.uint8)
+
+
+class TestImageCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        ims = [random_image() for _ in range(3)]
+        cache = ImageCache(max_bytes=2 * ims[0].nbytes)
+        cache.put('a', ims[0])
+        cache.put('b', ims[1])
+        # Accessing 'a' makes 'b' the least recently used image
+        np.testing.assert_array_equal(cache.get('a'), ims[0])
+        cache.put('c', ims[2])
+        self.assertIsNone(cache.get('b'))
+        np.testing.assert_array_equal(cache.get('a'), ims[0])
+        np.testing.assert_array_equal(cache.get('c'), ims[2])
+        self.assertEqual(cache.nbytes, 2 * ims[0].nbytes)
+
+    def test_oversized_image_not_cached(self):
+        im = random_image()
+        cache = ImageCache(max_bytes=im.nbytes - 1)
+        cache.put('a', im)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_cached_images_are_read_only(self):
+        cache = ImageCache(max_bytes=2**20)
+        cache.put('a', random_image())
+        with self.assertRaises(ValueError):
+            cache.get('a')[0, 0, 0] = 0
+
+
+class TestMappedImageCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_get_put(self):
+        im = random_image()
+        cache = MappedImageCache(2**20, self.cache_dir)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', im)
+        np.testing.assert_array_equal(cache.get('a'), im)
+        # A second cache on the same directory (e.g., in another worker
+        # process) sees the same images
+        cache2 = MappedImageCache(2**20, self.cache_dir)
+        np.testing.assert_array_equal(cache2.get('a'), im)
+        self.assertEqual(cache2.nbytes, cache.nbytes)
+
+    def test_lru_eviction(self):
+        ims = [random_image() for _ in range(3)]
+        cache = MappedImageCache(2.5 * ims[0].nbytes, self.cache_dir)
+        cache.put('a', ims[0])
+        cache.put('b', ims[1])
+        # Make 'a' the most recently used image
+        past = time.time() - 10
+        os.utime(cache._get_path('b'), (past, past))
+        cache.get('a')
+        cache.put('c', ims[2])
+        self.assertIsNone(cache.get('b'))
+        np.testing.assert_array_equal(cache.get('a'), ims[0])
+        np.testing.assert_array_equal(cache.get('c'), ims[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cv2
+import imp
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from detectron.datasets.json_dataset import JsonDataset
+from detectron.utils.image_shards import ImageShardIndex
+from detectron.utils.image_shards import ImageShardWriter
+import detectron.datasets.dataset_catalog as dataset_catalog
+import detectron.utils.image as image_utils
+import detectron.utils.image_shards as image_shards
+
+pack_image_shards = imp.load_source(
+    'pack_image_shards',
+    os.path.join(
+        os.path.dirname(__file__), '..', '..', 'tools', 'pack_image_shards.py'
+    )
+)
+
+
+class TestImageShards(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.im_dir = os.path.join(self.data_dir, 'images')
+        os.makedirs(os.path.join(self.im_dir, 'sub'))
+        rng = np.random.RandomState(0)
+        # Encoded images of various sizes, including one in a subdirectory
+        self.im_files = []
+        for i, ext in enumerate(['.jpg', '.png', '.jpg', '.png', '.jpg']):
+            h, w = rng.randint(20, 120, size=2)
+            im = rng.randint(0, 256, size=(h, w, 3)).astype(np.uint8)
+            im_file = '{}{:04d}{}'.format('sub/' if i == 2 else '', i, ext)
+            cv2.imwrite(os.path.join(self.im_dir, im_file), im)
+            self.im_files.append(im_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def read_file(self, im_file):
+        with open(os.path.join(self.im_dir, im_file), 'rb') as f:
+            return f.read()
+
+    def check_image_ref(self, image_ref, im_file):
+        self.assertTrue(image_shards.is_image_ref(image_ref))
+        shard_file, rest = image_ref.split('@', 1)
+        offset, rest = rest.split('+', 1)
+        length, file_name = rest.split('/', 1)
+        self.assertTrue(shard_file.endswith(image_shards.SHARD_EXT))
+        self.assertTrue(os.path.isfile(shard_file))
+        self.assertEqual(file_name, im_file)
+        self.assertEqual(
+            os.path.basename(image_ref), os.path.basename(im_file)
+        )
+        data = self.read_file(im_file)
+        self.assertEqual(int(length), len(data))
+        with open(shard_file, 'rb') as f:
+            f.seek(int(offset))
+            self.assertEqual(f.read(int(length)), data)
+        self.assertEqual(
+            image_shards.read_image_data(image_ref).tobytes(), data
+        )
+        np.testing.assert_array_equal(
+            image_utils.read_image(image_ref),
+            cv2.imread(os.path.join(self.im_dir, im_file))
+        )
+
+    def test_image_shard_writer(self):
+        output_dir = os.path.join(self.data_dir, 'shards')
+        os.makedirs(output_dir)
+        sizes = [len(self.read_file(f)) for f in self.im_files]
+        # Shards hold a few images each; the largest image is larger than a
+        # shard
+        max_shard_bytes = sorted(sizes)[-2] + 1
+        writer = ImageShardWriter(output_dir, 'test', max_shard_bytes)
+        for im_file in self.im_files:
+            writer.add(im_file, self.read_file(im_file))
+        index_file = writer.close()
+        shard_files = sorted(
+            f for f in os.listdir(output_dir)
+            if f.endswith(image_shards.SHARD_EXT)
+        )
+        self.assertGreater(len(shard_files), 1)
+        for shard_file in shard_files:
+            shard_bytes = os.path.getsize(os.path.join(output_dir, shard_file))
+            self.assertTrue(
+                shard_bytes <= max_shard_bytes or shard_bytes in sizes
+            )
+
+        # The packed dataset can be moved
+        moved_dir = os.path.join(self.data_dir, 'moved')
+        shutil.move(output_dir, moved_dir)
+        index = ImageShardIndex(
+            os.path.join(moved_dir, os.path.basename(index_file))
+        )
+        for im_file in self.im_files:
+            self.assertIn(im_file, index)
+            image_ref = index.get_image_ref(im_file)
+            self.assertTrue(image_ref.startswith(moved_dir))
+            self.check_image_ref(image_ref, im_file)
+        self.assertNotIn('missing.jpg', index)
+        self.assertFalse(
+            image_shards.is_image_ref(os.path.join(self.im_dir, '0000.jpg'))
+        )
+
+    def test_pack_image_shards(self):
+        dataset_name = 'test_image_shards'
+        images = [
+            {
+                'id': len(self.im_files) - i,
+                'file_name': im_file,
+                'height': 10,
+                'width': 10
+            } for i, im_file in enumerate(self.im_files)
+        ]
+        ann_fn = os.path.join(self.data_dir, 'annotations.json')
+        with open(ann_fn, 'w') as f:
+            json.dump(
+                {
+                    'images': images,
+                    'annotations': [],
+                    'categories': [{'id': 1, 'name': 'car'}]
+                }, f
+            )
+        dataset_catalog._DATASETS[dataset_name] = {
+            dataset_catalog._IM_DIR: self.im_dir,
+            dataset_catalog._ANN_FN: ann_fn,
+        }
+        try:
+            index_file = pack_image_shards.pack_image_shards(
+                dataset_name, os.path.join(self.data_dir, 'shards'), 1
+            )
+            dataset_catalog._DATASETS[dataset_name][
+                dataset_catalog._IM_SHARDS] = index_file
+            roidb = JsonDataset(dataset_name).get_roidb(gt=True)
+        finally:
+            del dataset_catalog._DATASETS[dataset_name]
+        self.assertEqual(len(roidb), len(self.im_files))
+        for entry in roidb:
+            im_file = images[len(self.im_files) - entry['id']]['file_name']
+            self.check_image_ref(entry['image'], im_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
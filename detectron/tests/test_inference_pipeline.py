@@ -0,0 +1,127 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import contextlib
+import mock
+import numpy as np
+import threading
+import time
+import unittest
+
+from detectron.core.test_pipeline import InferencePipeline
+from detectron.utils.timer import Timer
+import detectron.core.test_pipeline as test_pipeline
+
+
+@contextlib.contextmanager
+def null_scope(gpu_id):
+    yield
+
+
+def get_batches(num_images, ims_per_batch):
+    inds = range(num_images)
+    return [
+        [(i, {'image': i}, None) for i in inds[j:j + ims_per_batch]]
+        for j in range(0, num_images, ims_per_batch)
+    ]
+
+
+class TestInferencePipeline(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+
+        def sleep(*args, **kwargs):
+            time.sleep(rng.uniform(0, 0.005))
+
+        def read_image(im_file):
+            sleep()
+            if im_file is None:
+                raise IOError('Failed to read image')
+            return np.full((2, 3, 3), im_file, dtype=np.uint8)
+
+        def run_nets(batch, ims, inputs, stage_times):
+            sleep()
+            stage_times['im_detect_bbox'] = 0.1
+            return [im[0, 0, 0] for im in ims]
+
+        def get_results(ims, outputs, stage_times):
+            sleep()
+            return [(i, None, None) for i in outputs]
+
+        self.patches = [
+            mock.patch.object(
+                test_pipeline.image_utils, 'read_image', side_effect=read_image
+            ),
+            mock.patch.object(
+                test_pipeline.test, '_get_blobs', side_effect=sleep
+            ),
+            mock.patch.object(
+                test_pipeline.blob_utils, 'get_image_blob_batch',
+                side_effect=lambda *args: (sleep(), None, None)
+            ),
+            mock.patch.object(
+                test_pipeline.c2_utils, 'NamedCudaScope',
+                side_effect=null_scope
+            ),
+            mock.patch.object(
+                InferencePipeline, '_run_nets', side_effect=run_nets
+            ),
+            mock.patch.object(
+                InferencePipeline, '_get_results', side_effect=get_results
+            )
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_results_order(self):
+        num_threads = threading.active_count()
+        for ims_per_batch in (1, 3):
+            pipeline = InferencePipeline(
+                None, num_prefetch_threads=3, num_postprocess_threads=3,
+                queue_size=2
+            )
+            timers = defaultdict(Timer)
+            batches = get_batches(50, ims_per_batch)
+            results = list(pipeline.run(iter(batches), timers))
+            self.assertEqual([i for i, _, _, _ in results], range(50))
+            for i, entry, im, im_results in results:
+                self.assertEqual(entry['image'], i)
+                self.assertEqual(im[0, 0, 0], i)
+                self.assertEqual(im_results, (i, None, None))
+            self.assertEqual(timers['im_detect_bbox'].calls, len(batches))
+            self.assertEqual(threading.active_count(), num_threads)
+
+    def test_error(self):
+        num_threads = threading.active_count()
+        batches = get_batches(20, 1)
+        batches[7] = [(7, {'image': None}, None)]
+        pipeline = InferencePipeline(None)
+        with self.assertRaises(Exception):
+            list(pipeline.run(iter(batches)))
+        self.assertEqual(threading.active_count(), num_threads)
+
+
+if __name__ == '__main__':
+    unittest.main()
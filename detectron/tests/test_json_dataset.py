@@ -0,0 +1,277 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import copy
+import cPickle as pickle
+import json
+import mock
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from detectron.datasets.json_dataset import JsonDataset
+from detectron.datasets.mapped_proposals import load_mapped_proposals
+from detectron.datasets.mapped_proposals import save_mapped_proposals
+from detectron.datasets.streaming_coco import StreamingCOCO
+from detectron.pycocotools.coco import COCO
+import detectron.datasets.dataset_catalog as dataset_catalog
+
+_KEYPOINTS = [
+    'nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear', 'left_shoulder',
+    'right_shoulder', 'left_elbow', 'right_elbow', 'left_wrist', 'right_wrist',
+    'left_hip', 'right_hip', 'left_knee', 'right_knee', 'left_ankle',
+    'right_ankle'
+]
+
+
+def random_annotation(ann_id, image, category_id, rng):
+    height, width = image['height'], image['width']
+    # Boxes may extend beyond the image or be degenerate
+    x, y = rng.uniform(-20, width), rng.uniform(-20, height)
+    w, h = rng.choice([0, 0.5, 1, 30.2, 500]), rng.choice([0, 1, 2.5, 40])
+    ann = {
+        'id': ann_id,
+        'image_id': image['id'],
+        'category_id': category_id,
+        'bbox': [x, y, w, h],
+        'area': rng.choice([0, 2.5, 100, 1000]),
+        'iscrowd': int(rng.rand() < 0.3),
+        'keypoints': [
+            int(v) for v in rng.randint(0, 40, size=3 * len(_KEYPOINTS))
+        ]
+    }
+    ann['keypoints'][2::3] = rng.randint(0, 3, size=len(_KEYPOINTS)).tolist()
+    if rng.rand() < 0.5:
+        ann['keypoints'][2::3] = [0] * len(_KEYPOINTS)
+    if ann['iscrowd']:
+        ann['segmentation'] = {'size': [height, width], 'counts': [0, 10]}
+    else:
+        # Include invalid polygons with fewer than 3 points
+        ann['segmentation'] = [
+            rng.uniform(0, 40, size=rng.choice([4, 6, 8])).tolist()
+            for _ in range(rng.randint(1, 3))
+        ]
+    if rng.rand() < 0.1:
+        ann['ignore'] = 1
+    return ann
+
+
+class TestJsonDataset(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.dataset_name = 'test_json_dataset'
+        rng = np.random.RandomState(0)
+        categories = [
+            {'id': 1, 'name': 'person', 'keypoints': _KEYPOINTS},
+            {'id': 3, 'name': 'car'},
+        ]
+        images, annotations = [], []
+        for image_id in range(1, 51):
+            image = {
+                'id': image_id,
+                'file_name': '{:04d}.jpg'.format(image_id),
+                'height': int(rng.randint(50, 100)),
+                'width': int(rng.randint(50, 100)),
+            }
+            images.append(image)
+            open(os.path.join(self.data_dir, image['file_name']), 'w').close()
+            # Some images have no annotations
+            for _ in range(rng.randint(0, 8)):
+                annotations.append(
+                    random_annotation(
+                        len(annotations) + 1, image, rng.choice([1, 3]), rng
+                    )
+                )
+        # Annotations of an image are not contiguous in the json file
+        rng.shuffle(annotations)
+        ann_fn = os.path.join(self.data_dir, 'annotations.json')
+        with open(ann_fn, 'w') as f:
+            json.dump(
+                {
+                    'images': images,
+                    'annotations': annotations,
+                    'categories': categories
+                }, f
+            )
+        dataset_catalog._DATASETS[self.dataset_name] = {
+            dataset_catalog._IM_DIR: self.data_dir,
+            dataset_catalog._ANN_FN: ann_fn,
+        }
+
+    def tearDown(self):
+        del dataset_catalog._DATASETS[self.dataset_name]
+        shutil.rmtree(self.data_dir)
+
+    def test_add_gt_annotations_bulk(self):
+        ds = JsonDataset(self.dataset_name)
+        image_ids = sorted(ds.COCO.getImgIds())
+        roidb = copy.deepcopy(ds.COCO.loadImgs(image_ids))
+        bulk_roidb = copy.deepcopy(ds.COCO.loadImgs(image_ids))
+        for entry in roidb + bulk_roidb:
+            ds._prep_roidb_entry(entry)
+        for entry in roidb:
+            ds._add_gt_annotations(entry)
+        ds._add_gt_annotations_bulk(bulk_roidb)
+
+        self.assertGreater(sum(len(e['boxes']) for e in roidb), 0)
+        self.assertGreater(sum(e['is_crowd'].sum() for e in roidb), 0)
+        for entry, bulk_entry in zip(roidb, bulk_roidb):
+            self.assertEqual(set(entry.keys()), set(bulk_entry.keys()))
+            for k, v in entry.items():
+                bulk_v = bulk_entry[k]
+                if k == 'dataset':
+                    continue
+                if k == 'gt_overlaps':
+                    self.assertEqual(v.shape, bulk_v.shape)
+                    for attr in ('data', 'indices', 'indptr'):
+                        np.testing.assert_array_equal(
+                            getattr(v, attr), getattr(bulk_v, attr)
+                        )
+                        self.assertEqual(
+                            getattr(v, attr).dtype, getattr(bulk_v, attr).dtype
+                        )
+                elif isinstance(v, np.ndarray):
+                    self.assertEqual(v.dtype, bulk_v.dtype)
+                    np.testing.assert_array_equal(v, bulk_v)
+                else:
+                    self.assertEqual(type(v), type(bulk_v))
+                    self.assertEqual(v, bulk_v)
+
+    def test_streaming_coco(self):
+        ann_fn = dataset_catalog.get_ann_fn(self.dataset_name)
+        coco = COCO(ann_fn)
+        # Use a small chunk size so that objects straddle chunk boundaries
+        streaming_coco = StreamingCOCO(ann_fn, chunk_size=64)
+        self.assertEqual(streaming_coco.getCatIds(), coco.getCatIds())
+        self.assertEqual(
+            streaming_coco.loadCats(streaming_coco.getCatIds()),
+            coco.loadCats(coco.getCatIds())
+        )
+        image_ids = sorted(coco.getImgIds())
+        self.assertEqual(sorted(streaming_coco.getImgIds()), image_ids)
+        self.assertEqual(
+            streaming_coco.loadImgs(image_ids), coco.loadImgs(image_ids)
+        )
+        # Annotations are loaded on first use
+        self.assertNotIn('anns', streaming_coco.__dict__)
+        for image_id in image_ids:
+            self.assertEqual(
+                streaming_coco.loadAnns(
+                    streaming_coco.getAnnIds(imgIds=image_id)
+                ),
+                coco.loadAnns(coco.getAnnIds(imgIds=image_id))
+            )
+        self.assertEqual(len(streaming_coco.anns), len(coco.anns))
+
+    def test_mapped_proposals(self):
+        ds = JsonDataset(self.dataset_name)
+        rng = np.random.RandomState(0)
+        boxes, scores, ids = [], [], []
+        for image_id in ds.COCO.getImgIds():
+            num_boxes = rng.randint(0, 50)
+            image_boxes = rng.uniform(-10, 110, size=(num_boxes, 4))
+            image_boxes[:, 2:] += rng.uniform(-2, 40, size=(num_boxes, 2))
+            # Include duplicate boxes
+            image_boxes[num_boxes // 2:] = image_boxes[:num_boxes // 2 + 1][
+                :num_boxes - num_boxes // 2]
+            boxes.append(image_boxes.astype(np.float32))
+            scores.append(rng.rand(num_boxes).astype(np.float32))
+            ids.append(image_id)
+        proposal_file = os.path.join(self.data_dir, 'proposals.pkl')
+        with open(proposal_file, 'wb') as f:
+            pickle.dump(
+                dict(boxes=boxes, scores=scores, ids=ids), f,
+                pickle.HIGHEST_PROTOCOL
+            )
+        mapped_proposal_file = os.path.join(self.data_dir, 'proposals')
+        save_mapped_proposals(boxes, scores, ids, mapped_proposal_file)
+
+        roidb = ds.get_roidb(
+            gt=True, proposal_file=proposal_file, proposal_limit=20,
+            crowd_filter_thresh=0.7
+        )
+        mapped_roidb = ds.get_roidb(
+            gt=True, proposal_file=mapped_proposal_file, proposal_limit=20,
+            crowd_filter_thresh=0.7
+        )
+        self.assertGreater(sum(len(e['boxes']) for e in roidb), len(roidb))
+        for entry, mapped_entry in zip(roidb, mapped_roidb):
+            for k in ('boxes', 'gt_classes', 'max_overlaps', 'max_classes',
+                      'box_to_gt_ind_map'):
+                np.testing.assert_array_equal(entry[k], mapped_entry[k])
+            np.testing.assert_array_equal(
+                entry['gt_overlaps'].toarray(),
+                mapped_entry['gt_overlaps'].toarray()
+            )
+
+    def test_save_mapped_proposals_existing_target(self):
+        rng = np.random.RandomState(1)
+        boxes = [rng.rand(n, 4).astype(np.float32) for n in (3, 0, 5)]
+        scores = [rng.rand(len(b)).astype(np.float32) for b in boxes]
+        ids = [3, 1, 2]
+        proposal_dir = os.path.join(self.data_dir, 'proposals')
+
+        def check_saved():
+            proposals = load_mapped_proposals(proposal_dir)
+            np.testing.assert_array_equal(proposals['ids'], [1, 2, 3])
+            for i, j in enumerate((1, 2, 0)):
+                np.testing.assert_array_equal(proposals['boxes'][i], boxes[j])
+            self.assertFalse(
+                any('.tmp' in f for f in os.listdir(self.data_dir))
+            )
+
+        # Mapped proposal files and partially written ones are replaced
+        save_mapped_proposals(boxes, scores, ids, proposal_dir)
+        save_mapped_proposals(boxes, scores, ids, proposal_dir + '/')
+        check_saved()
+        os.remove(os.path.join(proposal_dir, 'offsets.npy'))
+        save_mapped_proposals(boxes, scores, ids, proposal_dir)
+        check_saved()
+
+        # Other files and directories are not
+        shutil.rmtree(proposal_dir)
+        for make_target in (
+            lambda: open(proposal_dir, 'w').close(),
+            lambda: os.makedirs(os.path.join(proposal_dir, 'other')),
+        ):
+            make_target()
+            with self.assertRaises(IOError):
+                save_mapped_proposals(boxes, scores, ids, proposal_dir)
+            self.assertTrue(os.path.exists(proposal_dir))
+            self.assertFalse(
+                any('.tmp' in f for f in os.listdir(self.data_dir))
+            )
+            if os.path.isdir(proposal_dir):
+                shutil.rmtree(proposal_dir)
+            else:
+                os.remove(proposal_dir)
+
+        # A failed write leaves the existing proposal file as it was
+        save_mapped_proposals(boxes, scores, ids, proposal_dir)
+        with mock.patch.object(np, 'save', side_effect=IOError):
+            with self.assertRaises(IOError):
+                save_mapped_proposals(boxes[:1], scores[:1], [1], proposal_dir)
+        check_saved()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cv2
+import numpy as np
+import unittest
+
+from detectron.core.config import cfg
+import detectron.utils.keypoints as keypoint_utils
+
+
+def random_heatmaps(rng, num_rois, num_keypoints, size):
+    # Smooth heatmaps with one or two modes
+    y, x = np.mgrid[0:size, 0:size]
+    maps = 0.1 * rng.randn(num_rois, num_keypoints, size, size)
+    for i in range(num_rois):
+        for k in range(num_keypoints):
+            for _ in range(rng.randint(1, 3)):
+                cx, cy = rng.uniform(0, size, size=2)
+                sigma = rng.uniform(1, 4)
+                maps[i, k] += rng.uniform(5, 15) * np.exp(
+                    -((x - cx)**2 + (y - cy)**2) / (2 * sigma**2)
+                )
+    return maps.astype(np.float32)
+
+
+def random_hard_heatmaps(rng, num_rois, num_keypoints, size):
+    # Noisy, near flat and flat heatmaps, and heatmaps with several modes of
+    # the same height
+    shape = (num_rois, num_keypoints, size, size)
+    y, x = np.mgrid[0:size, 0:size]
+    multimodal = np.zeros(shape)
+    for i in range(num_rois):
+        for k in range(num_keypoints):
+            for _ in range(rng.randint(2, 5)):
+                cx, cy = rng.uniform(0, size, size=2)
+                multimodal[i, k] += 10 * np.exp(
+                    -((x - cx)**2 + (y - cy)**2) / (2 * rng.uniform(1, 4)**2)
+                )
+    maps = np.concatenate((
+        rng.randn(*shape), 1e-3 * rng.randn(*shape), np.zeros(shape),
+        multimodal
+    ))
+    return maps.astype(np.float32)
+
+
+def random_rois(rng, num_rois, min_size, max_size):
+    xy = rng.uniform(0, 500, size=(num_rois, 2))
+    wh = rng.uniform(min_size, max_size, size=(num_rois, 2))
+    return np.hstack((xy, xy + wh)).astype(np.float32)
+
+
+def heatmaps_to_keypoints_resize(maps, rois):
+    """Find keypoints in heatmaps resized to the size of their rois, with the
+    spatial softmax of the whole resized heatmaps (reference for
+    heatmaps_to_keypoints).
+    """
+    widths = np.maximum(rois[:, 2] - rois[:, 0], 1)
+    heights = np.maximum(rois[:, 3] - rois[:, 1], 1)
+    min_size = cfg.KRCNN.INFERENCE_MIN_SIZE
+    xy_preds = np.zeros((len(rois), 4, maps.shape[1]), dtype=np.float32)
+    for i in range(len(rois)):
+        roi_map_width = int(max(np.ceil(widths[i]), min_size))
+        roi_map_height = int(max(np.ceil(heights[i]), min_size))
+        roi_map = cv2.resize(
+            np.transpose(maps[i], [1, 2, 0]), (roi_map_width, roi_map_height),
+            interpolation=cv2.INTER_CUBIC
+        )
+        roi_map = np.transpose(roi_map, [2, 0, 1])
+        roi_map_probs = keypoint_utils.scores_to_probs(roi_map.copy())
+        for k in range(maps.shape[1]):
+            y_int, x_int = np.unravel_index(
+                roi_map[k].argmax(), roi_map[k].shape
+            )
+            xy_preds[i, 0, k] = (x_int + 0.5) * widths[i] / roi_map_width + \
+                rois[i, 0]
+            xy_preds[i, 1, k] = (y_int + 0.5) * heights[i] / roi_map_height + \
+                rois[i, 1]
+            xy_preds[i, 2, k] = roi_map[k, y_int, x_int]
+            xy_preds[i, 3, k] = roi_map_probs[k, y_int, x_int]
+    return xy_preds
+
+
+class TestKeypoints(unittest.TestCase):
+    def setUp(self):
+        self.num_keypoints = cfg.KRCNN.NUM_KEYPOINTS
+        self.heatmap_size = cfg.KRCNN.HEATMAP_SIZE
+        self.inference_min_size = cfg.KRCNN.INFERENCE_MIN_SIZE
+        self.fast_heatmap_decoding = cfg.KRCNN.FAST_HEATMAP_DECODING
+        self.keypoint_confidence = cfg.KRCNN.KEYPOINT_CONFIDENCE
+        cfg.KRCNN.NUM_KEYPOINTS = 17
+        cfg.KRCNN.HEATMAP_SIZE = 56
+
+    def tearDown(self):
+        cfg.KRCNN.NUM_KEYPOINTS = self.num_keypoints
+        cfg.KRCNN.HEATMAP_SIZE = self.heatmap_size
+        cfg.KRCNN.INFERENCE_MIN_SIZE = self.inference_min_size
+        cfg.KRCNN.FAST_HEATMAP_DECODING = self.fast_heatmap_decoding
+        cfg.KRCNN.KEYPOINT_CONFIDENCE = self.keypoint_confidence
+
+    def test_keypoints_to_heatmap_labels(self):
+        rng = np.random.RandomState(0)
+        rois = random_rois(rng, 50, 1, 200)
+        keypoints = np.zeros((50, 3, 17), dtype=np.float32)
+        # Keypoints in and around their rois
+        for j in range(2):
+            keypoints[:, j] = rois[:, j, np.newaxis] + (
+                rois[:, j + 2, np.newaxis] - rois[:, j, np.newaxis]
+            ) * rng.uniform(-0.2, 1.2, size=(50, 17))
+        keypoints[:, 2] = rng.randint(0, 3, size=(50, 17))
+        # Keypoints on the right and bottom boundaries of their rois
+        keypoints[:5, 0, 0] = rois[:5, 2]
+        keypoints[5:10, 1, 1] = rois[5:10, 3]
+        heatmaps, weights = keypoint_utils.keypoints_to_heatmap_labels(
+            keypoints, rois
+        )
+        self.assertEqual(heatmaps.dtype, np.float32)
+        self.assertEqual(weights.dtype, np.float32)
+        size = cfg.KRCNN.HEATMAP_SIZE
+        for i in range(50):
+            for k in range(17):
+                x, y, v = keypoints[i, :, k]
+                x = np.floor(
+                    (x - rois[i, 0]) * (size / (rois[i, 2] - rois[i, 0]))
+                )
+                y = np.floor(
+                    (y - rois[i, 1]) * (size / (rois[i, 3] - rois[i, 1]))
+                )
+                if keypoints[i, 0, k] == rois[i, 2]:
+                    x = size - 1
+                if keypoints[i, 1, k] == rois[i, 3]:
+                    y = size - 1
+                valid = v > 0 and 0 <= x < size and 0 <= y < size
+                self.assertEqual(weights[i, k], valid)
+                self.assertEqual(heatmaps[i, k], y * size + x if valid else 0)
+        self.assertGreater(weights.sum(), 0)
+
+    def check_heatmaps_to_keypoints(self, maps, rois):
+        for min_size in (0, 56):
+            cfg.KRCNN.INFERENCE_MIN_SIZE = min_size
+            expected_xy_preds = heatmaps_to_keypoints_resize(maps, rois)
+            for fast_heatmap_decoding, keypoint_confidence in (
+                (False, 'bbox'), (True, 'bbox'), (True, 'prob')
+            ):
+                cfg.KRCNN.FAST_HEATMAP_DECODING = fast_heatmap_decoding
+                cfg.KRCNN.KEYPOINT_CONFIDENCE = keypoint_confidence
+                xy_preds = keypoint_utils.heatmaps_to_keypoints(maps, rois)
+                self.assertEqual(xy_preds.dtype, np.float32)
+                # Same locations and logits
+                np.testing.assert_array_equal(
+                    xy_preds[:, :3], expected_xy_preds[:, :3]
+                )
+                if not fast_heatmap_decoding:
+                    np.testing.assert_array_equal(
+                        xy_preds[:, 3], expected_xy_preds[:, 3]
+                    )
+                elif keypoint_confidence == 'prob':
+                    np.testing.assert_allclose(
+                        xy_preds[:, 3], expected_xy_preds[:, 3], rtol=1e-5
+                    )
+                else:
+                    np.testing.assert_array_equal(xy_preds[:, 3], 0)
+
+    def test_heatmaps_to_keypoints(self):
+        rng = np.random.RandomState(1)
+        maps = random_heatmaps(rng, 30, 17, 56)
+        rois = random_rois(rng, 30, 1, 300)
+        self.check_heatmaps_to_keypoints(maps, rois)
+        for fast_heatmap_decoding in (False, True):
+            cfg.KRCNN.FAST_HEATMAP_DECODING = fast_heatmap_decoding
+            self.assertEqual(
+                keypoint_utils.heatmaps_to_keypoints(maps[:0], rois[:0]).shape,
+                (0, 4, 17)
+            )
+
+    def test_heatmaps_to_keypoints_hard(self):
+        rng = np.random.RandomState(2)
+        maps = random_hard_heatmaps(rng, 10, 17, 56)
+        # Small rois (resized heatmaps that are a sparse sampling of the
+        # heatmaps) and large ones
+        rois = np.vstack((
+            random_rois(rng, len(maps) // 2, 1, 40),
+            random_rois(rng, len(maps) - len(maps) // 2, 40, 300)
+        ))
+        self.check_heatmaps_to_keypoints(maps, rois[rng.permutation(len(rois))])
+
+
+    def test_resized_heatmaps_peaks(self):
+        rng = np.random.RandomState(3)
+        maps = np.concatenate((
+            random_heatmaps(rng, 10, 5, 56),
+            random_hard_heatmaps(rng, 3, 5, 56),
+            -1e4 + 1e-2 * random_heatmaps(rng, 2, 5, 56)
+        ))
+        # Resized heatmap sizes from 1 to 400 pixels, for resized rows of
+        # all sizes modulo 4, and the same size as the heatmaps
+        widths = rng.randint(1, 400, size=len(maps))
+        heights = rng.randint(1, 400, size=len(maps))
+        widths[:4] = [55, 56, 57, 58]
+        heights[1] = 56
+        x_int, y_int, scores = keypoint_utils._resized_heatmaps_peaks(
+            maps, widths, heights
+        )
+        for i in range(len(maps)):
+            roi_map = cv2.resize(
+                np.transpose(maps[i], [1, 2, 0]), (widths[i], heights[i]),
+                interpolation=cv2.INTER_CUBIC
+            ).reshape(heights[i], widths[i], maps.shape[1])
+            for k in range(maps.shape[1]):
+                pos = roi_map[:, :, k].argmax()
+                self.assertEqual(
+                    (y_int[i, k], x_int[i, k]),
+                    np.unravel_index(pos, roi_map.shape[:2])
+                )
+                self.assertEqual(scores[i, k], roi_map[:, :, k].flat[pos])
+
+if __name__ == '__main__':
+    unittest.main()
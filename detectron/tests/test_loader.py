@@ -30,6 +30,7 @@ from caffe2.python import workspace
 
 from detectron.core.config import assert_and_infer_cfg
 from detectron.core.config import cfg
+from detectron.roi_data.loader import _get_num_loaders_change
 from detectron.roi_data.loader import RoIDataLoader
 import detectron.utils.logging as logging_utils
 
@@ -108,6 +109,141 @@ class TestRoIDataLoader(unittest.TestCase):
         test_loader.shutdown()
         train_loader.shutdown()
 
+    @mock.patch(
+        'detectron.roi_data.loader.get_minibatch_blob_names',
+        return_value=[u'data']
+    )
+    @mock.patch.object(RoIDataLoader, 'create_threads')
+    def test_aspect_ratio_bins(self, _1, _2):
+        heights = np.random.randint(100, 1000, size=200)
+        widths = np.random.randint(100, 1000, size=200)
+        roidb = [{'height': h, 'width': w} for h, w in zip(heights, widths)]
+        bins = (0.5, 0.75, 1.0, 1.5, 2.0)
+        is_immutable = cfg.is_immutable()
+        saved_cfg = (
+            cfg.TRAIN.ASPECT_GROUPING, cfg.TRAIN.ASPECT_RATIO_BINS,
+            cfg.TRAIN.IMS_PER_BATCH
+        )
+        cfg.immutable(False)
+        cfg.TRAIN.ASPECT_GROUPING = True
+        cfg.TRAIN.ASPECT_RATIO_BINS = bins
+        cfg.TRAIN.IMS_PER_BATCH = 4
+        try:
+            loader = RoIDataLoader(roidb)
+            seen_inds = set()
+            # Minibatches of more than an epoch
+            for _ in range(100):
+                _, db_inds = loader._get_next_minibatch_inds()
+                seen_inds.update(db_inds)
+                self.assertEqual(
+                    len(np.unique(np.digitize(
+                        heights[db_inds] / widths[db_inds], bins
+                    ))), 1
+                )
+            self.assertGreater(len(seen_inds), 150)
+        finally:
+            (
+                cfg.TRAIN.ASPECT_GROUPING, cfg.TRAIN.ASPECT_RATIO_BINS,
+                cfg.TRAIN.IMS_PER_BATCH
+            ) = saved_cfg
+            cfg.immutable(is_immutable)
+
+    @mock.patch(
+        'detectron.roi_data.loader.get_minibatch_blob_names',
+        return_value=[u'data']
+    )
+    @mock.patch.object(RoIDataLoader, 'create_threads')
+    def test_loader_state(self, _1, _2):
+        roidb = [{'height': 600, 'width': 800} for _ in range(37)]
+        is_immutable = cfg.is_immutable()
+        deterministic = cfg.DATA_LOADER.DETERMINISTIC
+        cfg.immutable(False)
+        cfg.DATA_LOADER.DETERMINISTIC = True
+        try:
+            # Seeded loaders draw the same minibatch stream
+            loader = RoIDataLoader(roidb, blobs_queue_capacity=4)
+            stream = [loader._get_next_minibatch_inds() for _ in range(80)]
+            loader = RoIDataLoader(roidb, blobs_queue_capacity=4)
+            self.assertEqual(
+                [loader._get_next_minibatch_inds() for _ in range(80)], stream
+            )
+            # Minibatches reach the GPUs slightly out of order and some are
+            # discarded; the last two enqueued to each GPU are not consumed
+            num_gpus = loader._num_gpus
+            enqueued = [[] for _ in range(num_gpus)]
+            for i, seq in enumerate(
+                [1, 0, 2, 4, 3, 5, 7, 6, 8, 10, 9] + range(11, 40)
+            ):
+                if seq % 7 == 3:
+                    loader._retire_minibatch(seq)
+                else:
+                    loader._retire_minibatch(seq, gpu_id=i % num_gpus)
+                    enqueued[i % num_gpus].append(seq)
+            num_iters = min(len(seqs) for seqs in enqueued) - 2
+            consumed = set(seq for seq in range(40) if seq % 7 == 3)
+            for seqs in enqueued:
+                consumed.update(seqs[:num_iters])
+            state = loader.get_state(num_iters)
+
+            resumed_loader = RoIDataLoader(roidb, blobs_queue_capacity=4)
+            resumed_loader.set_state(state)
+            self.assertEqual(
+                [resumed_loader._get_next_minibatch_inds() for _ in range(30)],
+                [s for s in stream if s[0] not in consumed][:30]
+            )
+        finally:
+            cfg.DATA_LOADER.DETERMINISTIC = deterministic
+            cfg.immutable(is_immutable)
+
+    @mock.patch(
+        'detectron.roi_data.loader.get_minibatch_blob_names',
+        return_value=[u'data']
+    )
+    @mock.patch.object(RoIDataLoader, 'create_threads')
+    def test_enqueue_state(self, _1, _2):
+        roidb = [{'height': 600, 'width': 800} for _ in range(37)]
+        is_immutable = cfg.is_immutable()
+        num_gpus = cfg.NUM_GPUS
+        cfg.immutable(False)
+        cfg.NUM_GPUS = 1
+        try:
+            loader = RoIDataLoader(roidb, blobs_queue_capacity=4)
+            for _ in range(6):
+                seq, _ = loader._get_next_minibatch_inds()
+                loader._minibatch_queue.put((seq, {'data': np.zeros(1)}))
+            states = []
+
+            def enqueue_blobs(gpu_id, blob_names, blobs):
+                # The network consumes the minibatch before the enqueue
+                # returns
+                states.append(loader.get_state(len(states) + 1))
+                if len(states) == 5:
+                    raise Exception('Blobs queue closed')
+
+            with mock.patch.object(
+                loader, 'enqueue_blobs', side_effect=enqueue_blobs
+            ):
+                loader.enqueue_blobs_thread(0, [u'data'])
+            self.assertTrue(loader.coordinator.should_stop())
+            self.assertEqual([state['seq'] for state in states], range(1, 6))
+            # The minibatch that could not be enqueued is not consumed
+            self.assertEqual(loader.get_state(4)['seq'], 4)
+            self.assertEqual(loader.get_state(4)['skip_seqs'], [])
+        finally:
+            cfg.NUM_GPUS = num_gpus
+            cfg.immutable(is_immutable)
+
+    def test_num_loaders_change(self):
+        # Full queue
+        self.assertEqual(_get_num_loaders_change([64, 60, 63, 64], 64), -1)
+        # Draining queue
+        self.assertEqual(_get_num_loaders_change([64, 60, 55, 50], 64), 1)
+        # Nearly empty queue
+        self.assertEqual(_get_num_loaders_change([0, 2, 0, 1], 64), 1)
+        # Steady queue
+        self.assertEqual(_get_num_loaders_change([30, 34, 28, 32], 64), 0)
+        self.assertEqual(_get_num_loaders_change([50, 64, 58, 62], 64), 0)
+
 
 if __name__ == '__main__':
     workspace.GlobalInit(['caffe2', '--caffe2_log_level=0'])
@@ -0,0 +1,83 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+import time
+import unittest
+
+from detectron.core.config import cfg
+import detectron.roi_data.minibatch_stats as minibatch_stats
+
+
+class TestMinibatchStats(unittest.TestCase):
+    def setUp(self):
+        self.profile_stages = cfg.DATA_LOADER.PROFILE_STAGES
+        cfg.DATA_LOADER.PROFILE_STAGES = True
+
+    def tearDown(self):
+        cfg.DATA_LOADER.PROFILE_STAGES = self.profile_stages
+
+    def test_stage_timer(self):
+        minibatch_stats.enable()
+        minibatch_stats.pop_values()
+        minibatch_stats.add_value('pad_fraction', 0.5)
+        for _ in range(2):
+            with minibatch_stats.stage_timer('outer'):
+                time.sleep(0.01)
+                # The time of a nested stage is excluded from the outer stage
+                with minibatch_stats.stage_timer('inner'):
+                    time.sleep(0.05)
+        values = minibatch_stats.pop_values()
+        self.assertEqual(
+            set(values), set(['pad_fraction', 'time_outer', 'time_inner'])
+        )
+        self.assertEqual(values['pad_fraction'], [0.5])
+        # One total per stage
+        self.assertEqual(len(values['time_outer']), 1)
+        self.assertGreaterEqual(values['time_outer'][0], 0.02)
+        self.assertLess(values['time_outer'][0], 0.05)
+        self.assertGreaterEqual(values['time_inner'][0], 0.1)
+        self.assertEqual(minibatch_stats.pop_values(), {})
+
+    def test_disabled(self):
+        values = []
+
+        def record():
+            # Threads that are not enabled record nothing
+            minibatch_stats.add_value('pad_fraction', 0.5)
+            with minibatch_stats.stage_timer('stage'):
+                pass
+            values.append(minibatch_stats.pop_values())
+
+        thread = threading.Thread(target=record)
+        thread.start()
+        thread.join()
+        self.assertEqual(values, [{}])
+
+        minibatch_stats.enable()
+        minibatch_stats.pop_values()
+        cfg.DATA_LOADER.PROFILE_STAGES = False
+        with minibatch_stats.stage_timer('stage'):
+            pass
+        self.assertEqual(minibatch_stats.pop_values(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
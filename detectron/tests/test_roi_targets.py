@@ -0,0 +1,288 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import scipy.sparse
+import unittest
+
+from detectron.core.config import cfg
+from detectron.ops.generate_proposal_labels import GenerateProposalLabelsOp
+import detectron.roi_data.fast_rcnn as fast_rcnn_roi_data
+import detectron.roi_data.mask_rcnn as mask_rcnn_roi_data
+import detectron.roi_data.roidb_store as roidb_store
+import detectron.roi_data.rpn as rpn_roi_data
+import detectron.utils.segms as segm_utils
+
+
+def random_polygon(rng, cx, cy, radius):
+    num_points = rng.randint(5, 20)
+    angles = np.sort(rng.uniform(0, 2 * np.pi, num_points))
+    radii = radius * rng.uniform(0.5, 1.0, num_points)
+    return [
+        np.column_stack(
+            (cx + radii * np.cos(angles), cy + radii * np.sin(angles))
+        ).ravel().tolist()
+    ]
+
+
+def random_bbox_target_data(rng, num_rois, num_classes):
+    bbox_target_data = np.zeros((num_rois, 5), dtype=np.float32)
+    bbox_target_data[:, 0] = rng.randint(0, num_classes, size=num_rois)
+    # bg RoIs have zero targets
+    fg = bbox_target_data[:, 0] > 0
+    bbox_target_data[fg, 1:] = rng.randn(np.sum(fg), 4)
+    return bbox_target_data
+
+
+class Blob(object):
+    def __init__(self, data=None):
+        self.data = data
+
+    def reshape(self, shape):
+        self.data = np.zeros(shape, dtype=np.float32)
+
+    def init(self, shape, data_type):
+        self.data = np.zeros(shape, dtype=np.int32)
+
+
+def random_mask_roidb(rng, num_entries):
+    roidb = []
+    for i in range(num_entries):
+        num_masks = rng.randint(1, 6)
+        polys = [
+            random_polygon(
+                rng, rng.uniform(100, 700), rng.uniform(100, 500),
+                rng.uniform(20, 100)
+            ) for _ in range(num_masks)
+        ]
+        boxes = segm_utils.polys_to_boxes(polys).astype(np.float32)
+        gt_classes = rng.randint(1, 5, size=num_masks).astype(np.int32)
+        gt_overlaps = np.zeros((num_masks, 5), dtype=np.float32)
+        gt_overlaps[np.arange(num_masks), gt_classes] = 1.0
+        roidb.append({
+            'image': '{:04d}.jpg'.format(i),
+            'flipped': bool(i % 2),
+            'height': 600,
+            'width': 800,
+            'boxes': boxes,
+            'segms': polys,
+            'seg_areas': np.full(num_masks, 1000, dtype=np.float32),
+            'gt_classes': gt_classes,
+            'gt_overlaps': scipy.sparse.csr_matrix(gt_overlaps),
+            'is_crowd': np.zeros(num_masks, dtype=np.bool),
+            'box_to_gt_ind_map': np.arange(num_masks, dtype=np.int32),
+        })
+    return roidb
+
+
+class TestRoITargets(unittest.TestCase):
+    def setUp(self):
+        self.num_classes = cfg.MODEL.NUM_CLASSES
+        self.compact_bbox_targets = cfg.FAST_RCNN.COMPACT_BBOX_TARGETS
+        self.mask_bitmap_size = cfg.MRCNN.MASK_BITMAP_SIZE
+        self.mask_on = cfg.MODEL.MASK_ON
+        cfg.MODEL.NUM_CLASSES = 221
+
+    def tearDown(self):
+        cfg.MODEL.NUM_CLASSES = self.num_classes
+        cfg.FAST_RCNN.COMPACT_BBOX_TARGETS = self.compact_bbox_targets
+        cfg.MRCNN.MASK_BITMAP_SIZE = self.mask_bitmap_size
+        cfg.MODEL.MASK_ON = self.mask_on
+        mask_rcnn_roi_data._mask_bitmap_cache = None
+
+    def test_expand_bbox_targets(self):
+        rng = np.random.RandomState(0)
+        bbox_target_data = random_bbox_target_data(rng, 512, 221)
+        bbox_targets, bbox_inside_weights = \
+            fast_rcnn_roi_data._expand_bbox_targets(bbox_target_data)
+        expected_bbox_targets = np.zeros((512, 4 * 221), dtype=np.float32)
+        expected_bbox_inside_weights = np.zeros_like(expected_bbox_targets)
+        for i, row in enumerate(bbox_target_data):
+            cls = int(row[0])
+            if cls > 0:
+                expected_bbox_targets[i, 4 * cls:4 * cls + 4] = row[1:]
+                expected_bbox_inside_weights[i, 4 * cls:4 * cls + 4] = 1.0
+        self.assertEqual(bbox_targets.dtype, np.float32)
+        np.testing.assert_array_equal(bbox_targets, expected_bbox_targets)
+        np.testing.assert_array_equal(
+            bbox_inside_weights, expected_bbox_inside_weights
+        )
+
+    def test_compact_bbox_targets(self):
+        rng = np.random.RandomState(1)
+        bbox_target_data = random_bbox_target_data(rng, 300, 221)
+        blobs = {}
+        for compact in (False, True):
+            cfg.FAST_RCNN.COMPACT_BBOX_TARGETS = compact
+            blobs[compact] = {'bbox_targets': bbox_target_data.copy()}
+            fast_rcnn_roi_data._add_bbox_target_blobs(blobs[compact])
+        compact_blobs = blobs[True]
+        self.assertEqual(
+            set(compact_blobs),
+            set(['bbox_targets', 'bbox_target_locs', 'bbox_loss_normalizer'])
+        )
+        self.assertEqual(compact_blobs['bbox_loss_normalizer'][0], 300)
+        # The locations select the non-zero entries of the expanded targets
+        bbox_targets = np.zeros_like(blobs[False]['bbox_targets'])
+        bbox_weights = np.zeros_like(bbox_targets)
+        for loc, targets in zip(
+            compact_blobs['bbox_target_locs'], compact_blobs['bbox_targets']
+        ):
+            roi_idx, start = int(loc[0]), int(loc[1])
+            self.assertEqual(loc[2], 0)
+            self.assertEqual(loc[3], 0)
+            bbox_targets[roi_idx, start:start + 4] = targets
+            bbox_weights[roi_idx, start:start + 4] = 1.0
+        np.testing.assert_array_equal(
+            bbox_targets, blobs[False]['bbox_targets']
+        )
+        np.testing.assert_array_equal(
+            bbox_weights, blobs[False]['bbox_inside_weights']
+        )
+        np.testing.assert_array_equal(
+            bbox_weights, blobs[False]['bbox_outside_weights']
+        )
+
+    def test_expand_mask_targets(self):
+        rng = np.random.RandomState(2)
+        M = cfg.MRCNN.RESOLUTION
+        masks = rng.randint(0, 2, size=(40, M**2)).astype(np.int32)
+        mask_class_labels = rng.randint(0, 221, size=40)
+        mask_class_labels[0] = 0
+        mask_targets = \
+            mask_rcnn_roi_data._expand_to_class_specific_mask_targets(
+                masks, mask_class_labels
+            )
+        expected_mask_targets = -np.ones((40, 221 * M**2), dtype=np.int32)
+        for i, cls in enumerate(mask_class_labels):
+            if cls > 0:
+                expected_mask_targets[i, M**2 * cls:M**2 * (cls + 1)] = \
+                    masks[i]
+        self.assertEqual(mask_targets.dtype, np.int32)
+        np.testing.assert_array_equal(mask_targets, expected_mask_targets)
+
+    def test_mask_bitmaps(self):
+        rng = np.random.RandomState(3)
+        M = cfg.MRCNN.RESOLUTION
+        polys = [
+            random_polygon(
+                rng, rng.uniform(50, 550), rng.uniform(50, 400),
+                rng.choice([8, 30, 120])
+            ) for _ in range(10)
+        ]
+        boxes = segm_utils.polys_to_boxes(polys)
+        entry = {'image': 'test.jpg', 'flipped': False}
+
+        # RoIs equal to the gt boxes, sampled at the bitmap resolution, give
+        # the rasterized polygons
+        cfg.MRCNN.MASK_BITMAP_SIZE = M
+        bitmaps = mask_rcnn_roi_data._get_mask_bitmaps(entry, polys, boxes)
+        masks = mask_rcnn_roi_data._crop_and_resize_bitmaps(
+            bitmaps, boxes, np.arange(10), boxes, M
+        )
+        for i in range(10):
+            np.testing.assert_array_equal(
+                masks[i],
+                segm_utils.polys_to_mask_wrt_box(polys[i], boxes[i], M) > 0
+            )
+        # Bitmaps are cached
+        self.assertIs(
+            mask_rcnn_roi_data._get_mask_bitmaps(entry, polys, boxes), bitmaps
+        )
+
+        # RoIs around the gt boxes give close to the rasterized polygons
+        mask_rcnn_roi_data._mask_bitmap_cache = None
+        cfg.MRCNN.MASK_BITMAP_SIZE = 128
+        bitmaps = mask_rcnn_roi_data._get_mask_bitmaps(entry, polys, boxes)
+        bitmap_inds = rng.randint(0, 10, size=100)
+        sizes = np.tile(boxes[bitmap_inds, 2:4] - boxes[bitmap_inds, 0:2], 2)
+        rois = boxes[bitmap_inds] + rng.uniform(-0.2, 0.2, (100, 4)) * sizes
+        masks = mask_rcnn_roi_data._crop_and_resize_bitmaps(
+            bitmaps, boxes, bitmap_inds, rois, M
+        )
+        self.assertEqual(masks.shape, (100, M, M))
+        self.assertEqual(masks.dtype, np.int32)
+        expected_masks = np.array([
+            segm_utils.polys_to_mask_wrt_box(polys[j], rois[i], M) > 0
+            for i, j in enumerate(bitmap_inds)
+        ])
+        self.assertGreater(np.mean(masks == expected_masks), 0.97)
+
+    def run_generate_proposal_labels(self, roidb_blob, rois, im_info):
+        np.random.seed(0)
+        output_blob_names = fast_rcnn_roi_data.get_fast_rcnn_blob_names()
+        outputs = [Blob() for _ in output_blob_names]
+        GenerateProposalLabelsOp().forward(
+            [Blob(rois), Blob(roidb_blob), Blob(im_info)], outputs
+        )
+        return {k: v.data for k, v in zip(output_blob_names, outputs)}
+
+    def test_mask_bitmaps_op(self):
+        # Mask targets computed by the GenerateProposalLabels op from the
+        # 'roidb' blob of RPN minibatches, serialized or referencing the
+        # entries in the roidb store
+        rng = np.random.RandomState(4)
+        cfg.MODEL.NUM_CLASSES = 5
+        cfg.MODEL.MASK_ON = True
+        roidb = random_mask_roidb(rng, 2)
+        rpn_blobs = {k: [] for k in rpn_roi_data.get_rpn_blob_names()}
+        rpn_roi_data.add_rpn_blobs(rpn_blobs, [1.0, 1.0], roidb)
+        rois = []
+        for i, entry in enumerate(roidb):
+            boxes = entry['boxes'][rng.randint(0, len(entry['boxes']), 200)]
+            sizes = np.tile(boxes[:, 2:4] - boxes[:, 0:2], 2)
+            rois.append(np.hstack((
+                np.full((200, 1), i),
+                boxes + rng.uniform(-0.2, 0.2, (200, 4)) * sizes
+            )))
+        rois = np.vstack(rois).astype(np.float32)
+        roidb_blob, im_info = rpn_blobs['roidb'], rpn_blobs['im_info']
+
+        expected_blobs = self.run_generate_proposal_labels(
+            roidb_blob, rois, im_info
+        )
+        cfg.MRCNN.MASK_BITMAP_SIZE = 128
+        blobs = self.run_generate_proposal_labels(roidb_blob, rois, im_info)
+        handle = roidb_store.register(roidb)
+        try:
+            store_blobs = self.run_generate_proposal_labels(
+                roidb_store.get_roidb_blob(handle, [0, 1]), rois, im_info
+            )
+        finally:
+            roidb_store.unregister(handle)
+        for k in expected_blobs:
+            np.testing.assert_array_equal(blobs[k], store_blobs[k])
+            if k != 'masks_int32':
+                np.testing.assert_array_equal(blobs[k], expected_blobs[k])
+        # Bitmaps are cached per image
+        for entry in roidb:
+            self.assertIsNotNone(mask_rcnn_roi_data._mask_bitmap_cache.get(
+                (entry['image'], entry['flipped'])
+            ))
+        masks = blobs['masks_int32']
+        expected_masks = expected_blobs['masks_int32']
+        fg = expected_masks >= 0
+        self.assertGreater(np.sum(expected_masks == 1), 0)
+        np.testing.assert_array_equal(masks >= 0, fg)
+        self.assertGreater(np.mean(masks[fg] == expected_masks[fg]), 0.97)
+
+
+if __name__ == '__main__':
+    unittest.main()
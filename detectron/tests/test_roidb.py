@@ -0,0 +1,341 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import json
+import mock
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from detectron.core.config import cfg
+from detectron.datasets.columnar_roidb import ColumnarRoidb
+import detectron.datasets.dataset_catalog as dataset_catalog
+import detectron.datasets.roidb as roidb_utils
+import detectron.datasets.roidb_cache as roidb_cache
+
+_KEYPOINTS = [
+    'nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear', 'left_shoulder',
+    'right_shoulder', 'left_elbow', 'right_elbow', 'left_wrist', 'right_wrist',
+    'left_hip', 'right_hip', 'left_knee', 'right_knee', 'left_ankle',
+    'right_ankle'
+]
+
+# Fields compared between roidb entries
+_ARRAY_FIELDS = (
+    'boxes', 'gt_classes', 'is_crowd', 'box_to_gt_ind_map', 'seg_areas',
+    'max_classes', 'max_overlaps', 'bbox_targets', 'gt_keypoints'
+)
+_OTHER_FIELDS = (
+    'id', 'image', 'height', 'width', 'flipped', 'has_visible_keypoints',
+    'segms'
+)
+
+
+def write_dataset(data_dir, rng):
+    """Write a small COCO style dataset with masks and keypoints, and
+    proposals around its objects. Return the annotation and proposal files.
+    """
+    categories = [
+        {'id': 1, 'name': 'person', 'keypoints': _KEYPOINTS},
+        {'id': 3, 'name': 'car'},
+    ]
+    images, annotations = [], []
+    proposals = {'boxes': [], 'scores': [], 'ids': []}
+    for image_id in range(1, 31):
+        image = {
+            'id': image_id,
+            'file_name': '{:04d}.jpg'.format(image_id),
+            'height': int(rng.randint(60, 120)),
+            'width': int(rng.randint(60, 120)),
+        }
+        images.append(image)
+        open(os.path.join(data_dir, image['file_name']), 'w').close()
+        boxes = []
+        for _ in range(rng.randint(1, 6)):
+            x, y = rng.uniform(0, image['width'] - 20, size=2)
+            w, h = rng.uniform(5, 20, size=2)
+            boxes.append([x, y, x + w, y + h])
+            keypoints = rng.randint(0, 40, size=(len(_KEYPOINTS), 3))
+            keypoints[:, 2] = rng.randint(0, 3, size=len(_KEYPOINTS))
+            annotations.append({
+                'id': len(annotations) + 1,
+                'image_id': image_id,
+                'category_id': int(rng.choice([1, 3])),
+                'bbox': [x, y, w, h],
+                'area': w * h,
+                'iscrowd': int(rng.rand() < 0.2),
+                'segmentation': [[x, y, x + w, y, x + w, y + h, x, y + h]],
+                'keypoints': keypoints.ravel().tolist(),
+            })
+        boxes = np.repeat(boxes, 4, axis=0)
+        boxes += rng.uniform(-4, 4, size=boxes.shape)
+        proposals['boxes'].append(boxes.astype(np.float32))
+        proposals['scores'].append(rng.rand(len(boxes)).astype(np.float32))
+        proposals['ids'].append(image_id)
+    ann_fn = os.path.join(data_dir, 'annotations.json')
+    with open(ann_fn, 'w') as f:
+        json.dump(
+            {
+                'images': images,
+                'annotations': annotations,
+                'categories': categories
+            }, f
+        )
+    proposal_file = os.path.join(data_dir, 'proposals.pkl')
+    with open(proposal_file, 'wb') as f:
+        pickle.dump(proposals, f, pickle.HIGHEST_PROTOCOL)
+    return ann_fn, proposal_file
+
+
+class TestRoidb(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.dataset_name = 'test_roidb'
+        ann_fn, self.proposal_file = write_dataset(
+            self.data_dir, np.random.RandomState(0)
+        )
+        dataset_catalog._DATASETS[self.dataset_name] = {
+            dataset_catalog._IM_DIR: self.data_dir,
+            dataset_catalog._ANN_FN: ann_fn,
+        }
+        self.saved_cfg = (
+            cfg.TRAIN.USE_FLIPPED, cfg.DATA_LOADER.COLUMNAR_ROIDB,
+            cfg.DATA_LOADER.LAZY_FLIPPED_ROIDB,
+            cfg.DATA_LOADER.FLIPPED_ROIDB_CACHE_SIZE,
+            cfg.DATA_LOADER.ROIDB_CACHE_DIR
+        )
+        cfg.TRAIN.USE_FLIPPED = True
+        cfg.DATA_LOADER.COLUMNAR_ROIDB = False
+        cfg.DATA_LOADER.LAZY_FLIPPED_ROIDB = False
+        cfg.DATA_LOADER.ROIDB_CACHE_DIR = b''
+
+    def tearDown(self):
+        (
+            cfg.TRAIN.USE_FLIPPED, cfg.DATA_LOADER.COLUMNAR_ROIDB,
+            cfg.DATA_LOADER.LAZY_FLIPPED_ROIDB,
+            cfg.DATA_LOADER.FLIPPED_ROIDB_CACHE_SIZE,
+            cfg.DATA_LOADER.ROIDB_CACHE_DIR
+        ) = self.saved_cfg
+        del dataset_catalog._DATASETS[self.dataset_name]
+        shutil.rmtree(self.data_dir)
+
+    def get_roidb(self):
+        return roidb_utils.combined_roidb_for_training(
+            self.dataset_name, self.proposal_file
+        )
+
+    def assertEntriesEqual(self, entry, expected_entry):
+        for k in _ARRAY_FIELDS:
+            self.assertIn(k, entry)
+            self.assertEqual(entry[k].dtype, expected_entry[k].dtype)
+            np.testing.assert_array_equal(entry[k], expected_entry[k])
+        for k in _OTHER_FIELDS:
+            self.assertEqual(entry[k], expected_entry[k])
+        np.testing.assert_array_equal(
+            entry['gt_overlaps'].toarray(),
+            expected_entry['gt_overlaps'].toarray()
+        )
+        self.assertEqual(entry['dataset'].name, expected_entry['dataset'].name)
+
+    def test_columnar_roidb(self):
+        roidb = self.get_roidb()
+        cfg.DATA_LOADER.COLUMNAR_ROIDB = True
+        columnar_roidb = self.get_roidb()
+        self.assertIsInstance(columnar_roidb, ColumnarRoidb)
+        self.assertEqual(len(columnar_roidb), len(roidb))
+        self.assertEqual(sum(e['flipped'] for e in roidb), len(roidb) // 2)
+        self.assertGreater(sum(e['is_crowd'].sum() for e in roidb), 0)
+        # Proposals have non-zero regression targets
+        self.assertGreater(
+            sum(np.sum(e['bbox_targets'][:, 1:] != 0) for e in roidb), 0
+        )
+        for i, entry in enumerate(roidb):
+            self.assertEntriesEqual(columnar_roidb[i], entry)
+        self.assertEntriesEqual(columnar_roidb[-1], roidb[-1])
+        with self.assertRaises(IndexError):
+            columnar_roidb[len(roidb)]
+        heights, widths = columnar_roidb.get_image_sizes()
+        np.testing.assert_array_equal(heights, [e['height'] for e in roidb])
+        np.testing.assert_array_equal(widths, [e['width'] for e in roidb])
+        # Entries are read-only views of the columnar arrays
+        entry = columnar_roidb[0]
+        for k in ('boxes', 'gt_classes', 'bbox_targets', 'gt_keypoints'):
+            with self.assertRaises(ValueError):
+                entry[k][0] = 0
+        with self.assertRaises(ValueError):
+            heights[0] = 0
+
+    def test_lazy_flipped_roidb(self):
+        roidb = self.get_roidb()
+        cfg.DATA_LOADER.LAZY_FLIPPED_ROIDB = True
+        for columnar in (False, True):
+            cfg.DATA_LOADER.COLUMNAR_ROIDB = columnar
+            for cache_size in (0, 4):
+                cfg.DATA_LOADER.FLIPPED_ROIDB_CACHE_SIZE = cache_size
+                lazy_roidb = self.get_roidb()
+                self.assertIsInstance(
+                    lazy_roidb, roidb_utils.LazyFlippedRoidb
+                )
+                num_unflipped = len(lazy_roidb.unflipped_roidb)
+                self.assertEqual(len(lazy_roidb), 2 * num_unflipped)
+                self.assertEqual(len(lazy_roidb), len(roidb))
+                for i, entry in enumerate(roidb):
+                    self.assertEqual(entry['flipped'], i >= num_unflipped)
+                    self.assertEntriesEqual(lazy_roidb[i], entry)
+                self.assertEntriesEqual(lazy_roidb[-1], roidb[-1])
+                heights, widths = lazy_roidb.get_image_sizes()
+                np.testing.assert_array_equal(
+                    heights, [e['height'] for e in roidb]
+                )
+                np.testing.assert_array_equal(
+                    widths, [e['width'] for e in roidb]
+                )
+
+                # Cache hits return the cached entry and misses build it again
+                i = num_unflipped + 1
+                entry = lazy_roidb[i]
+                if cache_size > 0:
+                    self.assertIs(lazy_roidb[i], entry)
+                    # Evict the entry
+                    for j in range(cache_size):
+                        lazy_roidb[num_unflipped + 2 + j]
+                self.assertIsNot(lazy_roidb[i], entry)
+                self.assertEntriesEqual(lazy_roidb[i], roidb[i])
+                self.assertLessEqual(len(lazy_roidb._cache), cache_size)
+
+    def test_roidb_cache_file(self):
+        def get_cache_file():
+            return roidb_cache.get_cache_file(
+                (self.dataset_name, ), (self.proposal_file, )
+            )
+
+        cache_file = get_cache_file()
+        self.assertEqual(get_cache_file(), cache_file)
+        # Changing the contents of the annotation or proposal file changes
+        # the cache file
+        for file_name in (
+            dataset_catalog.get_ann_fn(self.dataset_name), self.proposal_file
+        ):
+            with open(file_name, 'rb') as f:
+                contents = f.read()
+            with open(file_name, 'wb') as f:
+                f.write(contents + b' ')
+            self.assertNotEqual(get_cache_file(), cache_file)
+            with open(file_name, 'wb') as f:
+                f.write(contents)
+            self.assertEqual(get_cache_file(), cache_file)
+        self.assertNotEqual(
+            roidb_cache.get_cache_file((self.dataset_name, ), (None, )),
+            cache_file
+        )
+        # So does changing any of the config options the roidb depends on
+        for key in roidb_cache._ROIDB_CFG_KEYS:
+            parent, k = key.split('.')
+            value = cfg[parent][k]
+            if isinstance(value, bool):
+                cfg[parent][k] = not value
+            elif isinstance(value, tuple):
+                cfg[parent][k] = tuple(2 * v for v in value)
+            else:
+                cfg[parent][k] = value + 0.5
+            try:
+                self.assertNotEqual(get_cache_file(), cache_file, key)
+            finally:
+                cfg[parent][k] = value
+            self.assertEqual(get_cache_file(), cache_file)
+
+    def test_roidb_cache(self):
+        cfg.DATA_LOADER.ROIDB_CACHE_DIR = os.path.join(self.data_dir, 'cache')
+        cache_file = roidb_cache.get_cache_file(
+            (self.dataset_name, ), (self.proposal_file, )
+        )
+        self.assertIsNone(roidb_cache.load_roidb(cache_file))
+        roidb = self.get_roidb()
+        self.assertTrue(os.path.exists(cache_file))
+        self.assertEqual(
+            os.listdir(cfg.DATA_LOADER.ROIDB_CACHE_DIR),
+            [os.path.basename(cache_file)]
+        )
+        # The cached roidb is used instead of loading the dataset
+        with mock.patch.object(
+            roidb_utils, 'JsonDataset', side_effect=AssertionError
+        ):
+            cached_roidb = self.get_roidb()
+        self.assertEqual(len(cached_roidb), len(roidb))
+        for entry, cached_entry in zip(roidb, cached_roidb):
+            self.assertEntriesEqual(cached_entry, entry)
+            self.assertIsInstance(
+                cached_entry['dataset'], roidb_cache.CachedDatasetInfo
+            )
+        self.assertEqual(
+            cached_roidb[0]['dataset'].classes, roidb[0]['dataset'].classes
+        )
+
+        # Round trip of a columnar roidb
+        cfg.DATA_LOADER.COLUMNAR_ROIDB = True
+        columnar_roidb = self.get_roidb()
+        roidb_cache.save_roidb(columnar_roidb, cache_file)
+        cached_roidb = roidb_cache.load_roidb(cache_file)
+        self.assertIsInstance(cached_roidb, ColumnarRoidb)
+        for i, entry in enumerate(roidb):
+            self.assertEntriesEqual(cached_roidb[i], entry)
+
+    def test_roidb_cache_partial_write(self):
+        cfg.DATA_LOADER.ROIDB_CACHE_DIR = os.path.join(self.data_dir, 'cache')
+        cache_file = roidb_cache.get_cache_file(
+            (self.dataset_name, ), (self.proposal_file, )
+        )
+
+        def save_object(obj, file_name):
+            with open(file_name, 'wb') as f:
+                f.write(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)[:100])
+            raise IOError('No space left on device')
+
+        # A failed write leaves no cache file
+        with mock.patch.object(
+            roidb_cache, 'save_object', side_effect=save_object
+        ):
+            with self.assertRaises(IOError):
+                self.get_roidb()
+        self.assertFalse(os.path.exists(cache_file))
+        self.assertIsNone(roidb_cache.load_roidb(cache_file))
+        # and the partially written temporary file is never loaded
+        tmp_files = os.listdir(cfg.DATA_LOADER.ROIDB_CACHE_DIR)
+        self.assertEqual(len(tmp_files), 1)
+        self.assertTrue(
+            tmp_files[0].startswith(os.path.basename(cache_file) + '.tmp')
+        )
+        roidb = self.get_roidb()
+        self.assertIsNotNone(roidb_cache.load_roidb(cache_file))
+        # A truncated cache file is rebuilt
+        with open(cache_file, 'rb') as f:
+            contents = f.read()
+        with open(cache_file, 'wb') as f:
+            f.write(contents[:len(contents) // 2])
+        self.assertIsNone(roidb_cache.load_roidb(cache_file))
+        self.assertEqual(len(self.get_roidb()), len(roidb))
+        self.assertIsNotNone(roidb_cache.load_roidb(cache_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import scipy.sparse
+import unittest
+
+from detectron.datasets import json_dataset
+import detectron.roi_data.roidb_store as roidb_store
+import detectron.utils.blob as blob_utils
+
+
+def random_roidb(rng, num_entries):
+    roidb = []
+    for i in range(num_entries):
+        num_boxes = rng.randint(1, 10)
+        xy = rng.uniform(0, 400, size=(num_boxes, 2))
+        gt_classes = rng.randint(1, 5, size=num_boxes).astype(np.int32)
+        gt_overlaps = np.zeros((num_boxes, 5), dtype=np.float32)
+        gt_overlaps[np.arange(num_boxes), gt_classes] = 1.0
+        roidb.append({
+            'image': '{:04d}.jpg'.format(i),
+            'flipped': bool(i % 2),
+            'height': 600,
+            'width': 800,
+            'boxes': np.hstack((xy, xy + 50)).astype(np.float32),
+            'segms': [[xy[j].tolist() * 3] for j in range(num_boxes)],
+            'seg_areas': np.full(num_boxes, 2500, dtype=np.float32),
+            'gt_classes': gt_classes,
+            'gt_overlaps': scipy.sparse.csr_matrix(gt_overlaps),
+            'is_crowd': np.zeros(num_boxes, dtype=np.bool),
+            'box_to_gt_ind_map': np.arange(num_boxes, dtype=np.int32),
+            'max_classes': gt_classes,
+        })
+    return roidb
+
+
+class TestRoidbStore(unittest.TestCase):
+    def test_roidb_from_blob(self):
+        rng = np.random.RandomState(0)
+        roidb = random_roidb(rng, 20)
+        handle = roidb_store.register(roidb)
+        try:
+            db_inds = np.array([3, 17, 3])
+            roidb_blob = roidb_store.get_roidb_blob(handle, db_inds)
+            self.assertEqual(roidb_blob.dtype, np.int32)
+            minimal_roidb = roidb_store.roidb_from_blob(roidb_blob)
+            # Same entries as the serialized minimal roidb
+            serialized_roidb = roidb_store.roidb_from_blob(
+                blob_utils.serialize(
+                    roidb_store.get_minimal_roidb([roidb[i] for i in db_inds])
+                )
+            )
+            self.assertEqual(len(minimal_roidb), 3)
+            for entry, serialized_entry, i in zip(
+                minimal_roidb, serialized_roidb, db_inds
+            ):
+                self.assertEqual(set(entry), set(serialized_entry))
+                self.assertNotIn('max_classes', entry)
+                for k, v in entry.items():
+                    self.assertIs(v, roidb[i][k])
+                    if k == 'gt_overlaps':
+                        v = v.toarray()
+                        serialized_entry[k] = serialized_entry[k].toarray()
+                    np.testing.assert_array_equal(v, serialized_entry[k])
+            # Labeling the proposals leaves the registered roidb untouched
+            boxes = roidb[3]['boxes'].copy()
+            rois = np.hstack((
+                rng.randint(0, 3, size=(30, 1)),
+                rng.uniform(0, 400, size=(30, 4))
+            )).astype(np.float32)
+            json_dataset.add_proposals(
+                minimal_roidb, rois, np.ones(3), crowd_thresh=0
+            )
+            self.assertGreater(len(minimal_roidb[0]['boxes']), len(boxes))
+            np.testing.assert_array_equal(roidb[3]['boxes'], boxes)
+            self.assertNotIn('max_overlaps', roidb[3])
+        finally:
+            roidb_store.unregister(handle)
+
+
+if __name__ == '__main__':
+    unittest.main()
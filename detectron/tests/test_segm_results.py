@@ -0,0 +1,140 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cv2
+import numpy as np
+import pycocotools.mask as mask_util
+import unittest
+
+from detectron.core.config import cfg
+import detectron.core.test as test
+import detectron.utils.boxes as box_utils
+import detectron.utils.segms as segm_utils
+
+
+def segm_results_full_image(cls_boxes, masks, ref_boxes, im_h, im_w):
+    """Paste each mask into a full image before encoding it (reference for
+    segm_results).
+    """
+    num_classes = cfg.MODEL.NUM_CLASSES
+    cls_segms = [[] for _ in range(num_classes)]
+    mask_ind = 0
+    M = cfg.MRCNN.RESOLUTION
+    scale = (M + 2.0) / M
+    ref_boxes = box_utils.expand_boxes(ref_boxes, scale)
+    ref_boxes = ref_boxes.astype(np.int32)
+    padded_mask = np.zeros((M + 2, M + 2), dtype=np.float32)
+    for j in range(1, num_classes):
+        segms = []
+        for _ in range(cls_boxes[j].shape[0]):
+            if cfg.MRCNN.CLS_SPECIFIC_MASK:
+                padded_mask[1:-1, 1:-1] = masks[mask_ind, j, :, :]
+            else:
+                padded_mask[1:-1, 1:-1] = masks[mask_ind, 0, :, :]
+            ref_box = ref_boxes[mask_ind, :]
+            w = np.maximum(ref_box[2] - ref_box[0] + 1, 1)
+            h = np.maximum(ref_box[3] - ref_box[1] + 1, 1)
+            mask = cv2.resize(padded_mask, (w, h))
+            mask = np.array(mask > cfg.MRCNN.THRESH_BINARIZE, dtype=np.uint8)
+            im_mask = np.zeros((im_h, im_w), dtype=np.uint8)
+            x_0 = max(ref_box[0], 0)
+            x_1 = min(ref_box[2] + 1, im_w)
+            y_0 = max(ref_box[1], 0)
+            y_1 = min(ref_box[3] + 1, im_h)
+            im_mask[y_0:y_1, x_0:x_1] = mask[
+                (y_0 - ref_box[1]):(y_1 - ref_box[1]),
+                (x_0 - ref_box[0]):(x_1 - ref_box[0])
+            ]
+            segms.append(
+                mask_util.encode(
+                    np.array(im_mask[:, :, np.newaxis], order='F')
+                )[0]
+            )
+            mask_ind += 1
+        cls_segms[j] = segms
+    return cls_segms
+
+
+def encode_full_image(crop, x0, y0, height, width):
+    im_mask = np.zeros((height, width), dtype=np.uint8)
+    im_mask[y0:y0 + crop.shape[0], x0:x0 + crop.shape[1]] = crop
+    return mask_util.encode(np.array(im_mask[:, :, np.newaxis], order='F'))[0]
+
+
+class TestSegmResults(unittest.TestCase):
+    def setUp(self):
+        self.num_classes = cfg.MODEL.NUM_CLASSES
+        self.cls_specific_mask = cfg.MRCNN.CLS_SPECIFIC_MASK
+        cfg.MODEL.NUM_CLASSES = 5
+
+    def tearDown(self):
+        cfg.MODEL.NUM_CLASSES = self.num_classes
+        cfg.MRCNN.CLS_SPECIFIC_MASK = self.cls_specific_mask
+
+    def test_mask_crop_to_rle(self):
+        rng = np.random.RandomState(0)
+        for _ in range(500):
+            height, width = rng.randint(1, 30, size=2)
+            x0, y0 = rng.randint(0, width), rng.randint(0, height)
+            crop_h = rng.randint(1, height - y0 + 1)
+            crop_w = rng.randint(1, width - x0 + 1)
+            # Empty, full (runs that continue across columns) and random crops
+            p = rng.choice([0., 0.5, 1.])
+            crop = (rng.uniform(size=(crop_h, crop_w)) < p).astype(np.uint8)
+            self.assertEqual(
+                segm_utils.mask_crop_to_rle(crop, x0, y0, height, width),
+                encode_full_image(crop, x0, y0, height, width)
+            )
+        crop = np.ones((3, 2), dtype=np.uint8)
+        self.assertEqual(
+            segm_utils.mask_crop_to_rle(crop, 2, 1, 4, 4),
+            encode_full_image(crop, 2, 1, 4, 4)
+        )
+        self.assertEqual(
+            segm_utils.mask_crop_to_rle(np.zeros((0, 0)), 4, 4, 4, 4),
+            encode_full_image(np.zeros((0, 0)), 4, 4, 4, 4)
+        )
+
+    def test_segm_results(self):
+        rng = np.random.RandomState(1)
+        im_h, im_w = 120, 160
+        M = cfg.MRCNN.RESOLUTION
+        num_dets = [0, 30, 1, 12]
+        cls_boxes = [[]] + [np.zeros((n, 5), np.float32) for n in num_dets]
+        # Boxes of a few sizes, some of them crossing the image borders
+        wh = rng.choice([12, 20, 45], size=(sum(num_dets), 2))
+        xy = rng.uniform(-10, [im_w - 10, im_h - 10], size=(sum(num_dets), 2))
+        ref_boxes = np.hstack((xy, xy + wh)).astype(np.float32)
+        masks = rng.uniform(
+            size=(sum(num_dets), cfg.MODEL.NUM_CLASSES, M, M)
+        ).astype(np.float32)
+        for cls_specific_mask in (True, False):
+            cfg.MRCNN.CLS_SPECIFIC_MASK = cls_specific_mask
+            cls_segms = test.segm_results(
+                cls_boxes, masks, ref_boxes, im_h, im_w
+            )
+            expected_cls_segms = segm_results_full_image(
+                cls_boxes, masks, ref_boxes, im_h, im_w
+            )
+            self.assertEqual(cls_segms, expected_cls_segms)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import unittest
+
+from detectron.core.config import cfg
+from detectron.utils.shared_memory import SharedBlobsBuffer
+import detectron.utils.blob as blob_utils
+
+
+class TestSharedMemory(unittest.TestCase):
+    def setUp(self):
+        self.fpn_on = cfg.FPN.FPN_ON
+
+    def tearDown(self):
+        cfg.FPN.FPN_ON = self.fpn_on
+
+    def test_write_in_place(self):
+        rng = np.random.RandomState(0)
+        buffer = SharedBlobsBuffer(1024**2)
+        arrays = [
+            rng.uniform(size=(3, 40, 50)).astype(np.float32),
+            rng.randint(0, 10, size=(7, 2)).astype(np.int32),
+            np.zeros((0, 4), dtype=np.float32),
+        ]
+        for _ in range(2):
+            # Arrays built in the buffer are not copied by write
+            in_place = buffer.empty(arrays[0].shape, np.float32)
+            in_place[...] = arrays[0]
+            layout = buffer.write([arrays[1], in_place, arrays[2]])
+            self.assertEqual(layout[1][2], 0)
+            read_arrays = buffer.read(layout)
+            for array, expected in zip(read_arrays, arrays[1:2] + arrays[:1]):
+                np.testing.assert_array_equal(array, expected)
+            self.assertEqual(read_arrays[2].shape, (0, 4))
+        # Copies of arrays of the buffer are not built in place
+        buffer.empty(arrays[0].shape, np.float32)
+        layout = buffer.write([arrays[1], in_place[:, :, 1:]])
+        np.testing.assert_array_equal(
+            buffer.read(layout)[1], arrays[0][:, :, 1:]
+        )
+        # Allocations are discarded by clear and fail when the buffer is full
+        self.assertIsNotNone(buffer.empty((1024, 256), np.float32))
+        self.assertIsNone(buffer.empty((1, ), np.uint8))
+        buffer.clear()
+        self.assertIsNotNone(buffer.empty((1, ), np.uint8))
+
+    def test_im_list_to_blob_alloc(self):
+        rng = np.random.RandomState(1)
+        buffer = SharedBlobsBuffer(1024**2)
+        for fpn_on in (False, True):
+            cfg.FPN.FPN_ON = fpn_on
+            ims = [
+                rng.uniform(-100, 100, size=(h, w, 3)).astype(np.float32)
+                for h, w in ((60, 80), (75, 50))
+            ]
+            # The blob is built in the (dirty) buffer
+            buffer.empty((1024**2 // 4, ), np.float32)[...] = np.nan
+            buffer.clear()
+            blob = blob_utils.im_list_to_blob(ims, alloc=buffer.empty)
+            np.testing.assert_array_equal(
+                blob, blob_utils.im_list_to_blob(ims)
+            )
+            layout = buffer.write([blob])
+            np.testing.assert_array_equal(
+                buffer.read(layout)[0], blob_utils.im_list_to_blob(ims)
+            )
+            # Falls back to allocating the blob normally
+            np.testing.assert_array_equal(
+                blob_utils.im_list_to_blob(ims, alloc=lambda *_: None),
+                blob_utils.im_list_to_blob(ims)
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
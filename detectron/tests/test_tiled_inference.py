@@ -0,0 +1,141 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import mock
+import numpy as np
+import unittest
+
+from detectron.core.config import cfg
+import detectron.core.test as test
+
+
+class TestTiledInference(unittest.TestCase):
+    def setUp(self):
+        self.saved_cfg = (
+            cfg.MODEL.NUM_CLASSES, cfg.MODEL.FASTER_RCNN, cfg.TEST.TILING.SIZE,
+            cfg.TEST.TILING.OVERLAP, cfg.TEST.TILING.IMS_PER_BATCH,
+            cfg.TEST.DETECTIONS_PER_IM
+        )
+        cfg.MODEL.NUM_CLASSES = 3
+        cfg.MODEL.FASTER_RCNN = True
+
+    def tearDown(self):
+        (
+            cfg.MODEL.NUM_CLASSES, cfg.MODEL.FASTER_RCNN, cfg.TEST.TILING.SIZE,
+            cfg.TEST.TILING.OVERLAP, cfg.TEST.TILING.IMS_PER_BATCH,
+            cfg.TEST.DETECTIONS_PER_IM
+        ) = self.saved_cfg
+
+    def test_tiles(self):
+        for im_shape in ((2048, 2048), (300, 2000), (1000, 1000), (90, 50)):
+            tiles = test._get_tiles(im_shape, 1000, 200)
+            covered = np.zeros(im_shape, dtype=np.int32)
+            in_cores = np.zeros(im_shape, dtype=np.int32)
+            for (x1, y1, x2, y2), core in zip(
+                tiles, test._get_tile_cores(tiles, im_shape)
+            ):
+                self.assertEqual(
+                    (y2 - y1, x2 - x1), tuple(min(s, 1000) for s in im_shape)
+                )
+                covered[y1:y2, x1:x2] += 1
+                # Cores are at least half the overlap away from inner edges
+                self.assertTrue(x1 == 0 or core[0] >= x1 + 100)
+                self.assertTrue(y1 == 0 or core[1] >= y1 + 100)
+                self.assertTrue(x2 == im_shape[1] or core[2] <= x2 - 100)
+                self.assertTrue(y2 == im_shape[0] or core[3] <= y2 - 100)
+                in_cores[
+                    int(np.ceil(core[1])):int(np.ceil(core[3])),
+                    int(np.ceil(core[0])):int(np.ceil(core[2]))
+                ] += 1
+            self.assertTrue(np.all(covered > 0))
+            # The cores of the tiles partition the image
+            self.assertTrue(np.all(in_cores == 1))
+            # Neighbouring tiles overlap by at least the tile overlap
+            xs = sorted(set(x1 for x1, _, _, _ in tiles))
+            self.assertTrue(np.all(np.diff(xs) <= 800))
+        self.assertEqual(len(test._get_tiles((2048, 2048), 1000, 200)), 9)
+        self.assertEqual(test._get_tiles((90, 50), 1000, 200), [(0, 0, 50, 90)])
+
+    def test_detect_bbox_tiled(self):
+        cfg.TEST.TILING.SIZE = 400
+        cfg.TEST.TILING.OVERLAP = 100
+        cfg.TEST.TILING.IMS_PER_BATCH = 3
+        cfg.TEST.DETECTIONS_PER_IM = 0
+        rng = np.random.RandomState(0)
+        im_h, im_w = 1000, 1200
+        # Small objects all over the image, including on the tile seams (one
+        # in each cell of a grid, so that they do not overlap)
+        cells = np.dstack(np.mgrid[:im_w - 80:80, :im_h - 80:80])
+        cells = cells.reshape(-1, 2)
+        xy = cells + rng.uniform(0, 20, size=cells.shape)
+        objects = np.hstack((xy, xy + rng.uniform(10, 60, size=cells.shape)))
+        objects = np.round(objects).astype(np.float32)
+        classes = rng.randint(1, 3, size=len(objects))
+        # Each pixel holds its coordinates so that the detector can find the
+        # position of the tiles
+        im = np.dstack(np.mgrid[:im_h, :im_w]).astype(np.int32)
+
+        def im_detect_bbox_batch(model, ims, target_scale, target_max_size):
+            self.assertLessEqual(len(ims), 3)
+            scores = []
+            boxes = []
+            for tile_im in ims:
+                h, w = tile_im.shape[:2]
+                self.assertEqual((target_scale, target_max_size), (400, 400))
+                y1, x1 = tile_im[0, 0]
+                # Detect the parts of the objects in the tile, in tile
+                # coordinates; objects cut by the tile borders get lower scores
+                tile_objects = objects - [x1, y1, x1, y1]
+                clipped = np.hstack((
+                    np.maximum(tile_objects[:, :2], 0),
+                    np.minimum(tile_objects[:, 2:], [w - 1, h - 1])
+                ))
+                inds = np.where(np.all(clipped[:, :2] < clipped[:, 2:], 1))[0]
+                inside = np.all(clipped[inds] == tile_objects[inds], axis=1)
+                scores_t = np.zeros((len(inds), 3), dtype=np.float32)
+                scores_t[np.arange(len(inds)), classes[inds]] = np.where(
+                    inside, 0.9, 0.5
+                )
+                scores.append(scores_t)
+                boxes.append(np.tile(clipped[inds], (1, 3)))
+            return scores, boxes, [1.0] * len(ims)
+
+        with mock.patch.object(
+            test, 'im_detect_bbox_batch', side_effect=im_detect_bbox_batch
+        ) as patched:
+            scores, boxes, im_scale = test.im_detect_bbox_tiled(None, im)
+        self.assertEqual(patched.call_count, 4)
+        self.assertEqual(im_scale, 1.0)
+        _, _, cls_boxes = test.box_results_with_nms_and_limit(scores, boxes)
+        # Every object is detected once in image coordinates, with its full
+        # box (no truncated boxes from the tile seams)
+        for j in range(1, 3):
+            dets = cls_boxes[j]
+            expected_dets = objects[classes == j]
+            self.assertEqual(len(dets), len(expected_dets))
+            self.assertTrue(np.all(dets[:, 4] == np.float32(0.9)))
+            np.testing.assert_array_equal(
+                dets[np.lexsort(dets[:, :4].T), :4],
+                expected_dets[np.lexsort(expected_dets.T)]
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -64,7 +64,37 @@ def get_image_blob(im, target_scale, target_max_size):
     return blob, im_scale, im_info.astype(np.float32)
 
 
-def im_list_to_blob(ims):
+def get_image_blob_batch(ims, target_scale, target_max_size):
+    """Convert a list of images into a single network input.
+
+    Arguments:
+        ims (list): color images in BGR order
+
+    Returns:
+        blob (ndarray): a data blob holding the images
+        im_scales (list): image scale (target size) / (original size) of each
+            image
+        im_info (ndarray): one row per image holding the height and width that
+            get_image_blob would give for the image alone (instead of the
+            height and width of the blob), so that the proposals of an image
+            are clipped the same way whichever images it is batched with
+    """
+    processed_ims = []
+    im_scales = []
+    im_info = []
+    for im in ims:
+        processed_im, im_scale = prep_im_for_blob(
+            im, cfg.PIXEL_MEANS, target_scale, target_max_size
+        )
+        height, width = _get_padded_shape(processed_im.shape)
+        processed_ims.append(processed_im)
+        im_scales.append(im_scale)
+        im_info.append((height, width, im_scale))
+    blob = im_list_to_blob(processed_ims)
+    return blob, im_scales, np.array(im_info, dtype=np.float32)
+
+
+def im_list_to_blob(ims, alloc=None):
     """Convert a list of images into a network input. Assumes images were
     prepared using prep_im_for_blob or equivalent: i.e.
       - BGR channel order
@@ -72,18 +102,28 @@ def im_list_to_blob(ims):
       - resized to the desired input size
       - float32 numpy ndarray format
     Output is a 4D HCHW tensor of the images concatenated along axis 0 with
-    shape.
+    shape. If given, alloc(shape, dtype) returns an uninitialized array (e.g.,
+    in shared memory) in which the blob is built, or None to allocate it
+    normally.
     """
     if not isinstance(ims, list):
         ims = [ims]
     max_shape = np.array([im.shape for im in ims]).max(axis=0)
-    # Pad the image so they can be divisible by a stride
-    if cfg.FPN.FPN_ON:
-        stride = float(cfg.FPN.COARSEST_STRIDE)
-        max_shape[0] = int(np.ceil(max_shape[0] / stride) * stride)
-        max_shape[1] = int(np.ceil(max_shape[1] / stride) * stride)
+    max_shape[0], max_shape[1] = _get_padded_shape(max_shape)
 
     num_images = len(ims)
+    blob = None
+    if alloc is not None:
+        blob = alloc((num_images, 3, max_shape[0], max_shape[1]), np.float32)
+    if blob is not None:
+        # Copy the images directly in (batch elem, channel, height, width)
+        # order and zero the padding
+        for i in range(num_images):
+            im = ims[i]
+            blob[i, :, :im.shape[0], :im.shape[1]] = im.transpose(2, 0, 1)
+            blob[i, :, im.shape[0]:, :] = 0
+            blob[i, :, :im.shape[0], im.shape[1]:] = 0
+        return blob
     blob = np.zeros(
         (num_images, max_shape[0], max_shape[1], 3), dtype=np.float32
     )
@@ -97,6 +137,19 @@ def im_list_to_blob(ims):
     return blob
 
 
+def _get_padded_shape(shape):
+    """Return the height and width of an image of the given shape once padded
+    so that they are divisible by the coarsest stride of FPN models.
+    """
+    height, width = shape[0], shape[1]
+    # Pad the image so they can be divisible by a stride
+    if cfg.FPN.FPN_ON:
+        stride = float(cfg.FPN.COARSEST_STRIDE)
+        height = int(np.ceil(height / stride) * stride)
+        width = int(np.ceil(width / stride) * stride)
+    return height, width
+
+
 def prep_im_for_blob(im, pixel_means, target_size, max_size):
     """Prepare an image for use as a network input blob. Specially:
       - Subtract per-channel pixel mean
@@ -107,13 +160,7 @@ def prep_im_for_blob(im, pixel_means, target_size, max_size):
     """
     im = im.astype(np.float32, copy=False)
     im -= pixel_means
-    im_shape = im.shape
-    im_size_min = np.min(im_shape[0:2])
-    im_size_max = np.max(im_shape[0:2])
-    im_scale = float(target_size) / float(im_size_min)
-    # Prevent the biggest axis from being more than max_size
-    if np.round(im_scale * im_size_max) > max_size:
-        im_scale = float(max_size) / float(im_size_max)
+    im_scale = get_target_scale(im.shape, target_size, max_size)
     im = cv2.resize(
         im,
         None,
@@ -125,6 +172,20 @@ def prep_im_for_blob(im, pixel_means, target_size, max_size):
     return im, im_scale
 
 
+def get_target_scale(im_shape, target_size, max_size):
+    """Return the scale factor that resizes an image of shape im_shape so that
+    its shortest side is target_size, unless that makes its longest side larger
+    than max_size.
+    """
+    im_size_min = np.min(im_shape[0:2])
+    im_size_max = np.max(im_shape[0:2])
+    im_scale = float(target_size) / float(im_size_min)
+    # Prevent the biggest axis from being more than max_size
+    if np.round(im_scale * im_size_max) > max_size:
+        im_scale = float(max_size) / float(im_size_max)
+    return im_scale
+
+
 def zeros(shape, int32=False):
     """Return a blob of all zeros of the given shape with the correct float or
     int data type.
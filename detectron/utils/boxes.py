@@ -318,6 +318,20 @@ def nms(dets, thresh):
     return cython_nms.nms(dets, thresh)
 
 
+def nms_per_class(dets, starts, thresh):
+    """Apply nms independently to the detections of each class with a single
+    call. The detections are grouped by class and `starts` holds the index of
+    the first detection of each class. Returns the indices of the kept
+    detections in increasing order (i.e., the indices kept by nms for each
+    class, offset by the start of the class).
+    """
+    if dets.shape[0] == 0:
+        return np.zeros(0, dtype=np.int)
+    return cython_nms.nms_per_class(
+        dets, np.asarray(starts, dtype=np.int), np.float32(thresh)
+    )
+
+
 def soft_nms(
     dets, sigma=0.5, overlap_thresh=0.3, score_thresh=0.001, method='linear'
 ):
@@ -86,6 +86,82 @@ def nms(np.ndarray[np.float32_t, ndim=2] dets, np.float32_t thresh):
 
     return np.where(suppressed == 0)[0]
 
+@cython.boundscheck(False)
+@cython.cdivision(True)
+@cython.wraparound(False)
+def nms_per_class(
+    np.ndarray[np.float32_t, ndim=2] dets,
+    np.ndarray[np.int_t, ndim=1] starts,
+    np.float32_t thresh
+):
+    """Apply nms to the detections of each class. The detections are grouped
+    by class and starts holds the index of the first detection of each class.
+    """
+    cdef np.ndarray[np.float32_t, ndim=1] x1 = dets[:, 0]
+    cdef np.ndarray[np.float32_t, ndim=1] y1 = dets[:, 1]
+    cdef np.ndarray[np.float32_t, ndim=1] x2 = dets[:, 2]
+    cdef np.ndarray[np.float32_t, ndim=1] y2 = dets[:, 3]
+    cdef np.ndarray[np.float32_t, ndim=1] scores = dets[:, 4]
+
+    cdef np.ndarray[np.float32_t, ndim=1] areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+
+    cdef int ndets = dets.shape[0]
+    cdef int nclasses = starts.shape[0]
+    cdef np.ndarray[np.int_t, ndim=1] ends = np.append(starts[1:], ndets)
+    cdef np.ndarray[np.int_t, ndim=1] order = np.empty((ndets), dtype=np.int)
+    cdef np.ndarray[np.int_t, ndim=1] suppressed = \
+            np.zeros((ndets), dtype=np.int)
+
+    # class index and range of the detections of the class
+    cdef int c, start, end
+    # nominal indices
+    cdef int _i, _j
+    # sorted indices
+    cdef int i, j
+    # temp variables for box i's (the box currently under consideration)
+    cdef np.float32_t ix1, iy1, ix2, iy2, iarea
+    # variables for computing overlap with box j (lower scoring box)
+    cdef np.float32_t xx1, yy1, xx2, yy2
+    cdef np.float32_t w, h
+    cdef np.float32_t inter, ovr
+
+    # Sort the detections of each class like nms sorts the detections it is
+    # given, so that ties are broken the same way
+    for c in range(nclasses):
+        start = starts[c]
+        end = ends[c]
+        order[start:end] = start + scores[start:end].argsort()[::-1]
+
+    with nogil:
+      for c in range(nclasses):
+          start = starts[c]
+          end = ends[c]
+          for _i in range(start, end):
+              i = order[_i]
+              if suppressed[i] == 1:
+                  continue
+              ix1 = x1[i]
+              iy1 = y1[i]
+              ix2 = x2[i]
+              iy2 = y2[i]
+              iarea = areas[i]
+              for _j in range(_i + 1, end):
+                  j = order[_j]
+                  if suppressed[j] == 1:
+                      continue
+                  xx1 = max(ix1, x1[j])
+                  yy1 = max(iy1, y1[j])
+                  xx2 = min(ix2, x2[j])
+                  yy2 = min(iy2, y2[j])
+                  w = max(0.0, xx2 - xx1 + 1)
+                  h = max(0.0, yy2 - yy1 + 1)
+                  inter = w * h
+                  ovr = inter / (iarea + areas[j] - inter)
+                  if ovr >= thresh:
+                      suppressed[j] = 1
+
+    return np.where(suppressed == 0)[0]
+
 # ----------------------------------------------------------
 # Soft-NMS: Improving Object Detection With One Line of Code
 # Copyright (c) University of Maryland, College Park
@@ -23,6 +23,22 @@ from __future__ import unicode_literals
 import cv2
 import numpy as np
 
+import detectron.utils.image_shards as image_shards
+
+
+def read_image(im_file):
+    """Read an image as a uint8 BGR array from an image file or an image
+    reference into a packed image shard (see detectron/utils/image_shards.py).
+    """
+    if image_shards.is_image_ref(im_file):
+        im = cv2.imdecode(
+            image_shards.read_image_data(im_file), cv2.IMREAD_COLOR
+        )
+    else:
+        im = cv2.imread(im_file)
+    assert im is not None, 'Failed to read image \'{}\''.format(im_file)
+    return im
+
 
 def aspect_ratio_rel(im, aspect_ratio):
     """Performs width-relative aspect ratio transformation."""
@@ -0,0 +1,162 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Packed image shard format.
+
+Reading many small image files (especially from network storage) is slow. A
+dataset's images can instead be packed (see tools/pack_image_shards.py) into a
+few large shard files that hold the encoded image files back to back, plus an
+index file that maps each image file name to its shard, offset and length.
+
+Images inside a shard are referred to by an image reference of the form:
+
+    <shard file>@<offset>+<length>/<image file name>
+
+which is used in place of the image path in the roidb 'image' field. The
+basename of an image reference is the basename of the original image file, so
+code that derives names from image paths is unaffected. Shards are memory
+mapped, so reading an image does not open a file and images are read by
+slicing the mapped shard.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import mmap
+import numpy as np
+import os
+import re
+import threading
+
+from detectron.utils.io import save_object
+
+SHARD_EXT = '.shard'
+
+_IMAGE_REF_RE = re.compile(
+    r'^(?P<shard>.+?' + re.escape(SHARD_EXT) +
+    r')@(?P<offset>\d+)\+(?P<length>\d+)/(?P<file_name>.+)$'
+)
+
+# Memory-mapped shards of this process, keyed by shard file
+_shard_maps = {}
+_shard_maps_lock = threading.Lock()
+
+
+class ImageShardWriter(object):
+    """Packs encoded image files into shards of (at most) max_shard_bytes,
+    unless a single image is larger. The shards and the index are written to
+    output_dir, with file names starting with name.
+    """
+
+    def __init__(self, output_dir, name, max_shard_bytes=2**30):
+        self.output_dir = output_dir
+        self.name = name
+        self.max_shard_bytes = max_shard_bytes
+        self._shards = []
+        self._images = {}
+        self._f = None
+        self._shard_bytes = 0
+
+    def add(self, file_name, data):
+        """Append the encoded image data for image file_name."""
+        if self._f is None or (
+            self._shard_bytes > 0 and
+            self._shard_bytes + len(data) > self.max_shard_bytes
+        ):
+            self._open_next_shard()
+        self._images[file_name] = (
+            len(self._shards) - 1, self._shard_bytes, len(data)
+        )
+        self._f.write(data)
+        self._shard_bytes += len(data)
+
+    def close(self):
+        """Finish the last shard and write the index. Returns the path of the
+        index file.
+        """
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        index_file = os.path.join(self.output_dir, self.name + '.index.pkl')
+        # Shards are stored relative to the index so that the packed dataset
+        # can be moved
+        save_object(dict(shards=self._shards, images=self._images), index_file)
+        return index_file
+
+    def _open_next_shard(self):
+        if self._f is not None:
+            self._f.close()
+        shard_file = '{}_{:05d}{}'.format(
+            self.name, len(self._shards), SHARD_EXT
+        )
+        self._shards.append(shard_file)
+        self._f = open(os.path.join(self.output_dir, shard_file), 'wb')
+        self._shard_bytes = 0
+
+
+class ImageShardIndex(object):
+    """Index of a packed image dataset, which creates the image references of
+    the packed images.
+    """
+
+    def __init__(self, index_file):
+        with open(index_file, 'rb') as f:
+            index = pickle.load(f)
+        index_dir = os.path.dirname(os.path.abspath(index_file))
+        self._shards = [os.path.join(index_dir, s) for s in index['shards']]
+        self._images = index['images']
+
+    def __contains__(self, file_name):
+        return file_name in self._images
+
+    def get_image_ref(self, file_name):
+        """Return the image reference for image file_name."""
+        shard_id, offset, length = self._images[file_name]
+        return '{}@{}+{}/{}'.format(
+            self._shards[shard_id], offset, length, file_name
+        )
+
+
+def is_image_ref(path):
+    """Check whether path is an image reference into a shard."""
+    return _IMAGE_REF_RE.match(path) is not None
+
+
+def read_image_data(image_ref):
+    """Return the encoded image data of an image reference as a uint8 array
+    (a view into the memory-mapped shard).
+    """
+    m = _IMAGE_REF_RE.match(image_ref)
+    assert m is not None, 'Invalid image reference \'{}\''.format(image_ref)
+    shard_map = _get_shard_map(m.group('shard'))
+    return np.frombuffer(
+        shard_map,
+        dtype=np.uint8,
+        count=int(m.group('length')),
+        offset=int(m.group('offset'))
+    )
+
+
+def _get_shard_map(shard_file):
+    with _shard_maps_lock:
+        if shard_file not in _shard_maps:
+            with open(shard_file, 'rb') as f:
+                _shard_maps[shard_file] = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        return _shard_maps[shard_file]
@@ -24,7 +24,6 @@ import cv2
 import numpy as np
 
 from detectron.core.config import cfg
-import detectron.utils.blob as blob_utils
 
 
 def get_keypoints():
@@ -100,6 +99,21 @@ def flip_heatmaps(heatmaps):
     return heatmaps_flipped
 
 
+# Parameter of the bicubic kernel of cv2.resize with INTER_CUBIC
+_CUBIC_A = -0.75
+# A 1D bicubic interpolated value is a weighted sum of 4 input values, with
+# weights summing to 1, non negative weights for the 2 inner values and non
+# positive weights for the 2 outer values that sum to at least
+# -_CUBIC_OVERSHOOT (at the middle of the inner values)
+_CUBIC_OVERSHOOT = -_CUBIC_A / 4
+# Slack on the bounds of the interpolated values for the float32 rounding
+# errors, relative to the largest absolute value of each heatmap
+_CUBIC_BOUND_SLACK = 1e-4
+# Resize the whole heatmaps of a roi when more than this fraction of its
+# resized heatmaps remains to be evaluated after pruning (e.g., flat heatmaps)
+_MAX_EVALUATED_FRACTION = 0.25
+
+
 def heatmaps_to_keypoints(maps, rois):
     """Extract predicted keypoint locations from heatmaps. Output has shape
     (#rois, 4, #keypoints) with the 4 rows corresponding to (x, y, logit, prob)
@@ -110,53 +124,293 @@ def heatmaps_to_keypoints(maps, rois):
     # consistency with keypoints_to_heatmap_labels by using the conversion from
     # Heckbert 1990: c = d + 0.5, where d is a discrete coordinate and c is a
     # continuous coordinate.
-    offset_x = rois[:, 0]
-    offset_y = rois[:, 1]
+    offset_x = rois[:, 0, np.newaxis]
+    offset_y = rois[:, 1, np.newaxis]
 
     widths = rois[:, 2] - rois[:, 0]
     heights = rois[:, 3] - rois[:, 1]
     widths = np.maximum(widths, 1)
     heights = np.maximum(heights, 1)
-    widths_ceil = np.ceil(widths)
-    heights_ceil = np.ceil(heights)
-
-    # NCHW to NHWC for use with OpenCV
-    maps = np.transpose(maps, [0, 2, 3, 1])
+    roi_map_widths = np.ceil(widths).astype(np.int64)
+    roi_map_heights = np.ceil(heights).astype(np.int64)
     min_size = cfg.KRCNN.INFERENCE_MIN_SIZE
+    if min_size > 0:
+        roi_map_widths = np.maximum(roi_map_widths, min_size)
+        roi_map_heights = np.maximum(roi_map_heights, min_size)
+    width_corrections = widths / roi_map_widths
+    height_corrections = heights / roi_map_heights
+
+    if cfg.KRCNN.FAST_HEATMAP_DECODING:
+        x_int, y_int, scores = _resized_heatmaps_peaks(
+            maps, roi_map_widths, roi_map_heights)
+        probs = np.zeros_like(scores)
+        if cfg.KRCNN.KEYPOINT_CONFIDENCE == 'prob':
+            # The spatial softmax at the maximum, 1 / sum(exp(map - max)),
+            # needs the whole resized heatmaps
+            for i in range(len(rois)):
+                roi_map = _resize_heatmaps(
+                    maps[i], roi_map_widths[i], roi_map_heights[i])
+                for k, channel in enumerate(cv2.split(roi_map)):
+                    probs[i, k] = 1. / cv2.exp(channel - scores[i, k]).sum()
+    else:
+        peaks = [
+            _roi_map_peaks(_resize_heatmaps(
+                maps[i], roi_map_widths[i], roi_map_heights[i]))
+            for i in range(len(rois))
+        ]
+        x_int, y_int, scores, probs = np.array(peaks).reshape(
+            (len(rois), cfg.KRCNN.NUM_KEYPOINTS, 4)).transpose([2, 0, 1])
+
     xy_preds = np.zeros(
         (len(rois), 4, cfg.KRCNN.NUM_KEYPOINTS), dtype=np.float32)
-    for i in range(len(rois)):
-        if min_size > 0:
-            roi_map_width = int(np.maximum(widths_ceil[i], min_size))
-            roi_map_height = int(np.maximum(heights_ceil[i], min_size))
-        else:
-            roi_map_width = widths_ceil[i]
-            roi_map_height = heights_ceil[i]
-        width_correction = widths[i] / roi_map_width
-        height_correction = heights[i] / roi_map_height
-        roi_map = cv2.resize(
-            maps[i], (roi_map_width, roi_map_height),
-            interpolation=cv2.INTER_CUBIC)
-        # Bring back to CHW
-        roi_map = np.transpose(roi_map, [2, 0, 1])
-        roi_map_probs = scores_to_probs(roi_map.copy())
-        w = roi_map.shape[2]
-        for k in range(cfg.KRCNN.NUM_KEYPOINTS):
-            pos = roi_map[k, :, :].argmax()
-            x_int = pos % w
-            y_int = (pos - x_int) // w
-            assert (roi_map_probs[k, y_int, x_int] ==
-                    roi_map_probs[k, :, :].max())
-            x = (x_int + 0.5) * width_correction
-            y = (y_int + 0.5) * height_correction
-            xy_preds[i, 0, k] = x + offset_x[i]
-            xy_preds[i, 1, k] = y + offset_y[i]
-            xy_preds[i, 2, k] = roi_map[k, y_int, x_int]
-            xy_preds[i, 3, k] = roi_map_probs[k, y_int, x_int]
-
+    xy_preds[:, 0] = (x_int + 0.5) * width_corrections[:, np.newaxis] + \
+        offset_x
+    xy_preds[:, 1] = (y_int + 0.5) * height_corrections[:, np.newaxis] + \
+        offset_y
+    xy_preds[:, 2] = scores
+    xy_preds[:, 3] = probs
     return xy_preds
 
 
+def _resize_heatmaps(heatmaps, width, height):
+    """Resize CxHxW heatmaps to width x height, as an HxWxC array."""
+    # NCHW to NHWC for use with OpenCV
+    return cv2.resize(
+        np.transpose(heatmaps, [1, 2, 0]), (int(width), int(height)),
+        interpolation=cv2.INTER_CUBIC)
+
+
+def _roi_map_peaks(roi_map):
+    """Return the (x, y, score, prob) of the maximum of each keypoint in a
+    HxWx#keypoints heatmap resized to its roi, prob being the spatial softmax
+    of the heatmap at its maximum.
+    """
+    # Bring back to CHW
+    roi_map = np.transpose(roi_map, [2, 0, 1])
+    roi_map_probs = scores_to_probs(roi_map.copy())
+    w = roi_map.shape[2]
+    peaks = []
+    for k in range(cfg.KRCNN.NUM_KEYPOINTS):
+        pos = roi_map[k, :, :].argmax()
+        x_int = pos % w
+        y_int = (pos - x_int) // w
+        assert (roi_map_probs[k, y_int, x_int] ==
+                roi_map_probs[k, :, :].max())
+        peaks.append((
+            x_int, y_int, roi_map[k, y_int, x_int],
+            roi_map_probs[k, y_int, x_int]
+        ))
+    return peaks
+
+
+def _resized_heatmaps_peaks(maps, widths, heights):
+    """Return the x, y and score (each #rois x #keypoints) of the maximum of
+    each of the #rois x #keypoints x H x W heatmaps resized to widths[i] x
+    heights[i] with cv2.resize (INTER_CUBIC), the first one in row-major order
+    in case of ties, without resizing the whole heatmaps.
+
+    The resized heatmaps are bicubic interpolations: each resized pixel falls
+    in a cell between the heatmap pixels and only depends on a 4x4 window of
+    the heatmap around the cell, which bounds its value. The resized pixels are
+    only evaluated in the cells with the highest bound and then in the cells
+    whose bound reaches the highest value found, with the same arithmetic as
+    cv2.resize, so the result is identical to an argmax of the resized
+    heatmaps.
+    """
+    num_rois, num_keypoints, map_height, map_width = maps.shape
+    if num_rois == 0:
+        return (
+            np.zeros((0, num_keypoints), dtype=np.int64),
+            np.zeros((0, num_keypoints), dtype=np.int64),
+            np.zeros((0, num_keypoints), dtype=np.float32))
+    x_coeffs = _cubic_resize_coeffs(map_width, widths)
+    y_coeffs = _cubic_resize_coeffs(map_height, heights)
+    x_starts, x_counts = _cell_ranges(x_coeffs[0], widths, map_width)
+    y_starts, y_counts = _cell_ranges(y_coeffs[0], heights, map_height)
+
+    # Upper bounds of the resized heatmaps in each cell. Cell j lies between
+    # the heatmap pixels j and j + 1 (from -1 to H - 1 or W - 1) and depends
+    # on the pixels j - 1 to j + 2, with the border pixels replicated
+    padded_maps = np.pad(maps, ((0, 0), (0, 0), (2, 2), (2, 2)), 'edge')
+    bounds = _cubic_interpolation_bounds(
+        padded_maps, padded_maps, 3, map_width)
+    bounds, _ = _cubic_interpolation_bounds(
+        bounds[0], bounds[1], 2, map_height)
+    bounds += _CUBIC_BOUND_SLACK * np.abs(maps).max(axis=(2, 3))[
+        :, :, np.newaxis, np.newaxis]
+    # Cells without resized pixels (when downsizing) are left out
+    has_pixels = np.logical_and(
+        (y_counts > 0)[:, np.newaxis, :, np.newaxis],
+        (x_counts > 0)[:, np.newaxis, np.newaxis, :])
+    bounds = np.where(has_pixels, bounds, np.float32(-np.inf))
+
+    # Lower bounds of the maximum from the cells with the highest bound
+    flat_bounds = bounds.reshape(num_rois, num_keypoints, -1)
+    top_cells = np.unravel_index(
+        flat_bounds.argmax(axis=2).ravel(), bounds.shape[2:])
+    roi_inds, keypoint_inds = np.divmod(
+        np.arange(num_rois * num_keypoints), num_keypoints)
+    cells = (x_coeffs, y_coeffs, x_starts, x_counts, y_starts, y_counts)
+    _, _, lower_bounds = _resized_heatmaps_cells_peaks(
+        maps, widths, heights, cells, roi_inds, keypoint_inds, top_cells[0],
+        top_cells[1])
+    lower_bounds = lower_bounds.reshape(num_rois, num_keypoints)
+
+    # All the cells that can hold the maximum
+    candidates = bounds >= lower_bounds[:, :, np.newaxis, np.newaxis]
+    roi_inds, keypoint_inds, y_cells, x_cells = np.nonzero(candidates)
+    num_pixels = np.bincount(
+        roi_inds,
+        weights=y_counts[roi_inds, y_cells] * x_counts[roi_inds, x_cells],
+        minlength=num_rois)
+    resize_rois = num_pixels > _MAX_EVALUATED_FRACTION * num_keypoints * \
+        widths * heights
+    keep = ~resize_rois[roi_inds]
+    x_int, y_int, scores = _resized_heatmaps_cells_peaks(
+        maps, widths, heights, cells, roi_inds[keep], keypoint_inds[keep],
+        y_cells[keep], x_cells[keep])
+
+    peaks = np.zeros((3, num_rois, num_keypoints), dtype=np.float32)
+    peak_inds = np.unique(roi_inds[keep] * num_keypoints + keypoint_inds[keep])
+    peaks[0].flat[peak_inds] = x_int
+    peaks[1].flat[peak_inds] = y_int
+    peaks[2].flat[peak_inds] = scores
+    for i in np.where(resize_rois)[0]:
+        roi_map = _resize_heatmaps(maps[i], widths[i], heights[i])
+        for k, channel in enumerate(cv2.split(roi_map)):
+            pos = channel.argmax()
+            peaks[1, i, k], peaks[0, i, k] = divmod(pos, channel.shape[1])
+            peaks[2, i, k] = channel.flat[pos]
+    x_int, y_int, scores = peaks
+    return x_int.astype(np.int64), y_int.astype(np.int64), scores
+
+
+def _cubic_interpolation_bounds(upper, lower, axis, size):
+    """Return upper and lower bounds of the 1D bicubic interpolation along axis
+    in each of the size + 1 cells of values between lower and upper (padded
+    with 2 values on each side along axis).
+    """
+    def window(values, j):
+        inds = [slice(None)] * values.ndim
+        inds[axis] = slice(j, j + size + 1)
+        return values[tuple(inds)]
+
+    inner_max = np.maximum(window(upper, 1), window(upper, 2))
+    inner_min = np.minimum(window(lower, 1), window(lower, 2))
+    outer_max = np.maximum(window(upper, 0), window(upper, 3))
+    outer_min = np.minimum(window(lower, 0), window(lower, 3))
+    return (
+        inner_max + _CUBIC_OVERSHOOT * np.maximum(inner_max - outer_min, 0),
+        inner_min - _CUBIC_OVERSHOOT * np.maximum(outer_max - inner_min, 0))
+
+
+def _cubic_resize_coeffs(in_size, out_sizes):
+    """Pixel mapping of cv2.resize with INTER_CUBIC from in_size pixels to each
+    of out_sizes pixels, concatenated over out_sizes: the cell of each output
+    pixel (the input pixel on its left, from -1 to in_size - 1), its 4 input
+    pixels and their weights, computed in float32 as cv2.resize does.
+    """
+    starts = np.cumsum(out_sizes) - out_sizes
+    inds = np.repeat(np.arange(len(out_sizes)), out_sizes)
+    pos = np.arange(out_sizes.sum()) - starts[inds]
+    scales = 1. / (out_sizes / float(in_size))
+    f = ((pos + 0.5) * scales[inds] - 0.5).astype(np.float32)
+    cells = np.floor(f).astype(np.int64)
+    t = f - cells.astype(np.float32)
+    a = np.float32(_CUBIC_A)
+    one = np.float32(1)
+    w0 = ((a * (t + one) - 5 * a) * (t + one) + 8 * a) * (t + one) - 4 * a
+    w1 = ((a + 2) * t - (a + 3)) * t * t + one
+    w2 = ((a + 2) * (one - t) - (a + 3)) * (one - t) * (one - t) + one
+    w3 = one - w0 - w1 - w2
+    pixels = np.clip(cells[:, np.newaxis] + np.arange(-1, 3), 0, in_size - 1)
+    return cells, pixels, np.stack((w0, w1, w2, w3), axis=1)
+
+
+def _cell_ranges(cells, out_sizes, in_size):
+    """Return the index of the first output pixel (in the concatenated output
+    pixels of _cubic_resize_coeffs) and the number of output pixels in each
+    cell, as #out_sizes x (in_size + 1) arrays.
+    """
+    inds = np.repeat(np.arange(len(out_sizes)), out_sizes)
+    # Sorted, as the cells are increasing for each output size
+    keys = inds * (in_size + 1) + cells + 1
+    all_keys = np.arange(len(out_sizes) * (in_size + 1))
+    starts = np.searchsorted(keys, all_keys)
+    counts = np.searchsorted(keys, all_keys, side='right') - starts
+    shape = (len(out_sizes), in_size + 1)
+    return starts.reshape(shape), counts.reshape(shape)
+
+
+def _resized_heatmaps_cells_peaks(
+    maps, widths, heights, cells, roi_inds, keypoint_inds, y_cells, x_cells
+):
+    """Evaluate the resized heatmaps of _resized_heatmaps_peaks in the given
+    cells (from the cell mappings and ranges of the x and y axes) of the given
+    rois and keypoints, sorted by roi and keypoint. Return the x, y and score
+    of the first maximum of each (roi, keypoint), in the same order.
+    """
+    if len(roi_inds) == 0:
+        return (
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.float32))
+    num_keypoints = maps.shape[1]
+    x_coeffs, y_coeffs, x_starts, x_counts, y_starts, y_counts = cells
+    # Resized pixels of the cells
+    y_counts = y_counts[roi_inds, y_cells]
+    x_counts = x_counts[roi_inds, x_cells]
+    y_offsets = np.arange(y_counts.max())[np.newaxis, :, np.newaxis]
+    x_offsets = np.arange(x_counts.max())[np.newaxis, np.newaxis, :]
+    valid = np.logical_and(
+        y_offsets < y_counts[:, np.newaxis, np.newaxis],
+        x_offsets < x_counts[:, np.newaxis, np.newaxis])
+    cell_inds, y_offsets, x_offsets = np.nonzero(valid)
+    roi_inds = roi_inds[cell_inds]
+    keypoint_inds = keypoint_inds[cell_inds]
+    y_inds = y_starts[roi_inds, y_cells[cell_inds]] + y_offsets
+    x_inds = x_starts[roi_inds, x_cells[cell_inds]] + x_offsets
+    _, y_pixels, y_weights = [c[y_inds] for c in y_coeffs]
+    _, x_pixels, x_weights = [c[x_inds] for c in x_coeffs]
+
+    # cv2.resize first interpolates the rows, summing the 4 products in order
+    window = maps[
+        roi_inds[:, np.newaxis, np.newaxis],
+        keypoint_inds[:, np.newaxis, np.newaxis],
+        y_pixels[:, :, np.newaxis], x_pixels[:, np.newaxis, :]]
+    rows = window[:, :, 0] * x_weights[:, np.newaxis, 0]
+    for j in range(1, 4):
+        rows = rows + window[:, :, j] * x_weights[:, np.newaxis, j]
+    # It then interpolates the columns with SIMD instructions that sum the 4
+    # products in reverse order, except for the last (W * C) % 4 values of
+    # each resized row of W pixels with C channels (the keypoints), whose
+    # products are summed in order
+    reverse_sums = rows[:, 3] * y_weights[:, 3]
+    for j in range(2, -1, -1):
+        reverse_sums = rows[:, j] * y_weights[:, j] + reverse_sums
+    sums = rows[:, 0] * y_weights[:, 0]
+    for j in range(1, 4):
+        sums = sums + rows[:, j] * y_weights[:, j]
+    x_int = x_inds - (np.cumsum(widths) - widths)[roi_inds]
+    y_int = y_inds - (np.cumsum(heights) - heights)[roi_inds]
+    row_sizes = widths[roi_inds] * num_keypoints
+    in_order = x_int * num_keypoints + keypoint_inds >= row_sizes // 4 * 4
+    values = np.where(in_order, sums, reverse_sums)
+
+    # First maximum of each (roi, keypoint) in row-major order, the pixels
+    # being sorted by roi and keypoint
+    peak_inds = roi_inds * num_keypoints + keypoint_inds
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(peak_inds)) + 1))
+    max_values = np.maximum.reduceat(values, starts)
+    is_max = values == np.repeat(max_values, np.diff(np.append(
+        starts, len(values))))
+    widths = widths[roi_inds]
+    pos = np.minimum.reduceat(
+        np.where(is_max, y_int * widths + x_int, np.iinfo(np.int64).max),
+        starts)
+    y_int, x_int = np.divmod(pos, widths[starts])
+    return x_int, y_int, max_values
+
+
 def keypoints_to_heatmap_labels(keypoints, rois):
     """Encode keypoint location in the target heatmap for use in
     SoftmaxWithLoss.
@@ -168,45 +422,35 @@ def keypoints_to_heatmap_labels(keypoints, rois):
     # where d is a discrete coordinate and c is a continuous coordinate.
     assert keypoints.shape[2] == cfg.KRCNN.NUM_KEYPOINTS
 
-    shape = (len(rois), cfg.KRCNN.NUM_KEYPOINTS)
-    heatmaps = blob_utils.zeros(shape)
-    weights = blob_utils.zeros(shape)
-
-    offset_x = rois[:, 0]
-    offset_y = rois[:, 1]
-    scale_x = cfg.KRCNN.HEATMAP_SIZE / (rois[:, 2] - rois[:, 0])
-    scale_y = cfg.KRCNN.HEATMAP_SIZE / (rois[:, 3] - rois[:, 1])
-
-    for kp in range(keypoints.shape[2]):
-        vis = keypoints[:, 2, kp] > 0
-        x = keypoints[:, 0, kp].astype(np.float32)
-        y = keypoints[:, 1, kp].astype(np.float32)
-        # Since we use floor below, if a keypoint is exactly on the roi's right
-        # or bottom boundary, we shift it in by eps (conceptually) to keep it in
-        # the ground truth heatmap.
-        x_boundary_inds = np.where(x == rois[:, 2])[0]
-        y_boundary_inds = np.where(y == rois[:, 3])[0]
-        x = (x - offset_x) * scale_x
-        x = np.floor(x)
-        if len(x_boundary_inds) > 0:
-            x[x_boundary_inds] = cfg.KRCNN.HEATMAP_SIZE - 1
-
-        y = (y - offset_y) * scale_y
-        y = np.floor(y)
-        if len(y_boundary_inds) > 0:
-            y[y_boundary_inds] = cfg.KRCNN.HEATMAP_SIZE - 1
-
-        valid_loc = np.logical_and(
-            np.logical_and(x >= 0, y >= 0),
-            np.logical_and(
-                x < cfg.KRCNN.HEATMAP_SIZE, y < cfg.KRCNN.HEATMAP_SIZE))
-
-        valid = np.logical_and(valid_loc, vis)
-        valid = valid.astype(np.int32)
-
-        lin_ind = y * cfg.KRCNN.HEATMAP_SIZE + x
-        heatmaps[:, kp] = lin_ind * valid
-        weights[:, kp] = valid
+    offset_x = rois[:, 0, np.newaxis]
+    offset_y = rois[:, 1, np.newaxis]
+    scale_x = cfg.KRCNN.HEATMAP_SIZE / (rois[:, 2] - rois[:, 0])[:, np.newaxis]
+    scale_y = cfg.KRCNN.HEATMAP_SIZE / (rois[:, 3] - rois[:, 1])[:, np.newaxis]
+
+    # Keypoints of shape (#rois, #keypoints)
+    vis = keypoints[:, 2, :] > 0
+    x = keypoints[:, 0, :].astype(np.float32)
+    y = keypoints[:, 1, :].astype(np.float32)
+    # Since we use floor below, if a keypoint is exactly on the roi's right or
+    # bottom boundary, we shift it in by eps (conceptually) to keep it in the
+    # ground truth heatmap.
+    x_boundary = x == rois[:, 2, np.newaxis]
+    y_boundary = y == rois[:, 3, np.newaxis]
+    x = np.floor((x - offset_x) * scale_x)
+    x[x_boundary] = cfg.KRCNN.HEATMAP_SIZE - 1
+    y = np.floor((y - offset_y) * scale_y)
+    y[y_boundary] = cfg.KRCNN.HEATMAP_SIZE - 1
+
+    valid_loc = np.logical_and(
+        np.logical_and(x >= 0, y >= 0),
+        np.logical_and(x < cfg.KRCNN.HEATMAP_SIZE, y < cfg.KRCNN.HEATMAP_SIZE))
+
+    valid = np.logical_and(valid_loc, vis)
+    valid = valid.astype(np.int32)
+
+    lin_ind = y * cfg.KRCNN.HEATMAP_SIZE + x
+    heatmaps = (lin_ind * valid).astype(np.float32)
+    weights = valid.astype(np.float32)
 
     return heatmaps, weights
 
@@ -59,6 +59,9 @@ class SmoothedValue(object):
     def GetAverageValue(self):
         return np.mean(self.deque)
 
+    def GetPercentileValue(self, q):
+        return np.percentile(self.deque, q)
+
     def GetGlobalAverageValue(self):
         return self.total / self.count
 
@@ -0,0 +1,149 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Shared memory buffers for passing numpy blobs between processes."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import ctypes
+import multiprocessing
+import numpy as np
+
+# Arrays are placed at offsets that are a multiple of this many bytes
+_ALIGNMENT = 64
+
+
+class SharedBlobsBuffer(object):
+    """A fixed capacity block of shared memory that holds a list of numpy
+    arrays. The buffer must be created before the processes that use it are
+    forked. Only the (small) layout returned by write() needs to be sent to
+    the reading process.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self._raw = multiprocessing.RawArray(ctypes.c_uint8, self.capacity)
+        self._data = np.frombuffer(self._raw, dtype=np.uint8)
+        # End of the arrays allocated in the buffer since the last write()
+        self._allocated = 0
+
+    def empty(self, shape, dtype):
+        """Allocate an array in the buffer so that it can be built in place
+        and then passed to write() without being copied. Returns None if the
+        array does not fit.
+        """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if self._allocated + nbytes > self.capacity:
+            return None
+        array = self._view(dtype, shape, self._allocated)
+        self._allocated += _aligned(nbytes)
+        return array
+
+    def write(self, arrays):
+        """Copy the arrays into the buffer, except those allocated with
+        empty(). Returns the layout needed to read them back, or None if the
+        arrays do not fit.
+        """
+        layout = []
+        allocated = offset = self._allocated
+        self._allocated = 0
+        for array in arrays:
+            allocated_offset = self._get_allocated_offset(array, allocated)
+            if allocated_offset is not None:
+                layout.append((array.dtype.str, array.shape, allocated_offset))
+                continue
+            nbytes = array.nbytes
+            if offset + nbytes > self.capacity:
+                return None
+            self._view(array.dtype, array.shape, offset)[...] = array
+            layout.append((array.dtype.str, array.shape, offset))
+            offset += _aligned(nbytes)
+        return layout
+
+    def clear(self):
+        """Discard the arrays allocated with empty() since the last write()."""
+        self._allocated = 0
+
+    def read(self, layout, copy=True):
+        """Return the arrays described by layout. If copy is False the arrays
+        are views of the shared memory and are only valid until the next
+        write().
+        """
+        arrays = []
+        for dtype, shape, offset in layout:
+            array = self._view(np.dtype(dtype), shape, offset)
+            arrays.append(array.copy() if copy else array)
+        return arrays
+
+    def _get_allocated_offset(self, array, allocated):
+        """Return the offset of an array allocated with empty(), or None if
+        the array is not a contiguous array of the first allocated bytes of
+        the buffer.
+        """
+        if not array.flags.c_contiguous or array.base is None:
+            return None
+        offset = (
+            array.__array_interface__['data'][0] -
+            self._data.__array_interface__['data'][0]
+        )
+        if offset < 0 or offset + array.nbytes > allocated:
+            return None
+        return offset
+
+    def _view(self, dtype, shape, offset):
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        return self._data[offset:offset + nbytes].view(dtype).reshape(shape)
+
+
+class SharedBlobsRing(object):
+    """A ring of preallocated SharedBlobsBuffer slots. A producer acquires a
+    free slot, builds (see SharedBlobsBuffer.empty) or writes a list of arrays
+    into it and passes the slot id and layout to a consumer, which reads the
+    arrays in place and then releases the slot. Slots can be acquired and
+    released from any process forked after the ring is created.
+    """
+
+    def __init__(self, num_slots, slot_capacity):
+        self.slots = [SharedBlobsBuffer(slot_capacity) for _ in range(num_slots)]
+        self._free_slots = multiprocessing.Queue()
+        for slot_id in range(num_slots):
+            self._free_slots.put(slot_id)
+
+    def get(self, block=True, timeout=None):
+        """Acquire a free slot id. Raises Queue.Empty on timeout."""
+        return self._free_slots.get(block, timeout)
+
+    def release(self, slot_id):
+        self._free_slots.put(slot_id)
+
+    def empty(self, slot_id, shape, dtype):
+        return self.slots[slot_id].empty(shape, dtype)
+
+    def write(self, slot_id, arrays):
+        return self.slots[slot_id].write(arrays)
+
+    def clear(self, slot_id):
+        self.slots[slot_id].clear()
+
+    def read(self, slot_id, layout, copy=False):
+        return self.slots[slot_id].read(layout, copy=copy)
+
+
+def _aligned(nbytes):
+    return (nbytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
@@ -43,7 +43,13 @@ class Timer(object):
         self.start_time = time.time()
 
     def toc(self, average=True):
-        self.diff = time.time() - self.start_time
+        return self.add(time.time() - self.start_time, average=average)
+
+    def add(self, diff, average=True):
+        """Record a duration that was measured elsewhere (e.g., by another
+        thread).
+        """
+        self.diff = diff
         self.total_time += self.diff
         self.calls += 1
         self.average_time = self.total_time / self.calls
@@ -28,6 +28,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import cPickle as pickle
 import cv2  # NOQA (Must import before importing caffe2 due to bug in cv2)
 import logging
 import numpy as np
@@ -42,6 +43,7 @@ from detectron.core.config import get_output_dir
 from detectron.datasets.roidb import combined_roidb_for_training
 from detectron.modeling import model_builder
 from detectron.utils import lr_policy
+from detectron.utils.io import save_object
 from detectron.utils.training_stats import TrainingStats
 import detectron.utils.env as envu
 import detectron.utils.net as nu
@@ -74,6 +76,12 @@ def train_model():
                 output_dir, 'model_iter{}.pkl'.format(cur_iter)
             )
             nu.save_model_to_weights_file(checkpoints[cur_iter], model)
+            # Save the state of the minibatch stream for resuming from the
+            # checkpoint
+            save_object(
+                model.roi_data_loader.get_state(cur_iter + 1 - start_iter),
+                get_loader_state_file(output_dir, cur_iter)
+            )
 
         if cur_iter == start_iter + training_stats.LOG_PERIOD:
             # Reset the iteration timer to remove outliers from the first few
@@ -134,9 +142,31 @@ def create_model():
         optimize_memory(model)
     # Performs random weight initialization as defined by the model
     workspace.RunNetOnce(model.param_init_net)
+
+    if start_iter > 0:
+        loader_state_file = get_loader_state_file(output_dir, start_iter - 1)
+        if os.path.exists(loader_state_file):
+            logger.info(
+                'Resuming the data loader from {}'.format(loader_state_file)
+            )
+            with open(loader_state_file, 'rb') as f:
+                model.roi_data_loader_state = pickle.load(f)
+        else:
+            logger.info(
+                'No data loader state found; starting a new minibatch stream'
+            )
     return model, weights_file, start_iter, checkpoints, output_dir
 
 
+def get_loader_state_file(output_dir, checkpoint_iter):
+    """Return the path of the data loader state saved along with the model
+    checkpoint of the given iteration.
+    """
+    return os.path.join(
+        output_dir, 'loader_state_iter{}.pkl'.format(checkpoint_iter)
+    )
+
+
 def optimize_memory(model):
     """Save GPU memory through blob sharing."""
     for device in range(cfg.NUM_GPUS):
@@ -155,6 +185,8 @@ def setup_model_for_training(model, weights_file, output_dir):
     """Loaded saved weights and create the network in the C2 workspace."""
     logger = logging.getLogger(__name__)
     add_model_training_inputs(model)
+    if model.roi_data_loader_state is not None:
+        model.roi_data_loader.set_state(model.roi_data_loader_state)
 
     if weights_file:
         # Override random weight initialization with weights from a saved model
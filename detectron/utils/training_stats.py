@@ -109,4 +109,9 @@ class TrainingStats(object):
         )
         for k, v in self.smoothed_losses_and_metrics.items():
             stats[k] = v.GetMedianValue()
+        # Stats of the construction of minibatches (e.g., pad_fraction)
+        stats.update(self.model.roi_data_loader.get_minibatch_stats())
+        if cfg.DATA_LOADER.AUTOSCALE:
+            stats['num_loaders'] = \
+                self.model.roi_data_loader.get_num_active_loaders()
         return stats
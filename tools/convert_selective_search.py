@@ -17,6 +17,12 @@
 
 """Script to convert Selective Search proposal boxes into the Detectron proposal
 file format.
+
+Usage: convert_selective_search.py dataset_name file_in file_out
+
+If file_out does not end with .pkl, the proposals are saved in the mapped
+proposal format (see detectron/datasets/mapped_proposals.py) in the directory
+file_out.
 """
 
 from __future__ import absolute_import
@@ -30,6 +36,7 @@ import scipy.io as sio
 import sys
 
 from detectron.datasets.json_dataset import JsonDataset
+from detectron.datasets.mapped_proposals import save_mapped_proposals
 
 if __name__ == '__main__':
     dataset_name = sys.argv[1]
@@ -53,8 +60,11 @@ if __name__ == '__main__':
         scores.append(np.zeros((i_boxes.shape[0]), dtype=np.float32))
         ids.append(roidb[i]['id'])
 
-    with open(file_out, 'wb') as f:
-        pickle.dump(
-            dict(boxes=boxes, scores=scores, indexes=ids), f,
-            pickle.HIGHEST_PROTOCOL
-        )
+    if file_out.endswith('.pkl'):
+        with open(file_out, 'wb') as f:
+            pickle.dump(
+                dict(boxes=boxes, scores=scores, indexes=ids), f,
+                pickle.HIGHEST_PROTOCOL
+            )
+    else:
+        save_mapped_proposals(boxes, scores, ids, file_out)
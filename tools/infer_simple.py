@@ -102,23 +102,26 @@ def main(args):
     dummy_coco_dataset = dummy_datasets.get_coco_dataset()
 
     if os.path.isdir(args.im_or_folder):
-        im_list = glob.iglob(args.im_or_folder + '/*.' + args.image_ext)
+        im_list = sorted(glob.glob(args.im_or_folder + '/*.' + args.image_ext))
     else:
         im_list = [args.im_or_folder]
 
-    for i, im_name in enumerate(im_list):
-        out_name = os.path.join(
-            args.output_dir, '{}'.format(os.path.basename(im_name) + '.pdf')
-        )
-        logger.info('Processing {} -> {}'.format(im_name, out_name))
-        im = cv2.imread(im_name)
+    # Images are run through the network TEST.IMS_PER_BATCH at a time
+    ims_per_batch = cfg.TEST.IMS_PER_BATCH
+    for i in range(0, len(im_list), ims_per_batch):
+        im_names = im_list[i:i + ims_per_batch]
+        ims = [cv2.imread(im_name) for im_name in im_names]
         timers = defaultdict(Timer)
         t = time.time()
         with c2_utils.NamedCudaScope(0):
-            cls_boxes, cls_segms, cls_keyps = infer_engine.im_detect_all(
-                model, im, None, timers=timers
+            results = infer_engine.im_detect_all_batch(
+                model, ims, timers=timers
+            )
+        logger.info(
+            'Inference time: {:.3f}s ({:d} images)'.format(
+                time.time() - t, len(ims)
             )
-        logger.info('Inference time: {:.3f}s'.format(time.time() - t))
+        )
         for k, v in timers.items():
             logger.info(' | {}: {:.3f}s'.format(k, v.average_time))
         if i == 0:
@@ -127,19 +130,25 @@ def main(args):
                 'rest (caches and auto-tuning need to warm up)'
             )
 
-        vis_utils.vis_one_image(
-            im[:, :, ::-1],  # BGR -> RGB for visualization
-            im_name,
-            args.output_dir,
-            cls_boxes,
-            cls_segms,
-            cls_keyps,
-            dataset=dummy_coco_dataset,
-            box_alpha=0.3,
-            show_class=True,
-            thresh=0.7,
-            kp_thresh=2
-        )
+        for im_name, im, im_results in zip(im_names, ims, results):
+            cls_boxes, cls_segms, cls_keyps = im_results
+            out_name = os.path.join(
+                args.output_dir, '{}'.format(os.path.basename(im_name) + '.pdf')
+            )
+            logger.info('Processing {} -> {}'.format(im_name, out_name))
+            vis_utils.vis_one_image(
+                im[:, :, ::-1],  # BGR -> RGB for visualization
+                im_name,
+                args.output_dir,
+                cls_boxes,
+                cls_segms,
+                cls_keyps,
+                dataset=dummy_coco_dataset,
+                box_alpha=0.3,
+                show_class=True,
+                thresh=0.7,
+                kp_thresh=2
+            )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,110 @@
+#!/usr/bin/env python2
+
+# Copyright (c) 2017-present, Facebook, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##############################################################################
+
+"""Pack the images of a dataset into large shard files with an index (see
+detectron/utils/image_shards.py).
+
+The encoded image files are copied as is, so images decoded from the shards
+are identical to images read from the original files. Images are packed in the
+order of their image ids, which is the order of the dataset's roidb, so that
+inference over the dataset reads the shards sequentially.
+
+To use the shards, add the printed 'image_shards' entry to the dataset in
+detectron/datasets/dataset_catalog.py.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import os
+import sys
+
+# Must happen before importing COCO API (which imports matplotlib)
+import detectron.utils.env as envu
+envu.set_up_matplotlib()
+# COCO API
+from detectron.pycocotools.coco import COCO
+
+from detectron.utils.image_shards import ImageShardWriter
+import detectron.datasets.dataset_catalog as dataset_catalog
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Pack the images of a dataset into shard files'
+    )
+    parser.add_argument(
+        '--dataset',
+        dest='dataset',
+        help='dataset name (as in detectron/datasets/dataset_catalog.py)',
+        required=True,
+        type=str
+    )
+    parser.add_argument(
+        '--output-dir',
+        dest='output_dir',
+        help='directory for the shards and the index',
+        required=True,
+        type=str
+    )
+    parser.add_argument(
+        '--shard-size',
+        dest='shard_size',
+        help='maximum shard size in MB',
+        default=1024,
+        type=int
+    )
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+    return parser.parse_args()
+
+
+def pack_image_shards(dataset_name, output_dir, shard_size_mb):
+    im_dir = dataset_catalog.get_im_dir(dataset_name)
+    im_prefix = dataset_catalog.get_im_prefix(dataset_name)
+    coco = COCO(dataset_catalog.get_ann_fn(dataset_name))
+    image_ids = sorted(coco.getImgIds())
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    writer = ImageShardWriter(
+        output_dir, dataset_name, max_shard_bytes=shard_size_mb * 1024**2
+    )
+    for i, image_id in enumerate(image_ids):
+        im_file = im_prefix + coco.imgs[image_id]['file_name']
+        with open(os.path.join(im_dir, im_file), 'rb') as f:
+            writer.add(im_file, f.read())
+        if i % 1000 == 0:
+            print('{}/{}'.format(i + 1, len(image_ids)))
+    return writer.close()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    index_file = pack_image_shards(
+        args.dataset, args.output_dir, args.shard_size
+    )
+    print('Wrote image shard index: {}'.format(index_file))
+    print(
+        'Add this entry to the \'{}\' dataset in dataset_catalog.py:\n'
+        '    \'image_shards\': \'{}\''.format(
+            args.dataset, os.path.abspath(index_file)
+        )
+    )
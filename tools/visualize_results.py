@@ -30,6 +30,7 @@ import sys
 
 from detectron.core.config import cfg
 from detectron.datasets.json_dataset import JsonDataset
+import detectron.utils.image as image_utils
 import detectron.utils.vis as vis_utils
 
 # OpenCL may be enabled by default in OpenCV3; disable it because it's not
@@ -114,7 +115,7 @@ def vis(dataset, detections_pkl, thresh, output_dir, limit=0, ext='pdf'):
         if ix % 10 == 0:
             print('{:d}/{:d}'.format(ix + 1, len(roidb)))
 
-        im = cv2.imread(entry['image'])
+        im = image_utils.read_image(entry['image'])
         im_name = os.path.splitext(os.path.basename(entry['image']))[0]
 
         cls_boxes_i = [